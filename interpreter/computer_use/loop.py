@@ -35,6 +35,7 @@ from anthropic.types.beta import (
     BetaToolResultBlockParam,
 )
 
+from ..core.llm.utils.merge_deltas import StringAccumulator
 from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
 
 BETA_FLAG = "computer-use-2024-10-22"
@@ -161,6 +162,7 @@ async def sampling_loop(
 
         response_content = []
         current_block = None
+        partial_json = None
 
         for chunk in raw_response:
             if isinstance(chunk, BetaRawContentBlockStartEvent):
@@ -175,17 +177,17 @@ async def sampling_loop(
                 elif chunk.delta.type == "input_json_delta":
                     print(f"{chunk.delta.partial_json}", end="", flush=True)
                     if current_block and current_block.type == "tool_use":
-                        if not hasattr(current_block, "partial_json"):
-                            current_block.partial_json = ""
-                        current_block.partial_json += chunk.delta.partial_json
+                        if partial_json is None:
+                            partial_json = StringAccumulator()
+                        partial_json.append(chunk.delta.partial_json)
             elif isinstance(chunk, BetaRawContentBlockStopEvent):
                 if current_block:
-                    if hasattr(current_block, "partial_json"):
+                    if partial_json is not None:
                         # Finished a tool call
                         # print()
-                        current_block.input = json.loads(current_block.partial_json)
+                        current_block.input = json.loads(str(partial_json))
                         # yield {"type": "chunk", "chunk": current_block.input}
-                        delattr(current_block, "partial_json")
+                        partial_json = None
                     else:
                         # Finished a message
                         print("\n")
@@ -15,6 +15,7 @@ from pydantic import BaseModel
 from starlette.websockets import WebSocketState
 
 from .core import OpenInterpreter
+from .utils.coalesce_chunks import coalesce_chunks
 
 last_start_time = 0
 
@@ -57,6 +58,10 @@ class AsyncInterpreter(OpenInterpreter):
         )
         self.acknowledged_outputs = []
 
+        # Merge adjacent chunks of the same message before sending them (see `chat(coalesce_ms=...)`)
+        self.coalesce_ms = float(os.getenv("INTERPRETER_COALESCE_MS", 0)) or None
+        self.coalesce_bytes = int(os.getenv("INTERPRETER_COALESCE_BYTES", 0)) or None
+
         self.server = Server(self)
 
         # For the 01. This lets the OAI compatible server accumulate context before responding.
@@ -84,7 +89,7 @@ class AsyncInterpreter(OpenInterpreter):
             # But first, process any commands.
             if self.messages[-1].get("type") == "command":
                 command = self.messages[-1]["content"]
-                self.messages = self.messages[:-1]
+                self.messages.pop()
 
                 if command == "stop":
                     # Any start flag would have stopped it a moment ago, but to be sure:
@@ -115,7 +120,9 @@ class AsyncInterpreter(OpenInterpreter):
 
                 sent_chunks = False
 
-                for chunk_og in self._respond_and_store():
+                for chunk_og in coalesce_chunks(
+                    self._respond_and_store(), self.coalesce_ms, self.coalesce_bytes
+                ):
                     chunk = (
                         chunk_og.copy()
                     )  # This fixes weird double token chunks. Probably a deeper problem?
@@ -726,7 +733,13 @@ def create_router(async_interpreter):
     async def openai_compatible_generator(run_code):
         if run_code:
             print("Running code.\n")
-            for i, chunk in enumerate(async_interpreter._respond_and_store()):
+            for i, chunk in enumerate(
+                coalesce_chunks(
+                    async_interpreter._respond_and_store(),
+                    async_interpreter.coalesce_ms,
+                    async_interpreter.coalesce_bytes,
+                )
+            ):
                 if "content" in chunk:
                     print(chunk["content"], end="")  # Sorry! Shitty display for now
                 if "start" in chunk:
@@ -902,7 +915,7 @@ def create_router(async_interpreter):
                 if last_message.content == "{START}":
                     if async_interpreter.messages[-1]["content"] == "{START}":
                         # Remove that {START} message that would have just been added
-                        async_interpreter.messages = async_interpreter.messages[:-1]
+                        async_interpreter.messages.pop()
                     last_start_time = time.time()
                     if (
                         async_interpreter.messages
@@ -923,7 +936,7 @@ def create_router(async_interpreter):
                 if last_message.content == "{START}":
                     # This just sometimes happens I guess
                     # Remove that {START} message that would have just been added
-                    async_interpreter.messages = async_interpreter.messages[:-1]
+                    async_interpreter.messages.pop()
                     return
 
         async_interpreter.stop_event.set()
@@ -18,9 +18,13 @@ from .sms.sms import SMS
 from .terminal.terminal import Terminal
 from .vision.vision import Vision
 
+# Never synced between the interpreter's computer and the one inside the Python kernel
+UNSYNCED_ATTRIBUTES = {"_hashes", "system_message", "_dirty"}
+
 
 class Computer:
     def __init__(self, interpreter):
+        self._dirty = set()  # Attributes set since the last sync
         self.interpreter = interpreter
 
         self.terminal = Terminal(self)
@@ -235,3 +239,51 @@ Do not import the computer module, or any of its sub-modules. They are already i
         for key, value in data_dict.items():
             if hasattr(self, key):
                 setattr(self, key, value)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        dirty = self.__dict__.get("_dirty")
+        if dirty is not None:
+            dirty.add(name)
+
+    def changes_since(self, synced):
+        """
+        Returns the JSON-serializable attributes that differ from `synced` (attribute -> the JSON
+        we last sent or received), and updates `synced` to match.
+
+        Only attributes that were set since the last call (plus lists and dicts, which can change
+        without being set) are serialized and compared.
+        """
+        dirty = self.__dict__["_dirty"]
+        changes = {}
+        for key, value in list(self.__dict__.items()):
+            if key in UNSYNCED_ATTRIBUTES:
+                continue
+            if (
+                key in synced
+                and key not in dirty
+                and not isinstance(value, (list, dict))
+            ):
+                continue
+            try:
+                encoded = json.dumps(value)
+            except:
+                synced[
+                    key
+                ] = None  # Can't be synced, so don't try again unless it's set
+                continue
+            if synced.get(key) != encoded:
+                synced[key] = encoded
+                changes[key] = value
+        dirty.clear()
+        return changes
+
+    def apply_changes(self, changes, synced):
+        """
+        Sets the attributes in `changes` (from `changes_since` on the other computer), and records
+        them in `synced` so they aren't sent back.
+        """
+        for key, value in changes.items():
+            if hasattr(self, key) and key not in UNSYNCED_ATTRIBUTES:
+                setattr(self, key, value)
+                synced[key] = json.dumps(value)
@@ -0,0 +1,196 @@
+"""
+A process that imports ipykernel and the modules we want kernels to start with, once, then forks
+a copy of itself for each kernel we ask for. The copies share the parent's memory until they
+write to it, so a new kernel takes milliseconds and the heavy modules are only in memory once.
+
+Run by ForkServer, as a script, so none of interpreter's own imports end up in every kernel.
+Only works where there's os.fork.
+"""
+
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+
+class ForkServer:
+    """
+    Starts the fork server process and asks it for kernels.
+    """
+
+    def __init__(self, preload=()):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), json.dumps(list(preload))],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self._lock = threading.Lock()
+        # Once it's imported everything
+        reply = self.process.stdout.readline()
+        if not reply:
+            raise RuntimeError("The kernel fork server exited while starting.")
+
+    def start_kernel(self):
+        """
+        Forks a kernel. Returns a ForkedKernelManager for it.
+        """
+        from jupyter_client.connect import write_connection_file
+        from jupyter_core.paths import jupyter_runtime_dir
+
+        os.makedirs(jupyter_runtime_dir(), exist_ok=True)
+        connection_file, connection_info = write_connection_file(
+            os.path.join(jupyter_runtime_dir(), f"kernel-{uuid.uuid4()}.json")
+        )
+        request = {
+            "connection_file": connection_file,
+            # What a kernel we started ourselves would have had
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+        }
+        with self._lock:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        if not reply:
+            raise RuntimeError("The kernel fork server has exited.")
+        reply = json.loads(reply)
+        if "error" in reply:
+            raise RuntimeError(f"Couldn't fork a kernel: {reply['error']}")
+        return ForkedKernelManager(reply["pid"], connection_file, connection_info)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        # It exits when its stdin does. Kernels it forked exit when they notice it's gone
+        try:
+            self.process.stdin.close()
+        except:
+            pass
+
+
+class ForkedKernelManager:
+    """
+    Stands in for a jupyter_client KernelManager, for a kernel the fork server started.
+    Has the parts of its interface that the Python language uses.
+    """
+
+    def __init__(self, pid, connection_file, connection_info):
+        self.pid = pid
+        self.connection_file = connection_file
+        self.connection_info = connection_info
+
+    def client(self):
+        from jupyter_client import BlockingKernelClient
+
+        kc = BlockingKernelClient()
+        kc.load_connection_info(self.connection_info)
+        return kc
+
+    def is_alive(self):
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except OSError:
+            return False
+
+    def interrupt_kernel(self):
+        self._signal(signal.SIGINT)
+
+    def shutdown_kernel(self, now=False):
+        if not now:
+            self._signal(signal.SIGTERM)
+            deadline = time.time() + 5
+            while self.is_alive() and time.time() < deadline:
+                time.sleep(0.1)
+        if self.is_alive():
+            self._signal(signal.SIGKILL)
+        try:
+            os.remove(self.connection_file)
+        except OSError:
+            pass
+
+    def _signal(self, signum):
+        # Like KernelManager, signal the kernel's whole process group (anything it started, too)
+        try:
+            os.killpg(self.pid, signum)
+        except OSError:
+            try:
+                os.kill(self.pid, signum)
+            except OSError:
+                pass
+
+
+def serve(preload):
+    # Kernels we fork are reaped for us
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+    from ipykernel.kernelapp import IPKernelApp
+
+    for module in preload:
+        try:
+            __import__(module)
+        except Exception:
+            pass
+
+    _reply({"ready": True})
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            pid = os.fork()
+        except OSError as e:
+            _reply({"error": str(e)})
+            continue
+
+        if pid == 0:
+            try:
+                _become_kernel(IPKernelApp, request)
+            finally:
+                os._exit(0)
+
+        _reply({"pid": pid})
+
+
+def _become_kernel(IPKernelApp, request):
+    # Set up like jupyter_client would have started us: our own session (so Ctrl-C in the
+    # terminal doesn't reach us), default signal handling, and its directory and environment
+    os.setsid()
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)  # Not the pipe we talk to the interpreter on
+    os.close(devnull)
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+
+    # Don't generate the same random numbers as every other kernel
+    import random
+
+    random.seed()
+    if "numpy.random" in sys.modules:
+        sys.modules["numpy.random"].seed()
+
+    app = IPKernelApp.instance()
+    app.parent_handle = os.getppid()  # So it exits if we do
+    app.initialize(["-f", request["connection_file"]])
+    app.start()
+
+
+def _reply(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    # Our own directory is on the path when run as a script, and html.py in it would shadow the
+    # standard library's html in every kernel. Put the working directory there instead, like -m would
+    sys.path[0] = os.getcwd()
+    serve(json.loads(sys.argv[1]))
@@ -0,0 +1,201 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+os.environ["LITELLM_LOCAL_MODEL_COST_MAP"] = "True"
+import litellm
+
+SYSTEM_MESSAGE = "You are an expert programming assistant. You will help the user determine if they should enter input into the terminal, per the user's requests. If you think the user would want you to type something into stdin, enclose it in <input></input> XML tags, like <input>y</input> to type 'y'."
+
+# Last lines of output that look like the program is asking for something
+PROMPT_PATTERN = re.compile(
+    r"[:?>\]\)]\s*$|\b(y/n|yes/no|\[y|password|passphrase|press|enter|continue|proceed|confirm)\b",
+    re.IGNORECASE,
+)
+
+
+class InputWatchdog:
+    """
+    Watches the code that's running, and when it's been quiet for a while, asks the LLM whether
+    it's waiting for input (and what to type). This happens in its own thread, so output keeps
+    flowing while the LLM thinks, and the LLM only sees the code and its last few lines of
+    output, not the whole conversation.
+
+    The first check is `patience` seconds after the last output, and each check after that waits
+    twice as long (up to `max_interval`), until there's more output. Checks are skipped when the
+    last line of output doesn't look like a prompt (a training run printing its progress, say),
+    unless nothing at all has been printed for `frozen_after` seconds.
+    """
+
+    def __init__(
+        self,
+        interpreter,
+        send_input,
+        interrupt,
+        patience=None,
+        max_interval=600,
+        context_lines=20,
+        frozen_after=500,
+    ):
+        self.interpreter = interpreter
+        self.send_input = send_input
+        self.interrupt = interrupt
+        self.patience = (
+            int(os.environ.get("INTERPRETER_TERMINAL_INPUT_PATIENCE", 15))
+            if patience is None
+            else patience
+        )
+        self.max_interval = max_interval
+        self.context_lines = context_lines
+        self.context_chars = 4000
+        self.frozen_after = frozen_after
+
+        self._watch = None  # The running code's _Watch
+        self._condition = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def watch(self, code):
+        """
+        Starts watching newly started code (and stops watching anything else).
+        """
+        with self._condition:
+            self._watch = _Watch(code, self.context_lines, self.patience)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def output(self, text):
+        """
+        Tells the watchdog the code printed something.
+        """
+        watch = self._watch
+        if watch is not None:
+            watch.output(text, self.patience)
+
+    def cancel(self):
+        """
+        Stops watching. A check that's already asking the LLM is ignored.
+        """
+        with self._condition:
+            self._watch = None
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._watch = None
+            self._closed = True
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    watch = self._watch
+                    if watch is not None:
+                        wait = watch.due() - time.time()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._condition.wait(wait)
+                watch.checked(self.max_interval)
+
+            try:
+                self._check(watch)
+            except Exception as e:
+                if self.interpreter.verbose:
+                    print("Input watchdog error:", e)
+
+    def _check(self, watch):
+        quiet = time.time() - watch.last_output
+        lines = list(watch.lines)
+        frozen = quiet > self.frozen_after
+        if lines and not frozen and not PROMPT_PATTERN.search(lines[-1]):
+            return
+
+        response = self._ask(watch, lines, quiet, frozen)
+        if response is None or watch is not self._watch:
+            return
+
+        input_match = re.search(r"<input>(.*?)</input>", response)
+        if input_match:
+            user_input = input_match.group(1)
+            if user_input.upper() == "CTRL-C":
+                self.interrupt()
+            else:
+                self.send_input(user_input)
+
+    def _ask(self, watch, lines, quiet, frozen):
+        code = watch.code[-self.context_chars :]
+        output = "".join(lines)[-self.context_chars :]
+        text = f"This code is running:\n\n```\n{code}\n```\n\n"
+        if output:
+            text += f"These are the last lines it printed:\n\n```\n{output}\n```\n\n"
+        else:
+            text += "It hasn't printed anything.\n\n"
+        text += f"It has been {int(quiet)} seconds since it last printed anything. It might require user input. Are there keystrokes that the user should type in, to proceed after the last command?"
+        if frozen:
+            text += " If you think the process is frozen, or that the user wouldn't expect it to run for this long, then say <input>CTRL-C</input>."
+
+        llm = self.interpreter.llm
+        params = {
+            "messages": [
+                {"role": "system", "content": SYSTEM_MESSAGE},
+                {"role": "user", "content": text},
+            ],
+            "model": llm.model,
+            "stream": True,
+            "temperature": 0,
+        }
+        if llm.api_key:
+            params["api_key"] = llm.api_key
+        if llm.api_base:
+            params["api_base"] = llm.api_base
+
+        response = ""
+        for chunk in litellm.completion(**params):
+            if watch is not self._watch:
+                # Cancelled, or the code finished
+                return None
+            content = chunk.choices[0].delta.content
+            if type(content) == str:
+                response += content
+        return response
+
+
+class _Watch:
+    """
+    What the watchdog knows about the code that's running.
+    """
+
+    def __init__(self, code, context_lines, patience):
+        self.code = code
+        self.lines = deque(maxlen=context_lines)
+        self.last_output = time.time()
+        self.last_check = 0
+        self.interval = patience
+
+    def output(self, text, patience):
+        # Called from the dispatcher thread. Each of these is a single assignment or deque
+        # operation, so the watchdog thread never sees them half done
+        if text:
+            for line in text.splitlines(keepends=True):
+                if self.lines and not self.lines[-1].endswith("\n"):
+                    self.lines[-1] += line
+                else:
+                    self.lines.append(line)
+        self.interval = patience
+        self.last_output = time.time()
+
+    def due(self):
+        return max(self.last_output, self.last_check) + self.interval
+
+    def checked(self, max_interval):
+        self.last_check = time.time()
+        self.interval = min(self.interval * 2, max_interval)
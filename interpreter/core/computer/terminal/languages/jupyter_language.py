@@ -12,12 +12,11 @@ import sys
 import threading
 import time
 import traceback
-
-os.environ["LITELLM_LOCAL_MODEL_COST_MAP"] = "True"
-import litellm
-from jupyter_client import KernelManager
+import uuid
 
 from ..base_language import BaseLanguage
+from .input_watchdog import InputWatchdog
+from .kernel_pool import kernel_pool
 
 DEBUG_MODE = False
 
@@ -33,6 +32,63 @@ if "ipykernel_launcher" in sys.argv:
     sys.exit(0)
 
 
+# Runs once in the kernel, so the `computer` in there can be synced over a comm instead of by running code.
+# Changes from us are applied as they arrive (before the next cell runs), and the kernel sends its own
+# changes after every cell, if there are any.
+COMPUTER_SYNC_CODE = """
+def _setup_computer_sync():
+    from IPython import get_ipython
+
+    ipython = get_ipython()
+    synced = {}  # The interpreter's computer, as far as we know (attribute -> JSON)
+    pending = {}  # Changes that arrived before `computer` was imported
+    comms = []
+    caught_up = []
+
+    def get_computer():
+        computer = ipython.user_ns.get("computer")
+        if hasattr(computer, "changes_since"):
+            return computer
+
+    def catch_up(computer):
+        computer.apply_changes(pending, synced)
+        pending.clear()
+        if not caught_up:
+            # Everything else it has is new to the interpreter's computer, but not a change
+            computer.changes_since(synced)
+            caught_up.append(True)
+
+    def receive(msg):
+        pending.update(msg["content"]["data"].get("changes", {}))
+        computer = get_computer()
+        if computer is not None:
+            catch_up(computer)
+
+    def open_comm(comm, msg):
+        comms[:] = [comm]
+        comm.on_msg(receive)
+        receive(msg)
+
+    def send_changes(*args):
+        computer = get_computer()
+        if computer is None or not comms:
+            return
+        if not caught_up:
+            catch_up(computer)
+            return
+        changes = computer.changes_since(synced)
+        if changes:
+            comms[0].send({"changes": changes})
+
+    ipython.kernel.comm_manager.register_target("interpreter_computer", open_comm)
+    ipython.events.register("post_run_cell", send_changes)
+
+
+_setup_computer_sync()
+del _setup_computer_sync
+""".strip()
+
+
 class JupyterLanguage(BaseLanguage):
     file_extension = "py"
     name = "Python"
@@ -41,38 +97,34 @@ class JupyterLanguage(BaseLanguage):
     def __init__(self, computer):
         self.computer = computer
 
-        self.km = KernelManager(kernel_name="python3")
-        self.km.start_kernel()
-        self.kc = self.km.client()
-        self.kc.start_channels()
-        while not self.kc.is_alive():
-            time.sleep(0.1)
-        time.sleep(0.5)
+        # Already started and set up (with %matplotlib inline), usually in the background
+        self.km, self.kc = kernel_pool.get()
 
-        self.listener_thread = None
         self.finish_flag = False
 
-        # DISABLED because sometimes this bypasses sending it up to us for some reason!
-        # Give it our same matplotlib backend
-        # backend = matplotlib.get_backend()
-
-        # Use Agg, which bubbles everything up as an image.
-        # Not perfect (I want interactive!) but it works.
-        backend = "Agg"
-
-        code = f"""
-import matplotlib
-matplotlib.use('{backend}')
-        """.strip()
-
-        # Use Inline actually, it's better I think
-        code = """
-%matplotlib inline
-import matplotlib.pyplot as plt
-""".strip()
+        # Asks the LLM whether quiet code is waiting for input, in the background
+        self.input_watchdog = InputWatchdog(
+            computer.interpreter, send_input=self.kc.input, interrupt=self.stop
+        )
 
-        for _ in self.run(code):
-            pass
+        # For syncing our computer with the `computer` inside the kernel
+        self._computer_comm_id = None
+        self._computer_synced = {}  # Our computer, as the kernel last saw it
+        self._computer_changes = {}  # From the kernel's computer, not yet applied
+        self._computer_lock = threading.Lock()
+
+        # One thread reads everything the kernel publishes, and hands each message to the queue
+        # of the execution it's about (by the msg_id of the request that caused it)
+        self._executions = {}  # msg_id -> queue of LMC chunks, ended by None
+        self._interrupted = {}  # msg_id -> Event, set once a stopped execution is idle
+        self._executions_lock = threading.Lock()
+        self._current_execution = None
+        self._current_msg_id = None
+        # How long stop() waits for the kernel to finish with an interrupted execution
+        self.interrupt_timeout = 5
+        self._closing = False
+        self._dispatcher = threading.Thread(target=self._dispatch_iopub, daemon=True)
+        self._dispatcher.start()
 
         # DISABLED because it doesn't work??
         # Disable color outputs in the terminal, which don't look good in OI and aren't useful
@@ -83,16 +135,49 @@ import matplotlib.pyplot as plt
         # self.run(code)
 
     def terminate(self):
-        self.kc.stop_channels()
-        self.km.shutdown_kernel()
+        self._closing = True
+        self.input_watchdog.close()
+        # Shut down in the background, once the dispatcher has noticed
+        kernel_pool.recycle(self.km, self.kc, before=self._dispatcher.join)
+
+    def sync_computer(self):
+        """
+        Applies what the kernel's `computer` changed during the last run to our computer,
+        then sends it whatever changed on ours. Only changed attributes are sent, over a comm,
+        so (after setting that up once) no code is run, and nothing happens if nothing changed.
+        """
+        with self._computer_lock:
+            changes, self._computer_changes = self._computer_changes, {}
+        if changes:
+            self.computer.apply_changes(changes, self._computer_synced)
+
+        changes = self.computer.changes_since(self._computer_synced)
+
+        if self._computer_comm_id is None:
+            for _ in self.run(COMPUTER_SYNC_CODE):
+                pass
+            self._computer_comm_id = uuid.uuid4().hex
+            self._send_to_kernel(
+                "comm_open",
+                {
+                    "comm_id": self._computer_comm_id,
+                    "target_name": "interpreter_computer",
+                    "data": {"changes": changes},
+                },
+            )
+        elif changes:
+            self._send_to_kernel(
+                "comm_msg",
+                {"comm_id": self._computer_comm_id, "data": {"changes": changes}},
+            )
+
+    def _send_to_kernel(self, msg_type, content):
+        self.kc.shell_channel.send(self.kc.session.msg(msg_type, content))
 
     def run(self, code):
         while not self.kc.is_alive():
             time.sleep(0.1)
 
-        self.last_output_time = time.time()
-        self.last_output_message_time = time.time()
-
         ################################################################
         ### OFFICIAL OPEN INTERPRETER GOVERNMENT ISSUE SKILL LIBRARY ###
         ################################################################
@@ -122,6 +207,7 @@ import matplotlib.pyplot as plt
                 # Also, for python, you don't need them! It's just for active_line and stuff. Just looks pretty.
                 preprocessed_code = code
             message_queue = queue.Queue()
+            self.input_watchdog.watch(code)
             self._execute_code(preprocessed_code, message_queue)
             yield from self._capture_output(message_queue)
         except GeneratorExit:
@@ -131,177 +217,143 @@ import matplotlib.pyplot as plt
             yield {"type": "console", "format": "output", "content": content}
 
     def _execute_code(self, code, message_queue):
-        def iopub_message_listener():
-            max_retries = 100
-            while True:
-                # If self.finish_flag = True, and we didn't set it (we do below), we need to stop. That's our "stop"
-                if self.finish_flag == True:
-                    if DEBUG_MODE:
-                        print("interrupting kernel!!!!!")
-                    self.km.interrupt_kernel()
-                    return
-                # For async usage
-                if (
-                    hasattr(self.computer.interpreter, "stop_event")
-                    and self.computer.interpreter.stop_event.is_set()
-                ):
-                    self.km.interrupt_kernel()
-                    self.finish_flag = True
+        with self._executions_lock:
+            # Registered before the dispatcher can route anything about it (it waits for the lock)
+            msg_id = self.kc.execute(code)
+            self._executions[msg_id] = message_queue
+        self._current_msg_id = msg_id
+        self._current_execution = message_queue
+
+    def _dispatch_iopub(self):
+        """
+        Runs for as long as the kernel does. Turns iopub messages into LMC chunks for the execution
+        they belong to, ends that execution as soon as the kernel says it's idle, and keeps
+        the changes the kernel's `computer` sends us.
+        """
+        max_retries = 100
+        while not self._closing:
+            try:
+                # The timeout is only so this notices when we're closing
+                msg = self.kc.iopub_channel.get_msg(timeout=1)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                if self._closing:
                     return
-                try:
-                    input_patience = int(
-                        os.environ.get("INTERPRETER_TERMINAL_INPUT_PATIENCE", 15)
-                    )
-                    if (
-                        time.time() - self.last_output_time > input_patience
-                        and time.time() - self.last_output_message_time > input_patience
-                    ):
-                        self.last_output_message_time = time.time()
-
-                        text = f"{self.computer.interpreter.messages}\n\nThe program above has been running for over 15 seconds. It might require user input. Are there keystrokes that the user should type in, to proceed after the last command?"
-                        if time.time() - self.last_output_time > 500:
-                            text += f" If you think the process is frozen, or that the user wasn't expect it to run for this long (it has been {time.time() - self.last_output_time} seconds since last output) then say <input>CTRL-C</input>."
-
-                        messages = [
-                            {
-                                "role": "system",
-                                "type": "message",
-                                "content": "You are an expert programming assistant. You will help the user determine if they should enter input into the terminal, per the user's requests. If you think the user would want you to type something into stdin, enclose it in <input></input> XML tags, like <input>y</input> to type 'y'.",
-                            },
-                            {"role": "user", "type": "message", "content": text},
-                        ]
-                        params = {
-                            "messages": messages,
-                            "model": self.computer.interpreter.llm.model,
-                            "stream": True,
-                            "temperature": 0,
-                        }
-                        if self.computer.interpreter.llm.api_key:
-                            params["api_key"] = self.computer.interpreter.llm.api_key
-
-                        response = ""
-                        for chunk in litellm.completion(**params):
-                            content = chunk.choices[0].delta.content
-                            if type(content) == str:
-                                response += content
-
-                        # Parse the response for input tags
-                        input_match = re.search(r"<input>(.*?)</input>", response)
-                        if input_match:
-                            user_input = input_match.group(1)
-                            # Check if the user input is CTRL-C
-                            self.finish_flag = True
-                            if user_input.upper() == "CTRL-C":
-                                self.finish_flag = True
-                            else:
-                                self.kc.input(user_input)
-
-                    msg = self.kc.iopub_channel.get_msg(timeout=0.05)
-                    self.last_output_time = time.time()
-                except queue.Empty:
-                    continue
-                except Exception as e:
-                    max_retries -= 1
-                    if max_retries < 0:
-                        raise
-                    print("Jupyter error, retrying:", str(e))
-                    continue
+                max_retries -= 1
+                if max_retries < 0:
+                    raise
+                print("Jupyter error, retrying:", str(e))
+                continue
 
-                if DEBUG_MODE:
-                    print("-----------" * 10)
-                    print("Message received:", msg["content"])
-                    print("-----------" * 10)
-
-                if (
-                    msg["header"]["msg_type"] == "status"
-                    and msg["content"]["execution_state"] == "idle"
-                ):
-                    # Set finish_flag and return when the kernel becomes idle
-                    if DEBUG_MODE:
-                        print("from thread: kernel is idle")
-                    self.finish_flag = True
-                    return
+            if DEBUG_MODE:
+                print("-----------" * 10)
+                print("Message received:", msg["content"])
+                print("-----------" * 10)
 
-                content = msg["content"]
-
-                if msg["msg_type"] == "stream":
-                    line, active_line = self.detect_active_line(content["text"])
-                    if active_line:
-                        message_queue.put(
-                            {
-                                "type": "console",
-                                "format": "active_line",
-                                "content": active_line,
-                            }
-                        )
-                    message_queue.put(
-                        {"type": "console", "format": "output", "content": line}
-                    )
-                elif msg["msg_type"] == "error":
-                    content = "\n".join(content["traceback"])
-                    # Remove color codes
-                    ansi_escape = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
-                    content = ansi_escape.sub("", content)
-                    message_queue.put(
-                        {
-                            "type": "console",
-                            "format": "output",
-                            "content": content,
-                        }
+            if (
+                msg["msg_type"] == "comm_msg"
+                and msg["content"].get("comm_id") == self._computer_comm_id
+            ):
+                with self._computer_lock:
+                    self._computer_changes.update(
+                        msg["content"]["data"].get("changes", {})
                     )
-                elif msg["msg_type"] in ["display_data", "execute_result"]:
-                    data = content["data"]
-                    if "image/png" in data:
-                        message_queue.put(
-                            {
-                                "type": "image",
-                                "format": "base64.png",
-                                "content": data["image/png"],
-                            }
-                        )
-                    elif "image/jpeg" in data:
-                        message_queue.put(
-                            {
-                                "type": "image",
-                                "format": "base64.jpeg",
-                                "content": data["image/jpeg"],
-                            }
-                        )
-                    elif "text/html" in data:
-                        message_queue.put(
-                            {
-                                "type": "code",
-                                "format": "html",
-                                "content": data["text/html"],
-                            }
-                        )
-                    elif "text/plain" in data:
-                        message_queue.put(
-                            {
-                                "type": "console",
-                                "format": "output",
-                                "content": data["text/plain"],
-                            }
-                        )
-                    elif "application/javascript" in data:
-                        message_queue.put(
-                            {
-                                "type": "code",
-                                "format": "javascript",
-                                "content": data["application/javascript"],
-                            }
-                        )
-
-        self.listener_thread = threading.Thread(target=iopub_message_listener)
-        # self.listener_thread.daemon = True
-        self.listener_thread.start()
+                continue
 
-        if DEBUG_MODE:
-            print(
-                "thread is on:", self.listener_thread.is_alive(), self.listener_thread
+            msg_id = msg["parent_header"].get("msg_id")
+            idle = (
+                msg["header"]["msg_type"] == "status"
+                and msg["content"]["execution_state"] == "idle"
             )
 
-        self.kc.execute(code)
+            with self._executions_lock:
+                message_queue = self._executions.get(msg_id)
+                interrupted = self._interrupted.get(msg_id)
+                if idle and interrupted is not None:
+                    del self._interrupted[msg_id]
+
+            if interrupted is not None:
+                # Stopped, so nothing it says now (like its KeyboardInterrupt) is wanted
+                if idle:
+                    interrupted.set()
+                continue
+            if message_queue is None:
+                # About something else, like the kernel handling one of our comm messages
+                continue
+
+            if idle:
+                if DEBUG_MODE:
+                    print("from dispatcher: kernel is idle")
+                with self._executions_lock:
+                    del self._executions[msg_id]
+                message_queue.put(None)
+                continue
+
+            for chunk in self._message_to_chunks(msg):
+                if message_queue is self._current_execution:
+                    self.input_watchdog.output(
+                        chunk["content"] if chunk["format"] == "output" else ""
+                    )
+                message_queue.put(chunk)
+
+    def _message_to_chunks(self, msg):
+        content = msg["content"]
+
+        if msg["msg_type"] == "stream":
+            line, active_line = self.detect_active_line(content["text"])
+            chunks = []
+            if active_line:
+                chunks.append(
+                    {"type": "console", "format": "active_line", "content": active_line}
+                )
+            chunks.append({"type": "console", "format": "output", "content": line})
+            return chunks
+        elif msg["msg_type"] == "error":
+            content = "\n".join(content["traceback"])
+            # Remove color codes
+            ansi_escape = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
+            content = ansi_escape.sub("", content)
+            return [{"type": "console", "format": "output", "content": content}]
+        elif msg["msg_type"] in ["display_data", "execute_result"]:
+            data = content["data"]
+            if "image/png" in data:
+                return [
+                    {
+                        "type": "image",
+                        "format": "base64.png",
+                        "content": data["image/png"],
+                    }
+                ]
+            elif "image/jpeg" in data:
+                return [
+                    {
+                        "type": "image",
+                        "format": "base64.jpeg",
+                        "content": data["image/jpeg"],
+                    }
+                ]
+            elif "text/html" in data:
+                return [
+                    {"type": "code", "format": "html", "content": data["text/html"]}
+                ]
+            elif "text/plain" in data:
+                return [
+                    {
+                        "type": "console",
+                        "format": "output",
+                        "content": data["text/plain"],
+                    }
+                ]
+            elif "application/javascript" in data:
+                return [
+                    {
+                        "type": "code",
+                        "format": "javascript",
+                        "content": data["application/javascript"],
+                    }
+                ]
+        return []
 
     def detect_active_line(self, line):
         if "##active_line" in line:
@@ -318,40 +370,55 @@ import matplotlib.pyplot as plt
         return line, None
 
     def _capture_output(self, message_queue):
+        try:
+            yield from self._wait_for_output(message_queue)
+        finally:
+            self._current_execution = None
+            self.input_watchdog.cancel()
+
+    def _wait_for_output(self, message_queue):
+        async_usage = hasattr(self.computer.interpreter, "stop_event")
+        # Its stop_event can't wake us, so check it every so often
+        timeout = 0.1 if async_usage else None
         while True:
-            time.sleep(0.1)
+            try:
+                output = message_queue.get(timeout=timeout)
+            except queue.Empty:
+                if self.computer.interpreter.stop_event.is_set():
+                    self.stop()
+                    break
+                continue
 
-            # For async usage
-            if (
-                hasattr(self.computer.interpreter, "stop_event")
-                and self.computer.interpreter.stop_event.is_set()
-            ):
-                self.finish_flag = True
+            if output is None:
+                if DEBUG_MODE:
+                    print("we're done")
                 break
-
-            if self.listener_thread:
-                try:
-                    output = message_queue.get(timeout=0.1)
-                    if DEBUG_MODE:
-                        print(output)
-                    yield output
-
-                except queue.Empty:
-                    if self.finish_flag:
-                        time.sleep(0.1)
-
-                        try:
-                            output = message_queue.get(timeout=0.1)
-                            if DEBUG_MODE:
-                                print(output)
-                            yield output
-                        except queue.Empty:
-                            if DEBUG_MODE:
-                                print("we're done")
-                            break
+            if DEBUG_MODE:
+                print(output)
+            yield output
 
     def stop(self):
         self.finish_flag = True
+        message_queue = self._current_execution
+        if message_queue is None:
+            return
+
+        interrupted = threading.Event()
+        with self._executions_lock:
+            msg_id = self._current_msg_id
+            running = msg_id in self._executions
+            if running:
+                del self._executions[msg_id]
+                self._interrupted[msg_id] = interrupted
+
+        if running:
+            if DEBUG_MODE:
+                print("interrupting kernel!!!!!")
+            self.km.interrupt_kernel()
+            # The kernel aborts whatever we send it while it's still handling the interrupt
+            # (stop_on_error), which would silently drop the next run. So wait until it's done
+            interrupted.wait(self.interrupt_timeout)
+        message_queue.put(None)
 
     def preprocess_code(self, code):
         return preprocess_python(code)
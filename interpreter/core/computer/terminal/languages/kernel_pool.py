@@ -0,0 +1,189 @@
+import atexit
+import os
+import threading
+
+from jupyter_client import KernelManager
+
+from .fork_server import ForkServer
+
+# Run in every kernel before it's handed out
+SETUP_CODE = """
+%matplotlib inline
+import matplotlib.pyplot as plt
+""".strip()
+
+# Imports modules without adding anything to the kernel's namespace
+PRELOAD_CODE = """
+for _module in {modules!r}:
+    try:
+        __import__(_module)
+    except Exception:
+        pass
+del _module
+""".strip()
+
+
+class KernelPool:
+    """
+    Keeps `size` Python kernels started, set up, and with the `preload` modules already imported,
+    so the first Python code block (and the first one after `interpreter.reset()`) doesn't wait
+    for any of that. Kernels are started in the background, and used ones are shut down in the
+    background too.
+
+    There's one pool per process, shared by every interpreter in it.
+
+    With `fork_server` on (and where there's os.fork), kernels are forked from one process that
+    has already imported the `preload` modules, instead of each being started from scratch. That
+    takes milliseconds, and they share its memory. (It's started with the `preload` modules at
+    the time, so changing them later means calling `close_fork_server()`.)
+    """
+
+    def __init__(self, size=1, preload=None, kernel_name="python3", fork_server=False):
+        self.size = size
+        self.preload = (
+            ["numpy", "pandas", "matplotlib.pyplot"] if preload is None else preload
+        )
+        self.kernel_name = kernel_name
+        self.fork_server = fork_server
+        self.setup_timeout = 60
+
+        self._ready = []  # (km, kc)
+        self._starting = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self._fork_server = None
+        self._fork_server_lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns a ready (KernelManager, client) pair, with its channels started. Waits for one
+        that's already starting, if there is one, or starts one.
+        """
+        with self._condition:
+            while True:
+                while self._ready:
+                    km, kc = self._ready.pop(0)
+                    if km.is_alive():
+                        self._fill()
+                        return km, kc
+                    _shut_down_later(km, kc)
+                if not self._starting:
+                    break
+                self._condition.wait()
+            self._fill()
+
+        # Nothing on its way, so start one ourselves (without preloading, since we're waiting)
+        return self._start_kernel(preload=False)
+
+    def warm(self):
+        """
+        Starts getting kernels ready in the background, up to `size` of them.
+        """
+        with self._condition:
+            self._fill()
+
+    def recycle(self, km, kc, before=None):
+        """
+        Shuts a used kernel down in the background. `before` is called first, from there.
+        """
+        _shut_down_later(km, kc, before)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            ready, self._ready = self._ready, []
+        for km, kc in ready:
+            _shut_down(km, kc, now=True)
+        self.close_fork_server()
+
+    def close_fork_server(self):
+        with self._fork_server_lock:
+            if self._fork_server is not None:
+                self._fork_server.close()
+                self._fork_server = None
+
+    def _fill(self):
+        # Call with the condition held
+        if self._closed:
+            return
+        for _ in range(self.size - len(self._ready) - self._starting):
+            self._starting += 1
+            threading.Thread(target=self._start_in_background, daemon=True).start()
+
+    def _start_in_background(self):
+        try:
+            kernel = self._start_kernel()
+        except Exception:
+            kernel = None  # get() will start one itself, and see what's wrong
+        with self._condition:
+            self._starting -= 1
+            if kernel is not None:
+                if self._closed:
+                    _shut_down_later(*kernel)
+                else:
+                    self._ready.append(kernel)
+            self._condition.notify_all()
+
+    def _start_kernel(self, preload=True):
+        if self.fork_server and hasattr(os, "fork"):
+            km = self._get_fork_server().start_kernel()
+        else:
+            km = KernelManager(kernel_name=self.kernel_name)
+            km.start_kernel()
+        kc = km.client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.setup_timeout)
+            code = SETUP_CODE
+            if preload and self.preload:
+                code += "\n" + PRELOAD_CODE.format(modules=list(self.preload))
+            kc.execute_interactive(
+                code,
+                timeout=self.setup_timeout,
+                allow_stdin=False,
+                output_hook=lambda msg: None,
+            )
+        except:
+            _shut_down(km, kc, now=True)
+            raise
+        return km, kc
+
+    def _get_fork_server(self):
+        with self._fork_server_lock:
+            if self._fork_server is None or not self._fork_server.is_alive():
+                self._fork_server = ForkServer(self.preload)
+            return self._fork_server
+
+
+def _shut_down(km, kc, now=False):
+    try:
+        kc.stop_channels()
+        km.shutdown_kernel(now=now)
+    except:
+        pass
+
+
+def _shut_down_later(km, kc, before=None):
+    def shut_down():
+        if before is not None:
+            before()
+        _shut_down(km, kc)
+
+    threading.Thread(target=shut_down, daemon=True).start()
+
+
+kernel_pool = KernelPool(
+    size=int(os.environ.get("INTERPRETER_KERNEL_POOL_SIZE", 1)),
+    preload=(
+        [
+            m.strip()
+            for m in os.environ["INTERPRETER_KERNEL_PRELOAD"].split(",")
+            if m.strip()
+        ]
+        if "INTERPRETER_KERNEL_PRELOAD" in os.environ
+        else None
+    ),
+    fork_server=os.environ.get("INTERPRETER_KERNEL_FORK_SERVER", "False").lower()
+    == "true",
+)
+atexit.register(kernel_pool.close)
@@ -1,13 +1,18 @@
+import codecs
+import io
 import os
 import queue
 import re
+import selectors
 import subprocess
 import threading
-import time
 import traceback
 
 from ..base_language import BaseLanguage
 
+# Put in the output queue after an execution's last output
+END_OF_EXECUTION = object()
+
 
 class SubprocessLanguage(BaseLanguage):
     def __init__(self):
@@ -16,6 +21,7 @@ class SubprocessLanguage(BaseLanguage):
         self.verbose = False
         self.output_queue = queue.Queue()
         self.done = threading.Event()
+        self.process_ended = threading.Event()  # Set once we've read all of its output
 
     def detect_active_line(self, line):
         return None
@@ -47,11 +53,14 @@ class SubprocessLanguage(BaseLanguage):
 
         my_env = os.environ.copy()
         my_env["PYTHONIOENCODING"] = "utf-8"
+        # select() only works on sockets on Windows, so there stderr goes into stdout, to be
+        # read by one thread in the order it was written
+        windows = os.name == "nt"
         self.process = subprocess.Popen(
             self.start_cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stderr=subprocess.STDOUT if windows else subprocess.PIPE,
             text=True,
             bufsize=0,
             universal_newlines=True,
@@ -59,16 +68,19 @@ class SubprocessLanguage(BaseLanguage):
             encoding="utf-8",
             errors="replace",
         )
-        threading.Thread(
-            target=self.handle_stream_output,
-            args=(self.process.stdout, False),
-            daemon=True,
-        ).start()
-        threading.Thread(
-            target=self.handle_stream_output,
-            args=(self.process.stderr, True),
-            daemon=True,
-        ).start()
+        self.process_ended = threading.Event()
+        if windows:
+            threading.Thread(
+                target=self.handle_stream_output,
+                args=(self.process.stdout, False, self.process_ended),
+                daemon=True,
+            ).start()
+        else:
+            threading.Thread(
+                target=self.handle_streams,
+                args=(self.process.stdout, self.process.stderr, self.process_ended),
+                daemon=True,
+            ).start()
 
     def run(self, code):
         retry_count = 0
@@ -77,7 +89,10 @@ class SubprocessLanguage(BaseLanguage):
         # Setup
         try:
             code = self.preprocess_code(code)
-            if not self.process:
+            # Anything still in here is from an execution we stopped listening to
+            self.clear_output_queue()
+            if not self.process or self.process_ended.is_set():
+                # It exited (after `exit`, say), so nothing would answer
                 self.start_process()
         except:
             yield {
@@ -119,75 +134,166 @@ class SubprocessLanguage(BaseLanguage):
                     }
                     return
 
+        # The reader threads put END_OF_EXECUTION in the queue, so this just waits on it
         while True:
-            if not self.output_queue.empty():
-                yield self.output_queue.get()
-            else:
-                time.sleep(0.1)
-            try:
-                output = self.output_queue.get(timeout=0.3)  # Waits for 0.3 seconds
-                yield output
-            except queue.Empty:
-                if self.done.is_set():
-                    # Try to yank 3 more times from it... maybe there's something in there...
-                    # (I don't know if this actually helps. Maybe we just need to yank 1 more time)
-                    for _ in range(3):
-                        if not self.output_queue.empty():
-                            yield self.output_queue.get()
-                        time.sleep(0.2)
-                    break
-
-    def handle_stream_output(self, stream, is_error_stream):
+            output = self.output_queue.get()
+            if output is END_OF_EXECUTION:
+                break
+            yield output
+
+    def clear_output_queue(self):
+        try:
+            while True:
+                self.output_queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def finish_execution(self):
+        self.done.set()
+        self.output_queue.put(END_OF_EXECUTION)
+
+    def end_process(self, ended):
+        ended.set()
+        if ended is self.process_ended:
+            # The process is gone, so nothing else is coming
+            self.finish_execution()
+
+    def handle_streams(self, stdout, stderr, ended):
+        """
+        Reads stdout and stderr in one thread. When the end of execution marker shows up on one,
+        whatever the code wrote to the other before it is already in that pipe, so we read that
+        too, then say we're done. No waiting around to see if anything else turns up.
+        """
+        # The binary streams under the text ones. One read gets whatever's in the pipe
+        readers = {
+            stdout.buffer: _LineReader(False),
+            stderr.buffer: _LineReader(True),
+        }
+        try:
+            with selectors.DefaultSelector() as selector:
+                for stream in readers:
+                    selector.register(stream, selectors.EVENT_READ)
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        if self._read_lines(selector, key.fileobj, readers):
+                            self._catch_up(selector, readers, key.fileobj)
+                            self.finish_execution()
+                            # The other streams may have been read dry, so select again
+                            break
+        except (OSError, ValueError):
+            if self.verbose:
+                print("Stream closed while reading.")
+        self.end_process(ended)
+
+    def _catch_up(self, selector, readers, ended_stream):
+        while True:
+            ready = [
+                key.fileobj
+                for key, _ in selector.select(timeout=0)
+                if key.fileobj is not ended_stream
+            ]
+            if not ready:
+                return
+            for stream in ready:
+                self._read_lines(selector, stream, readers)
+
+    def _read_lines(self, selector, stream, readers):
+        """
+        Reads what's in `stream`'s pipe and handles each whole line.
+        Returns True if one of them was the end of the execution.
+        """
+        data = stream.read(65536)
+        if not data:
+            selector.unregister(stream)
+        reader = readers[stream]
+        ended = False
+        for line in reader.feed(data, final=not data):
+            if self.handle_line(line, reader.is_error_stream):
+                ended = True
+        return ended
+
+    def handle_stream_output(self, stream, is_error_stream, ended=None):
         try:
             for line in iter(stream.readline, ""):
-                if self.verbose:
-                    print(f"Received output line:\n{line}\n---")
-
-                line = self.line_postprocessor(line)
-
-                if line is None:
-                    continue  # `line = None` is the postprocessor's signal to discard completely
-
-                if self.detect_active_line(line):
-                    active_line = self.detect_active_line(line)
-                    self.output_queue.put(
-                        {
-                            "type": "console",
-                            "format": "active_line",
-                            "content": active_line,
-                        }
-                    )
-                    # Sometimes there's a little extra on the same line, so be sure to send that out
-                    line = re.sub(r"##active_line\d+##", "", line)
-                    if line:
-                        self.output_queue.put(
-                            {"type": "console", "format": "output", "content": line}
-                        )
-                elif self.detect_end_of_execution(line):
-                    # Sometimes there's a little extra on the same line, so be sure to send that out
-                    line = line.replace("##end_of_execution##", "").strip()
-                    if line:
-                        self.output_queue.put(
-                            {"type": "console", "format": "output", "content": line}
-                        )
-                    self.done.set()
-                elif is_error_stream and "KeyboardInterrupt" in line:
-                    self.output_queue.put(
-                        {
-                            "type": "console",
-                            "format": "output",
-                            "content": "KeyboardInterrupt",
-                        }
-                    )
-                    time.sleep(0.1)
-                    self.done.set()
-                else:
-                    self.output_queue.put(
-                        {"type": "console", "format": "output", "content": line}
-                    )
+                if self.handle_line(line, is_error_stream):
+                    self.finish_execution()
         except ValueError as e:
             if "operation on closed file" in str(e):
                 if self.verbose:
                     print("Stream closed while reading.")
             else:
                 raise e
+        if ended is not None:
+            self.end_process(ended)
+
+    def handle_line(self, line, is_error_stream):
+        """
+        Puts a line of output in the output queue. Returns True if it's the end of the execution.
+        """
+        if self.verbose:
+            print(f"Received output line:\n{line}\n---")
+
+        line = self.line_postprocessor(line)
+
+        if line is None:
+            return False  # `line = None` is the postprocessor's signal to discard completely
+
+        if self.detect_active_line(line):
+            active_line = self.detect_active_line(line)
+            self.output_queue.put(
+                {
+                    "type": "console",
+                    "format": "active_line",
+                    "content": active_line,
+                }
+            )
+            # Sometimes there's a little extra on the same line, so be sure to send that out
+            line = re.sub(r"##active_line\d+##", "", line)
+            if line:
+                self.output_queue.put(
+                    {"type": "console", "format": "output", "content": line}
+                )
+        elif self.detect_end_of_execution(line):
+            # Sometimes there's a little extra on the same line, so be sure to send that out
+            line = line.replace("##end_of_execution##", "").strip()
+            if line:
+                self.output_queue.put(
+                    {"type": "console", "format": "output", "content": line}
+                )
+            return True
+        elif is_error_stream and "KeyboardInterrupt" in line:
+            self.output_queue.put(
+                {
+                    "type": "console",
+                    "format": "output",
+                    "content": "KeyboardInterrupt",
+                }
+            )
+            return True
+        else:
+            self.output_queue.put(
+                {"type": "console", "format": "output", "content": line}
+            )
+        return False
+
+
+class _LineReader:
+    """
+    Turns what's read from a pipe into lines, like the text mode stream would have.
+    """
+
+    def __init__(self, is_error_stream):
+        self.is_error_stream = is_error_stream
+        self.decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder("utf-8")(errors="replace"), translate=True
+        )
+        self.partial = ""
+
+    def feed(self, data, final=False):
+        lines = (self.partial + self.decoder.decode(data, final=final)).split("\n")
+        self.partial = lines.pop()
+        lines = [line + "\n" for line in lines]
+        if final and self.partial:
+            lines.append(self.partial)
+            self.partial = ""
+        return lines
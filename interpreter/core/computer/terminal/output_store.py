@@ -0,0 +1,204 @@
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+
+from ....terminal_interface.utils.local_storage_path import get_storage_path
+
+PAGE_SIZE = 10000  # Bytes per page
+MAX_STORE_BYTES = 1024 * 1024 * 1024  # Oldest outputs are deleted past this
+
+_NEWLINE = re.compile(b"\n")
+
+
+class OutputStore:
+    """
+    Keeps the full output of code runs on disk, named by the hash of their contents,
+    so outputs too long for the LLM's context can still be paged through and searched.
+    """
+
+    def __init__(self, directory=None, max_bytes=MAX_STORE_BYTES):
+        self.directory = directory or get_storage_path("outputs")
+        self.max_bytes = max_bytes
+
+    def writer(self):
+        return OutputWriter(self)
+
+    def get(self, id=None):
+        """
+        Returns the stored output with this `id` (or the most recent one).
+        """
+        if id is None:
+            paths = self._paths()
+            if not paths:
+                raise FileNotFoundError("No outputs have been stored yet.")
+            return StoredOutput(max(paths, key=os.path.getmtime))
+
+        id = str(id)
+        if not re.fullmatch(r"[0-9a-f]+", id):
+            raise ValueError(f"Invalid output id: {id}")
+        path = os.path.join(self.directory, id + ".txt")
+        if os.path.exists(path):
+            return StoredOutput(path)
+        # Allow short ids, like git does
+        matches = [p for p in self._paths() if os.path.basename(p).startswith(id)]
+        if len(matches) == 1:
+            return StoredOutput(matches[0])
+        raise FileNotFoundError(f"No stored output with id {id}")
+
+    def prune(self, keep=None):
+        """
+        Deletes the oldest outputs (other than `keep`) until the store fits in `max_bytes`.
+        """
+        paths = sorted(self._paths(), key=os.path.getmtime)
+        sizes = {path: os.path.getsize(path) for path in paths}
+        total = sum(sizes.values())
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= sizes[path]
+
+    def _paths(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".txt")
+        ]
+
+
+class OutputWriter:
+    """
+    Streams an output to a temporary file, then files it under the hash of its contents.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        os.makedirs(store.directory, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(dir=store.directory, suffix=".tmp")
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.id = None
+        self.path = None
+
+    def write(self, text):
+        data = text.encode("utf-8", errors="replace")
+        self._hash.update(data)
+        self._file.write(data)
+
+    def close(self):
+        """
+        Finishes writing. Returns the output's id.
+        """
+        if self.id is not None:
+            return self.id
+        self._file.close()
+        self.id = self._hash.hexdigest()[:16]
+        self.path = os.path.join(self.store.directory, self.id + ".txt")
+        if os.path.exists(self.path):
+            # Same output as before
+            os.remove(self._temp_path)
+            os.utime(self.path)
+        else:
+            os.replace(self._temp_path, self.path)
+            self.store.prune(keep=self.path)
+        return self.id
+
+
+class StoredOutput:
+    """
+    A stored output, read through a memory map so it's never loaded all at once.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.basename(path)[: -len(".txt")]
+
+    def __len__(self):
+        return os.path.getsize(self.path)
+
+    def __repr__(self):
+        return f"<StoredOutput {self.id}: {len(self)} bytes, {self.pages()} pages of {PAGE_SIZE}>"
+
+    def pages(self, page_size=PAGE_SIZE):
+        return max(1, -(-len(self) // page_size))
+
+    def page(self, n=0, page_size=PAGE_SIZE):
+        """
+        Returns page `n` (starting from 0) of the output. Negative numbers count from the end.
+        """
+        if n < 0:
+            n += self.pages(page_size)
+        return self.read(n * page_size, (n + 1) * page_size)
+
+    def read(self, start=0, end=None):
+        """
+        Returns the text between byte offsets `start` and `end`.
+        """
+        with self._map() as data:
+            if data is None:
+                return ""
+            return data[start:end].decode("utf-8", errors="ignore")
+
+    def grep(self, pattern, max_matches=100, ignore_case=False):
+        """
+        Returns the lines matching the regex `pattern`, with their line numbers.
+        """
+        flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+        regex = re.compile(pattern.encode("utf-8"), flags)
+        matches = []
+        with self._map() as data:
+            if data is None:
+                return ""
+            line_number = 1
+            counted_to = 0  # line_number is the line this offset is on
+            next_line = 0  # Where the line after the last match starts
+            for match in regex.finditer(data):
+                position = match.start()
+                if position < next_line:
+                    continue  # Already have this line
+                line_number += sum(
+                    1 for _ in _NEWLINE.finditer(data, counted_to, position)
+                )
+                counted_to = position
+                line_start = data.rfind(b"\n", 0, position) + 1
+                line_end = data.find(b"\n", position)
+                if line_end == -1:
+                    line_end = len(data)
+                line = data[line_start:line_end].decode("utf-8", errors="ignore")
+                matches.append(f"{line_number}: {line}")
+                next_line = line_end + 1
+                if len(matches) >= max_matches:
+                    matches.append(f"(Stopped after {max_matches} matches)")
+                    break
+        return "\n".join(matches)
+
+    def _map(self):
+        return _MappedFile(self.path)
+
+
+class _MappedFile:
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._map = None
+
+    def __enter__(self):
+        self._file = open(self.path, "rb")
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return None  # Empty files can't be mapped
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def __exit__(self, *args):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
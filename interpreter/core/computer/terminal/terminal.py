@@ -9,12 +9,15 @@ from .languages.applescript import AppleScript
 from .languages.html import HTML
 from .languages.java import Java
 from .languages.javascript import JavaScript
+from .languages.jupyter_language import JupyterLanguage
+from .languages.kernel_pool import kernel_pool
 from .languages.powershell import PowerShell
 from .languages.python import Python
 from .languages.r import R
 from .languages.react import React
 from .languages.ruby import Ruby
 from .languages.shell import Shell
+from .output_store import OutputStore
 
 # Should this be renamed to OS or System?
 
@@ -46,6 +49,16 @@ class Terminal:
             Java,
         ]
         self._active_languages = {}
+        self.output_store = OutputStore()  # Full copies of outputs that were truncated
+        # Ready Python kernels, shared by every interpreter
+        self.kernel_pool = kernel_pool
+
+    def output(self, id=None):
+        """
+        Returns a stored output (the most recent one if `id` isn't given).
+        Read it with `.page(n)`, or search it with `.grep(pattern)`.
+        """
+        return self.output_store.get(id)
 
     def sudo_install(self, package):
         try:
@@ -153,7 +166,27 @@ class Terminal:
             # If stream == True, replace this with _streaming_run.
             return self._streaming_run(language, code, display=display)
 
-    def _streaming_run(self, language, code, display=False):
+    def warm_up(self):
+        """
+        Starts getting a Python kernel ready in the background, if we'll need one and don't have one.
+        """
+        python = self.get_language("python")
+        if (
+            python
+            and issubclass(python, JupyterLanguage)
+            and "python" not in self._active_languages
+        ):
+            self.kernel_pool.warm()
+
+    def sync_computer(self):
+        """
+        Brings this computer and the `computer` inside the Python kernel up to date with each other.
+        """
+        python = self._language_instance("python")
+        if hasattr(python, "sync_computer"):
+            python.sync_computer()
+
+    def _language_instance(self, language):
         if language not in self._active_languages:
             # Get the language. Pass in self.computer *if it takes a single argument*
             # but pass in nothing if not. This makes custom languages easier to add / understand.
@@ -162,8 +195,11 @@ class Terminal:
                 self._active_languages[language] = lang_class(self.computer)
             else:
                 self._active_languages[language] = lang_class()
+        return self._active_languages[language]
+
+    def _streaming_run(self, language, code, display=False):
         try:
-            for chunk in self._active_languages[language].run(code):
+            for chunk in self._language_instance(language).run(code):
                 # self.format_to_recipient can format some messages as having a certain recipient.
                 # Here we add that to the LMC messages:
                 if chunk["type"] == "console" and chunk.get("format") == "output":
@@ -1,8 +1,8 @@
 import base64
-import contextlib
 import io
 import os
 import tempfile
+import threading
 
 from PIL import Image
 
@@ -18,24 +18,26 @@ class Vision:
         self.model = None  # Will load upon first use
         self.tokenizer = None  # Will load upon first use
         self.easyocr = None
+        self._load_lock = threading.Lock()  # OCR and queries run in threads
 
     def load(self, load_moondream=True, load_easyocr=True):
         # print("Loading vision models (Moondream, EasyOCR)...\n")
 
-        with contextlib.redirect_stdout(
-            open(os.devnull, "w")
-        ), contextlib.redirect_stderr(open(os.devnull, "w")):
+        # No redirect_stdout to keep the models quiet. It swaps sys.stdout for the whole process,
+        # so it would hide everything else that's printed, and this runs in the describer's threads
+        with self._load_lock:
             if self.easyocr == None and load_easyocr:
                 import easyocr
 
                 self.easyocr = easyocr.Reader(
-                    ["en"]
+                    ["en"], verbose=False
                 )  # this needs to run only once to load the model into memory
 
             if self.model == None and load_moondream:
                 import transformers  # Wait until we use it. Transformers can't be lazy loaded for some reason!
 
                 os.environ["TOKENIZERS_PARALLELISM"] = "false"
+                transformers.logging.set_verbosity_error()
 
                 if self.computer.debug:
                     print(
@@ -46,7 +48,6 @@ class Vision:
                     )
                 model_id = "vikhyatk/moondream2"
                 revision = "2024-04-02"
-                print("loading model")
 
                 self.model = transformers.AutoModelForCausalLM.from_pretrained(
                     model_id, trust_remote_code=True, revision=revision
@@ -139,7 +140,7 @@ class Vision:
                     "\nTo use local vision, run `pip install 'open-interpreter[local]'`.\n"
                 )
                 return ""
-            if not success:
+            if not success and self.model == None:  # Another thread may have loaded it
                 return ""
 
         if lmc:
@@ -166,10 +167,9 @@ class Vision:
         elif pil_image:
             img = pil_image
 
-        with contextlib.redirect_stdout(open(os.devnull, "w")):
-            enc_image = self.model.encode_image(img)
-            answer = self.model.answer_question(
-                enc_image, query, self.tokenizer, max_length=400
-            )
+        enc_image = self.model.encode_image(img)
+        answer = self.model.answer_question(
+            enc_image, query, self.tokenizer, max_length=400
+        )
 
         return answer
@@ -2,10 +2,8 @@
 This file defines the Interpreter class.
 It's the main file. `from interpreter import interpreter` will import an instance of this class.
 """
-import json
 import os
 import threading
-import time
 from datetime import datetime
 
 from ..terminal_interface.local_setup import local_setup
@@ -16,9 +14,15 @@ from ..terminal_interface.utils.oi_dir import oi_dir
 from .computer.computer import Computer
 from .default_system_message import default_system_message
 from .llm.llm import Llm
+from .render_message import RenderCache
 from .respond import respond
+from .utils.chat_handle import ChatHandle
+from .utils.coalesce_chunks import coalesce_chunks
+from .utils.conversation_journal import ConversationJournal, save_json_conversation
+from .utils.image_store import ImageStore
+from .utils.message_log import MessageLog
 from .utils.telemetry import send_telemetry
-from .utils.truncate_output import truncate_output
+from .utils.truncate_output import OutputAccumulator
 
 
 class OpenInterpreter:
@@ -83,6 +87,7 @@ class OpenInterpreter:
     ):
         # State
         self.messages = [] if messages is None else messages
+        self._idle = threading.Event()  # Set whenever we're not responding
         self.responding = False
         self.last_messages_count = 0
 
@@ -94,6 +99,7 @@ class OpenInterpreter:
         self.max_output = max_output
         self.safe_mode = safe_mode
         self.shrink_images = shrink_images
+        self.lossy_images = False  # Lets shrink_images send images as WebP/JPEG
         self.disable_telemetry = disable_telemetry
         self.in_terminal_interface = in_terminal_interface
         self.multi_line = multi_line
@@ -110,6 +116,11 @@ class OpenInterpreter:
         self.conversation_history = conversation_history
         self.conversation_filename = conversation_filename
         self.conversation_history_path = conversation_history_path
+        self._conversation_journal = None
+
+        # Console output is collected here while it's streaming, then written to its message
+        self._output = None
+        self._output_message = None
 
         # OS control mode related attributes
         self.os = os
@@ -131,6 +142,8 @@ class OpenInterpreter:
 
         # These are LLM related
         self.system_message = system_message
+        self.render_cache = RenderCache()  # Output of {{ }} blocks
+        self.image_store = ImageStore()  # Image messages refer to images stored here
         self.custom_instructions = custom_instructions
         self.user_message_template = user_message_template
         self.always_apply_user_message_template = always_apply_user_message_template
@@ -144,12 +157,34 @@ class OpenInterpreter:
         """
         self = local_setup(self)
 
-    def wait(self):
-        while self.responding:
-            time.sleep(0.2)
+    def wait(self, timeout=None):
+        self._idle.wait(timeout)
         # Return new messages
         return self.messages[self.last_messages_count :]
 
+    @property
+    def responding(self):
+        return not self._idle.is_set()
+
+    @responding.setter
+    def responding(self, responding):
+        # An event, so wait() doesn't have to keep checking
+        if responding:
+            self._idle.clear()
+        else:
+            self._idle.set()
+
+    @property
+    def messages(self):
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages):
+        # Always a MessageLog, however it's set, so lookups can use its index
+        if not isinstance(messages, MessageLog):
+            messages = MessageLog(messages)
+        self._messages = messages
+
     @property
     def anonymous_telemetry(self) -> bool:
         return not self.disable_telemetry and not self.offline
@@ -161,7 +196,23 @@ class OpenInterpreter:
         )
         return self.contribute_conversation and not overrides
 
-    def chat(self, message=None, display=True, stream=False, blocking=True):
+    def chat(
+        self,
+        message=None,
+        display=True,
+        stream=False,
+        blocking=True,
+        coalesce_ms=None,
+        coalesce_bytes=None,
+    ):
+        """
+        With `stream=True`, returns a generator of LMC chunks. Set `coalesce_ms` and/or
+        `coalesce_bytes` to have adjacent chunks of the same message merged (for up to that many
+        milliseconds, or characters), so there are fewer of them to handle.
+
+        With `blocking=False`, runs in a thread and returns a ChatHandle, which can be waited on,
+        awaited, or cancelled. Add `stream=True` to also iterate over it for the chunks.
+        """
         try:
             self.responding = True
             if self.anonymous_telemetry:
@@ -177,15 +228,14 @@ class OpenInterpreter:
                     },
                 )
 
-            if not blocking:
-                chat_thread = threading.Thread(
-                    target=self.chat, args=(message, display, stream, True)
-                )  # True as in blocking = True
-                chat_thread.start()
-                return
-
-            if stream:
-                return self._streaming_chat(message=message, display=display)
+            if stream or not blocking:
+                chunks = self._streaming_chat(message=message, display=display)
+                if coalesce_ms or coalesce_bytes:
+                    chunks = coalesce_chunks(chunks, coalesce_ms, coalesce_bytes)
+                if not blocking:
+                    # It clears `responding` when it's done
+                    return ChatHandle(self, chunks, stream=stream)
+                return chunks
 
             # If stream=False, *pull* from the stream.
             for _ in self._streaming_chat(message=message, display=display):
@@ -240,6 +290,15 @@ class OpenInterpreter:
             elif isinstance(message, list):
                 self.messages = message
 
+            # Store images once, on disk, rather than keeping their base64 in messages
+            for i, message in enumerate(self.messages):
+                stored = self.image_store.store_message(message)
+                if stored is not message:
+                    self.messages[i] = stored
+
+            # Blocks in the system message can ask to be re-rendered for every new message
+            self.render_cache.invalidate("turn")
+
             # Now that the user's messages have been added, we set last_messages_count.
             # This way we will only return the messages after what they added.
             self.last_messages_count = len(self.messages)
@@ -274,26 +333,40 @@ class OpenInterpreter:
 
                     date = datetime.now().strftime("%B_%d_%Y_%H-%M-%S")
                     self.conversation_filename = (
-                        "__".join([first_few_words, date]) + ".json"
+                        "__".join([first_few_words, date]) + ".jsonl"
                     )
 
-                # Check if the directory exists, if not, create it
-                if not os.path.exists(self.conversation_history_path):
-                    os.makedirs(self.conversation_history_path)
-                # Write or overwrite the file
-                with open(
-                    os.path.join(
-                        self.conversation_history_path, self.conversation_filename
-                    ),
-                    "w",
-                ) as f:
-                    json.dump(self.messages, f)
+                self._save_conversation()
             return
 
         raise Exception(
             "`interpreter.chat()` requires a display. Set `display=True` or pass a message into `interpreter.chat(message)`."
         )
 
+    def _save_conversation(self):
+        """
+        Appends new messages to the conversation's journal. A conversation that isn't a `.jsonl`
+        journal (one saved before them, or a `conversation_filename` the user picked) is still
+        written whole, as JSON, so it stays where and what it was.
+        """
+        path = os.path.join(self.conversation_history_path, self.conversation_filename)
+        if not path.endswith(".jsonl"):
+            if self._conversation_journal is not None:
+                self._conversation_journal.close()
+                self._conversation_journal = None
+            save_json_conversation(path, self.messages)
+            return
+
+        if (
+            self._conversation_journal is None
+            or self._conversation_journal.path != path
+        ):
+            if self._conversation_journal is not None:
+                self._conversation_journal.close()
+            self._conversation_journal = ConversationJournal(path)
+
+        self._conversation_journal.sync(self.messages)
+
     def _respond_and_store(self):
         """
         Pulls from the respond stream, adding delimiters. Some things, like active_line, console, confirmation... these act specially.
@@ -312,8 +385,21 @@ class OpenInterpreter:
                 return True
             return False
 
+        def is_output(chunk):
+            return chunk["type"] == "console" and chunk.get("format") == "output"
+
         last_flag_base = None
 
+        def start_output(message):
+            self.flush_output()
+            self._output_message = message
+            self._output = OutputAccumulator(
+                self.max_output,
+                add_scrollbars=self.computer.import_computer_api,  # I consider scrollbars to be a computer API thing
+                store=self.computer.terminal.output_store,
+            )
+            self._output.append(message["content"])
+
         try:
             for chunk in respond(self):
                 # For async usage
@@ -324,6 +410,12 @@ class OpenInterpreter:
                 if chunk["content"] == "":
                     continue
 
+                # Anything other than more output (or the active line moving) means the output is done
+                if not is_output(chunk) and not (
+                    chunk["type"] == "console" and chunk["content"] is not None
+                ):
+                    self.flush_output()
+
                 # If active_line is None, we finished running code.
                 if (
                     chunk.get("format") == "active_line"
@@ -390,7 +482,15 @@ class OpenInterpreter:
                                 for property in ["role", "type", "format"]
                             ]
                         ):
-                            self.messages.append(chunk)
+                            self.flush_output()
+                            self.messages.append(self.image_store.store_message(chunk))
+                        elif chunk["type"] == "image":
+                            # Each image is its own message
+                            self.messages.append(self.image_store.store_message(chunk))
+                        elif is_output(chunk):
+                            if self._output is None:
+                                start_output(self.messages[-1])
+                            self._output.append(chunk["content"])
                         else:
                             self.messages[-1]["content"] += chunk["content"]
                 else:
@@ -408,28 +508,39 @@ class OpenInterpreter:
 
                     # Add the chunk as a new message
                     if not is_ephemeral(chunk):
-                        self.messages.append(chunk)
+                        self.messages.append(self.image_store.store_message(chunk))
+
+                # Start collecting output for the message we just added
+                if is_output(chunk) and self.messages and self.messages[-1] is chunk:
+                    start_output(chunk)
 
                 # Yield the chunk itself
                 yield chunk
 
-                # Truncate output if it's console output
-                if chunk["type"] == "console" and chunk["format"] == "output":
-                    self.messages[-1]["content"] = truncate_output(
-                        self.messages[-1]["content"],
-                        self.max_output,
-                        add_scrollbars=self.computer.import_computer_api,  # I consider scrollbars to be a computer API thing
-                    )
+            self.flush_output()
 
             # Yield a final end flag
             if last_flag_base:
                 yield {**last_flag_base, "end": True}
         except GeneratorExit:
             raise  # gotta pass this up!
+        finally:
+            self.flush_output()
+
+    def flush_output(self):
+        """
+        Writes the console output that's still being collected into its message.
+        Output is only written once it's done, so call this before reading `messages` mid-response.
+        """
+        if self._output is not None:
+            self._output_message["content"] = self._output.value()
+            self._output = None
+            self._output_message = None
 
     def reset(self):
         self.computer.terminate()  # Terminates all languages
         self.computer._has_imported_computer_api = False  # Flag reset
+        self.render_cache.invalidate()
         self.messages = []
         self.last_messages_count = 0
 
@@ -8,6 +8,8 @@ import litellm
 litellm.suppress_debug_info = True
 litellm.REPEATED_STREAMING_CHUNK_LIMIT = 99999999
 
+import asyncio
+import concurrent.futures
 import json
 import logging
 import subprocess
@@ -15,13 +17,25 @@ import time
 import uuid
 
 import requests
-import tokentrim as tt
 
 from .run_text_llm import run_text_llm
 
 # from .run_function_calling_llm import run_function_calling_llm
 from .run_tool_calling_llm import run_tool_calling_llm
-from .utils.convert_to_openai_messages import convert_to_openai_messages
+from .utils.completion_transport import (
+    blocked_for,
+    is_retryable,
+    prepare_params,
+    retry_delay,
+    use_connection_pool,
+)
+from .utils.convert_to_openai_messages import (
+    ConversionCache,
+    convert_to_openai_messages,
+)
+from .utils.describe_images import ImageDescriber, image_key
+from .utils.model_info_cache import ModelInfoCache
+from .utils.trim_messages import MessageTrimmer, model_max_tokens
 
 # Create or get the logger
 logger = logging.getLogger("LiteLLM")
@@ -49,6 +63,7 @@ class Llm:
 
         # OpenAI-compatible chat completions "endpoint"
         self.completions = fixed_litellm_completions
+        self.acompletions = fixed_litellm_acompletions  # Same, but an async generator
 
         # Settings
         self.model = "gpt-4o"
@@ -68,8 +83,27 @@ class Llm:
         self.api_base = None
         self.api_key = None
         self.api_version = None
+        self.prompt_caching = (
+            True  # Keep the prompt prefix stable and mark cache breakpoints
+        )
+        self.cache_usage = None  # Prompt cache hits and misses from the last request
+        self.refresh_model_info = (
+            False  # Ignore what we remembered about models last time
+        )
         self._is_loaded = False
 
+        # What we've learned about models in previous runs (capabilities, context windows...)
+        self._model_info_cache = ModelInfoCache()
+
+        # Descriptions of images we've seen, for when the LLM can't see them itself
+        self._image_describer = ImageDescriber()
+
+        # Converted messages from previous turns, so we only convert new ones
+        self._conversion_cache = ConversionCache()
+
+        # Remembers token counts, so we only tokenize new messages
+        self._trimmer = MessageTrimmer()
+
         # Budget manager powered by LiteLLM
         self.max_budget = None
 
@@ -123,25 +157,40 @@ class Llm:
                 self.api_base = "https://api.openinterpreter.com/v0"
                 self.interpreter.conversation_id = str(uuid.uuid4())
 
+        if self.supports_functions == None or self.supports_vision == None:
+            model_info = self._model_info_cache.get(model, self.api_base)
+
         # Detect function support
         if self.supports_functions == None:
-            try:
-                if litellm.supports_function_calling(model):
-                    self.supports_functions = True
-                else:
+            if "supports_functions" in model_info:
+                self.supports_functions = model_info["supports_functions"]
+            else:
+                try:
+                    if litellm.supports_function_calling(model):
+                        self.supports_functions = True
+                    else:
+                        self.supports_functions = False
+                except:
                     self.supports_functions = False
-            except:
-                self.supports_functions = False
+                self._model_info_cache.update(
+                    model, self.api_base, supports_functions=self.supports_functions
+                )
 
         # Detect vision support
         if self.supports_vision == None:
-            try:
-                if litellm.supports_vision(model):
-                    self.supports_vision = True
-                else:
+            if "supports_vision" in model_info:
+                self.supports_vision = model_info["supports_vision"]
+            else:
+                try:
+                    if litellm.supports_vision(model):
+                        self.supports_vision = True
+                    else:
+                        self.supports_vision = False
+                except:
                     self.supports_vision = False
-            except:
-                self.supports_vision = False
+                self._model_info_cache.update(
+                    model, self.api_base, supports_vision=self.supports_vision
+                )
 
         # Trim image messages if they're there
         image_messages = [msg for msg in messages if msg["type"] == "image"]
@@ -162,42 +211,66 @@ class Llm:
                             print("Removing image message!")
                 # Idea: we could set detail: low for the middle messages, instead of deleting them
         elif self.supports_vision == False and self.vision_renderer:
+            # Describe every new image at once, filling in each one as soon as it's ready
+            descriptions = {}
             for img_msg in image_messages:
                 if img_msg["format"] != "description":
-                    self.interpreter.display_message("\n  *Viewing image...*\n")
-
-                    if img_msg["format"] == "path":
-                        precursor = f"The image I'm referring to ({img_msg['content']}) contains the following: "
-                        if self.interpreter.computer.import_computer_api:
-                            postcursor = f"\nIf you want to ask questions about the image, run `computer.vision.query(path='{img_msg['content']}', query='(ask any question here)')` and a vision AI will answer it."
-                        else:
-                            postcursor = ""
+                    try:
+                        lmc = self.interpreter.image_store.load_message(img_msg)
+                    except OSError:
+                        # It was pruned from the image store
+                        img_msg[
+                            "content"
+                        ] = "(An image was here, but it's no longer available.)"
+                        img_msg["format"] = "description"
+                        continue
+                    future = self._image_describer.describe(
+                        lmc,
+                        self.vision_renderer,
+                        self.interpreter.computer.vision.ocr,
+                        key=image_key(img_msg),
+                    )
+                    descriptions[future] = img_msg
+
+            if descriptions:
+                self.interpreter.display_message("\n  *Viewing image...*\n")
+
+            for future in concurrent.futures.as_completed(descriptions):
+                img_msg = descriptions[future]
+
+                if img_msg["format"] == "path":
+                    precursor = f"The image I'm referring to ({img_msg['content']}) contains the following: "
+                    if self.interpreter.computer.import_computer_api:
+                        postcursor = f"\nIf you want to ask questions about the image, run `computer.vision.query(path='{img_msg['content']}', query='(ask any question here)')` and a vision AI will answer it."
                     else:
-                        precursor = "Imagine I have just shown you an image with this description: "
                         postcursor = ""
+                else:
+                    precursor = (
+                        "Imagine I have just shown you an image with this description: "
+                    )
+                    postcursor = ""
 
-                    try:
-                        image_description = self.vision_renderer(lmc=img_msg)
-                        ocr = self.interpreter.computer.vision.ocr(lmc=img_msg)
-
-                        # It would be nice to format this as a message to the user and display it like: "I see: image_description"
-
-                        img_msg["content"] = (
-                            precursor
-                            + image_description
-                            + "\n---\nI've OCR'd the image, this is the result (this may or may not be relevant. If it's not relevant, ignore this): '''\n"
-                            + ocr
-                            + "\n'''"
-                            + postcursor
-                        )
-                        img_msg["format"] = "description"
+                try:
+                    image_description, ocr = future.result()
 
-                    except ImportError:
-                        print(
-                            "\nTo use local vision, run `pip install 'open-interpreter[local]'`.\n"
-                        )
-                        img_msg["format"] = "description"
-                        img_msg["content"] = ""
+                    # It would be nice to format this as a message to the user and display it like: "I see: image_description"
+
+                    img_msg["content"] = (
+                        precursor
+                        + image_description
+                        + "\n---\nI've OCR'd the image, this is the result (this may or may not be relevant. If it's not relevant, ignore this): '''\n"
+                        + ocr
+                        + "\n'''"
+                        + postcursor
+                    )
+                    img_msg["format"] = "description"
+
+                except ImportError:
+                    print(
+                        "\nTo use local vision, run `pip install 'open-interpreter[local]'`.\n"
+                    )
+                    img_msg["format"] = "description"
+                    img_msg["content"] = ""
 
         # Convert to OpenAI messages format
         messages = convert_to_openai_messages(
@@ -206,49 +279,38 @@ class Llm:
             vision=self.supports_vision,
             shrink_images=self.interpreter.shrink_images,
             interpreter=self.interpreter,
+            cache=self._conversion_cache,
         )
 
         system_message = messages[0]["content"]
         messages = messages[1:]
 
         # Trim messages
-        try:
-            if self.context_window and self.max_tokens:
-                trim_to_be_this_many_tokens = (
-                    self.context_window - self.max_tokens - 25
-                )  # arbitrary buffer
-                messages = tt.trim(
-                    messages,
-                    system_message=system_message,
-                    max_tokens=trim_to_be_this_many_tokens,
-                )
-            elif self.context_window and not self.max_tokens:
-                # Just trim to the context window if max_tokens not set
-                messages = tt.trim(
-                    messages,
-                    system_message=system_message,
-                    max_tokens=self.context_window,
-                )
-            else:
-                try:
-                    messages = tt.trim(
-                        messages, system_message=system_message, model=model
-                    )
-                except:
-                    if len(messages) == 1:
-                        if self.interpreter.in_terminal_interface:
-                            self.interpreter.display_message(
-                                """
+        if self.context_window and self.max_tokens:
+            trim_to_be_this_many_tokens = (
+                self.context_window - self.max_tokens - 25
+            )  # arbitrary buffer
+        elif self.context_window and not self.max_tokens:
+            # Just trim to the context window if max_tokens not set
+            trim_to_be_this_many_tokens = self.context_window
+        else:
+            trim_to_be_this_many_tokens = model_max_tokens(model)
+
+        if trim_to_be_this_many_tokens is None:
+            if len(messages) == 1:
+                if self.interpreter.in_terminal_interface:
+                    self.interpreter.display_message(
+                        """
 **We were unable to determine the context window of this model.** Defaulting to 8000.
 
 If your model can handle more, run `interpreter --context_window {token limit} --max_tokens {max tokens per response}`.
 
 Continuing...
-                            """
-                            )
-                        else:
-                            self.interpreter.display_message(
-                                """
+                    """
+                    )
+                else:
+                    self.interpreter.display_message(
+                        """
 **We were unable to determine the context window of this model.** Defaulting to 8000.
 
 If your model can handle more, run `self.context_window = {token limit}`.
@@ -256,21 +318,27 @@ If your model can handle more, run `self.context_window = {token limit}`.
 Also please set `self.max_tokens = {max tokens per response}`.
 
 Continuing...
-                            """
-                            )
-                    messages = tt.trim(
-                        messages, system_message=system_message, max_tokens=8000
+                    """
                     )
-        except:
-            # If we're trimming messages, this won't work.
-            # If we're trimming from a model we don't know, this won't work.
+            trim_to_be_this_many_tokens = 8000
+
+        try:
+            messages = self._trimmer.trim(
+                messages,
+                system_message=system_message,
+                max_tokens=trim_to_be_this_many_tokens,
+                model=model,
+                stable=self.prompt_caching,
+            )
+        except Exception as e:
+            # Counting tokens can fail (e.g. if the tokenizer can't be downloaded).
             # Better not to fail until `messages` is too big, just for frustrations sake, I suppose.
+            if self.interpreter.verbose:
+                print("Unable to trim messages:", e)
 
             # Reunite system message with messages
             messages = [{"role": "system", "content": system_message}] + messages
 
-            pass
-
         # If there should be a system message, there should be a system message!
         # Empty system messages appear to be deleted :(
         if system_message == "":
@@ -298,6 +366,11 @@ Continuing...
             params["temperature"] = self.temperature
         if hasattr(self.interpreter, "conversation_id"):
             params["conversation_id"] = self.interpreter.conversation_id
+        if self.prompt_caching and model != "openai/i":
+            # So the last chunk tells us how much of the prompt was cached
+            params["stream_options"] = {"include_usage": True}
+
+        self.cache_usage = None
 
         # Set some params directly on LiteLLM
         if self.max_budget:
@@ -342,7 +415,24 @@ Continuing...
 
         self._is_loaded = True
 
-        if self.model.startswith("ollama/"):
+        if self.refresh_model_info:
+            self._model_info_cache.forget(self.model, self.api_base)
+
+        model_info = self._model_info_cache.get(self.model, self.api_base)
+
+        if (
+            self.model.startswith("ollama/")
+            and model_info.get("ollama_ready")
+            and (self.context_window != None or "context_window" in model_info)
+        ):
+            # We've already checked that this model is downloaded, and how big its context window is
+            if self.context_window == None:
+                self.context_window = model_info.get("context_window")
+            if self.max_tokens == None:
+                if self.context_window != None:
+                    self.max_tokens = int(self.context_window * 0.2)
+
+        elif self.model.startswith("ollama/"):
             model_name = self.model.replace("ollama/", "")
             api_base = getattr(self, "api_base", None) or os.getenv(
                 "OLLAMA_HOST", "http://localhost:11434"
@@ -372,15 +462,15 @@ Continuing...
                 requests.post(f"{api_base}/api/pull", json={"name": model_name})
 
             # Get context window if not set
+            context_length = None
             if self.context_window == None:
                 response = requests.post(
                     f"{api_base}/api/show", json={"name": model_name}
                 )
-                model_info = response.json().get("model_info", {})
-                context_length = None
-                for key in model_info:
+                ollama_model_info = response.json().get("model_info", {})
+                for key in ollama_model_info:
                     if "context_length" in key:
-                        context_length = model_info[key]
+                        context_length = ollama_model_info[key]
                         break
                 if context_length is not None:
                     self.context_window = context_length
@@ -399,68 +489,130 @@ Continuing...
 
             self.interpreter.display_message("*Model loaded.*\n")
 
+            # Next time, skip all of the above
+            info = {"ollama_ready": True}
+            if context_length is not None:
+                info["context_window"] = context_length
+            self._model_info_cache.update(self.model, self.api_base, **info)
+
         # Validate LLM should be moved here!!
 
         if self.context_window == None:
-            try:
-                model_info = litellm.get_model_info(model=self.model)
+            if "max_input_tokens" not in model_info:
+                try:
+                    litellm_model_info = litellm.get_model_info(model=self.model)
+                    model_info = {
+                        "max_input_tokens": litellm_model_info["max_input_tokens"],
+                        "max_output_tokens": litellm_model_info.get(
+                            "max_output_tokens"
+                        ),
+                    }
+                except:
+                    # Unknown to litellm. Remember that too, so we don't ask again
+                    model_info = {"max_input_tokens": None, "max_output_tokens": None}
+                self._model_info_cache.update(self.model, self.api_base, **model_info)
+
+            if model_info["max_input_tokens"] is not None:
                 self.context_window = model_info["max_input_tokens"]
-                if self.max_tokens == None:
+                if self.max_tokens == None and model_info["max_output_tokens"]:
                     self.max_tokens = min(
                         int(self.context_window * 0.2), model_info["max_output_tokens"]
                     )
-            except:
-                pass
 
 
 def fixed_litellm_completions(**params):
     """
     Just uses a dummy API key, since we use litellm without an API key sometimes.
     Hopefully they will fix this!
-    """
-
-    if "local" in params.get("model"):
-        # Kinda hacky, but this helps sometimes
-        params["stop"] = ["<|assistant|>", "<|end|>", "<|eot_id|>"]
 
-    if params.get("model") == "i" and "conversation_id" in params:
-        litellm.drop_params = (
-            False  # If we don't do this, litellm will drop this param!
-        )
-    else:
-        litellm.drop_params = True
+    Also retries transient errors with backoff, over a pooled connection.
+    """
 
-    params["model"] = params["model"].replace(":latest", "")
+    params = prepare_params(params)
+    use_connection_pool()
+    api_base = params.get("api_base")
 
     # Run completion
     attempts = 4
     first_error = None
 
-    params["num_retries"] = 0
-
     for attempt in range(attempts):
+        time.sleep(blocked_for(api_base))
+        started = False
         try:
-            yield from litellm.completion(**params)
+            for chunk in litellm.completion(**params):
+                started = True
+                yield chunk
             return  # If the completion is successful, exit the function
         except KeyboardInterrupt:
             print("Exiting...")
             sys.exit(0)
         except Exception as e:
+            if started:
+                # Trying again would repeat what we've already streamed out
+                raise
             if attempt == 0:
                 # Store the first error
                 first_error = e
-            if (
-                isinstance(e, litellm.exceptions.AuthenticationError)
-                and "api_key" not in params
-            ):
-                print(
-                    "LiteLLM requires an API key. Trying again with a dummy API key. In the future, if this fixes it, please set a dummy API key to prevent this message. (e.g `interpreter --api_key x` or `self.api_key = 'x'`)"
-                )
-                # So, let's try one more time with a dummy API key:
+            if _should_use_dummy_api_key(e, params):
                 params["api_key"] = "x"
-            if attempt == 1:
-                # Try turning up the temperature?
-                params["temperature"] = params.get("temperature", 0.0) + 0.1
+            elif not is_retryable(e) or attempt == attempts - 1:
+                break
+            else:
+                time.sleep(retry_delay(attempt, e, api_base))
 
     if first_error is not None:
         raise first_error  # If all attempts fail, raise the first error
+
+
+async def fixed_litellm_acompletions(**params):
+    """
+    Like `fixed_litellm_completions`, but async. Use it with `async for`.
+    """
+
+    params = prepare_params(params)
+    use_connection_pool()
+    api_base = params.get("api_base")
+
+    attempts = 4
+    first_error = None
+
+    for attempt in range(attempts):
+        await asyncio.sleep(blocked_for(api_base))
+        started = False
+        try:
+            response = await litellm.acompletion(**params)
+            if params.get("stream"):
+                async for chunk in response:
+                    started = True
+                    yield chunk
+            else:
+                yield response
+            return
+        except Exception as e:
+            if started:
+                raise
+            if attempt == 0:
+                first_error = e
+            if _should_use_dummy_api_key(e, params):
+                params["api_key"] = "x"
+            elif not is_retryable(e) or attempt == attempts - 1:
+                break
+            else:
+                await asyncio.sleep(retry_delay(attempt, e, api_base))
+
+    if first_error is not None:
+        raise first_error
+
+
+def _should_use_dummy_api_key(error, params):
+    if (
+        isinstance(error, litellm.exceptions.AuthenticationError)
+        and "api_key" not in params
+    ):
+        print(
+            "LiteLLM requires an API key. Trying again with a dummy API key. In the future, if this fixes it, please set a dummy API key to prevent this message. (e.g `interpreter --api_key x` or `self.api_key = 'x'`)"
+        )
+        # So, let's try one more time with a dummy API key
+        return True
+    return False
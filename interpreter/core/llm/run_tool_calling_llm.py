@@ -1,8 +1,9 @@
 import os
 import re
 
-from .utils.merge_deltas import merge_deltas
-from .utils.parse_partial_json import parse_partial_json
+from .utils.incremental_json_parser import IncrementalJsonParser
+from .utils.merge_deltas import DeltaAccumulator
+from .utils.prompt_cache import add_cache_breakpoints, record_cache_usage
 
 tool_schema = {
     "type": "function",
@@ -167,20 +168,28 @@ def run_tool_calling_llm(llm, request_params):
 
     ## Convert output to LMC format
 
-    accumulated_deltas = {}
+    accumulated_deltas = DeltaAccumulator()
     language = None
-    code = ""
     function_call_detected = False
     accumulated_review = ""
     review_category = None
     buffer = ""
+    arguments_parser = IncrementalJsonParser()
+
+    if llm.prompt_caching:
+        request_params["messages"] = add_cache_breakpoints(
+            request_params["messages"], request_params["model"]
+        )
 
     for chunk in llm.completions(**request_params):
+        record_cache_usage(llm, chunk)
+
         if "choices" not in chunk or len(chunk["choices"]) == 0:
             # This happens sometimes
             continue
 
         delta = chunk["choices"][0]["delta"]
+        arguments_delta = None
 
         # Convert tool call into function call, which we have great parsing logic for below
         if "tool_calls" in delta and delta["tool_calls"]:
@@ -195,9 +204,10 @@ def run_tool_calling_llm(llm, request_params):
                         "arguments": delta["tool_calls"][0].function.arguments,
                     }
                 }
+                arguments_delta = delta["function_call"]["arguments"]
 
         # Accumulate deltas
-        accumulated_deltas = merge_deltas(accumulated_deltas, delta)
+        accumulated_deltas.add(delta)
 
         if "content" in delta and delta["content"]:
             if function_call_detected:
@@ -247,21 +257,15 @@ def run_tool_calling_llm(llm, request_params):
             else:
                 yield {"type": "message", "content": delta["content"]}
 
-        if (
-            accumulated_deltas.get("function_call")
-            and "name" in accumulated_deltas["function_call"]
-            and (
-                accumulated_deltas["function_call"]["name"] == "python"
-                or accumulated_deltas["function_call"]["name"] == "functions"
-            )
+        if accumulated_deltas.has_function_call and str(accumulated_deltas.name) in (
+            "python",
+            "functions",
         ):
             if language is None:
                 language = "python"
 
-            # Pull the code string straight out of the "arguments" string
-            code_delta = accumulated_deltas["function_call"]["arguments"][len(code) :]
-            # Update the code
-            code = accumulated_deltas["function_call"]["arguments"]
+            # Pull the new code straight out of the "arguments" string
+            code_delta = accumulated_deltas.arguments.read_new()
             # Yield the delta
             if code_delta:
                 yield {
@@ -270,40 +274,32 @@ def run_tool_calling_llm(llm, request_params):
                     "content": code_delta,
                 }
 
-        if (
-            accumulated_deltas.get("function_call")
-            and "arguments" in accumulated_deltas["function_call"]
-            and accumulated_deltas["function_call"]["arguments"]
-        ):
-            if "arguments" in accumulated_deltas["function_call"]:
-                arguments = accumulated_deltas["function_call"]["arguments"]
-                arguments = parse_partial_json(arguments)
-
-                if arguments:
-                    if (
-                        language is None
-                        and "language" in arguments
-                        and "code"
-                        in arguments  # <- This ensures we're *finished* typing language, as opposed to partially done
-                        and arguments["language"]
-                    ):
-                        language = arguments["language"]
-
-                    if language is not None and "code" in arguments:
-                        # Calculate the delta (new characters only)
-                        code_delta = arguments["code"][len(code) :]
-                        # Update the code
-                        code = arguments["code"]
-                        # Yield the delta
-                        if code_delta:
-                            yield {
-                                "type": "code",
-                                "format": language,
-                                "content": code_delta,
-                            }
-                else:
-                    if llm.interpreter.verbose:
-                        print("Arguments not a dict.")
+        if arguments_delta:
+            # Only the new characters are parsed, the parser remembers where it left off
+            arguments_parser.feed(arguments_delta)
+
+            if not arguments_parser.failed:
+                if (
+                    language is None
+                    and "language" in arguments_parser.completed
+                    and "code"
+                    in arguments_parser  # <- This ensures we're *finished* typing language, as opposed to partially done
+                    and arguments_parser.get("language")
+                ):
+                    language = arguments_parser.get("language")
+
+                if language is not None and "code" in arguments_parser:
+                    # Only the characters that arrived since we last checked
+                    code_delta = arguments_parser.read_new("code")
+                    if code_delta:
+                        yield {
+                            "type": "code",
+                            "format": language,
+                            "content": code_delta,
+                        }
+            else:
+                if llm.interpreter.verbose:
+                    print("Arguments not a dict.")
 
     if os.getenv("INTERPRETER_REQUIRE_AUTHENTICATION", "False").lower() == "true":
         print("function_call_detected", function_call_detected)
@@ -0,0 +1,114 @@
+# Parser states
+_TEXT = 0
+_INFO = 1  # Reading the language after an opening fence, up to the end of the line
+_CODE = 2
+
+
+class CodeFenceParser:
+    """
+    Splits a streamed markdown response into text and code, one chunk at a time.
+
+    Each chunk is scanned once, so the cost is proportional to the chunk, not the whole response.
+    Backticks at the end of a chunk are held back until we know whether they're a fence.
+
+    `feed` returns a list of events:
+        ("message", text)      text outside of a code block
+        ("language", language) a code block started. Non-letters are removed from the language
+        ("code", code)         code inside the current block
+        ("end", None)          the current block was closed
+    """
+
+    def __init__(self):
+        self._state = _TEXT
+        self._ticks = 0  # Backticks we've seen but haven't handled yet
+        self._info = []
+
+    def parse(self, chunks):
+        """
+        Yields the events for every chunk in `chunks`, then for whatever's left at the end.
+        """
+        for chunk in chunks:
+            yield from self.feed(chunk)
+        yield from self.flush()
+
+    def feed(self, chunk):
+        events = []
+        i = 0
+        length = len(chunk)
+
+        while i < length:
+            if self._state == _INFO:
+                newline = chunk.find("\n", i)
+                if newline == -1:
+                    self._info.append(chunk[i:])
+                    break
+                self._info.append(chunk[i:newline])
+                i = newline + 1
+                self._start_code(events)
+                continue
+
+            tick = chunk.find("`", i)
+
+            if self._ticks and tick != i:
+                # A run of backticks from before just ended
+                self._end_ticks(events)
+                continue
+
+            if tick == -1:
+                self._emit(events, chunk[i:])
+                break
+
+            if tick > i:
+                self._emit(events, chunk[i:tick])
+
+            end = tick
+            while end < length and chunk[end] == "`":
+                end += 1
+            self._ticks += end - tick
+            i = end
+
+        return events
+
+    def flush(self):
+        """
+        Handles anything held back, once the stream is over.
+        """
+        events = []
+        if self._ticks:
+            self._end_ticks(events)
+        if self._state == _INFO and self._info:
+            # The response ended on the opening fence's line
+            self._start_code(events)
+        return events
+
+    def _start_code(self, events):
+        # Removes hallucinations containing spaces or non letters
+        language = "".join(char for char in "".join(self._info) if char.isalpha())
+        self._info = []
+        self._state = _CODE
+        events.append(("language", language))
+
+    def _end_ticks(self, events):
+        ticks = self._ticks
+        self._ticks = 0
+
+        if ticks < 3:
+            self._emit(events, "`" * ticks)
+            return
+
+        # Any backticks past the first three are content
+        if ticks > 3:
+            self._emit(events, "`" * (ticks - 3))
+
+        if self._state == _TEXT:
+            self._state = _INFO
+        else:
+            self._state = _TEXT
+            events.append(("end", None))
+
+    def _emit(self, events, text):
+        kind = "message" if self._state == _TEXT else "code"
+        if events and events[-1][0] == kind:
+            events[-1] = (kind, events[-1][1] + text)
+        else:
+            events.append((kind, text))
@@ -0,0 +1,116 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import httpx
+import litellm
+
+# Status codes worth trying again. Anything else (bad requests, context window errors...)
+# will fail the same way every time
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+BASE_DELAY = 0.5
+MAX_DELAY = 30
+
+# Shared by every interpreter in this process
+_lock = threading.Lock()
+_blocked_until = {}  # api_base -> when its last Retry-After runs out
+
+
+def prepare_params(params):
+    """
+    Returns a copy of `params`, ready for litellm.
+    Settings litellm would otherwise read from globals are passed per call instead.
+    """
+    params = dict(params)
+
+    if "local" in params.get("model"):
+        # Kinda hacky, but this helps sometimes
+        params["stop"] = ["<|assistant|>", "<|end|>", "<|eot_id|>"]
+
+    # If we don't do this, litellm will drop conversation_id!
+    params["drop_params"] = not (
+        params.get("model") == "i" and "conversation_id" in params
+    )
+
+    params["model"] = params["model"].replace(":latest", "")
+
+    # We do our own retrying
+    params["num_retries"] = 0
+
+    return params
+
+
+def use_connection_pool():
+    """
+    Gives litellm long-lived HTTP clients to send requests with, unless someone already has.
+    httpx keeps a pool of open connections per host, so each api_base reuses its connections
+    (and TLS sessions) between turns instead of setting up new ones.
+    """
+    with _lock:
+        limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        if litellm.client_session is None:
+            litellm.client_session = httpx.Client(limits=limits, timeout=600)
+        if litellm.aclient_session is None:
+            litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=600)
+
+
+def is_retryable(error):
+    if isinstance(error, (litellm.exceptions.APIConnectionError, litellm.Timeout)):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def retry_delay(attempt, error, api_base=None):
+    """
+    How long to wait before the next attempt. Honors the provider's Retry-After header,
+    otherwise backs off exponentially with full jitter, so interpreters sharing a provider
+    don't all retry at the same moment.
+    """
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        delay = min(retry_after, MAX_DELAY)
+        with _lock:
+            _blocked_until[api_base] = max(
+                _blocked_until.get(api_base, 0), time.time() + delay
+            )
+        return delay
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+
+
+def blocked_for(api_base=None):
+    """
+    How long until requests to `api_base` should be sent again, after a Retry-After.
+    """
+    with _lock:
+        return max(0, _blocked_until.get(api_base, 0) - time.time())
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(
+        error, "litellm_response_headers", None
+    )
+    if not headers:
+        return None
+
+    milliseconds = headers.get("retry-after-ms")
+    if milliseconds:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        # It can also be an HTTP date
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -1,9 +1,10 @@
 import base64
 import io
 import json
-import sys
+import os
 
-from PIL import Image
+from ...utils.image_store import is_stored_image
+from .prepare_image import prepare_image
 
 
 def convert_to_openai_messages(
@@ -12,9 +13,13 @@ def convert_to_openai_messages(
     vision=False,
     shrink_images=True,
     interpreter=None,
+    cache=None,
 ):
     """
     Converts LMC messages into OpenAI messages
+
+    If a `ConversionCache` is passed in, messages that haven't changed since the last call
+    are taken from it instead of being converted again.
     """
     new_messages = []
 
@@ -31,227 +36,62 @@ def convert_to_openai_messages(
 
     #     messages = [message for message in messages if message.get("type") != "code"]
 
+    # Only the last user message gets the user message template, so find it once
+    last_user_message = None
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            last_user_message = message
+            break
+
+    # Everything (besides the message itself) that changes what a message converts to
+    settings = (
+        function_calling,
+        vision,
+        shrink_images,
+        getattr(interpreter, "lossy_images", None),
+        getattr(getattr(interpreter, "llm", None), "model", None),
+        getattr(interpreter, "user_message_template", None),
+        getattr(interpreter, "always_apply_user_message_template", None),
+        getattr(interpreter, "code_output_template", None),
+        getattr(interpreter, "empty_code_output_template", None),
+        getattr(interpreter, "code_output_sender", None),
+    )
+
     for message in messages:
         # Is this for thine eyes?
         if "recipient" in message and message["recipient"] != "assistant":
             continue
 
-        new_message = {}
-
-        if message["type"] == "message":
-            new_message["role"] = message[
-                "role"
-            ]  # This should never be `computer`, right?
-
-            if message["role"] == "user" and (
-                message == [m for m in messages if m["role"] == "user"][-1]
-                or interpreter.always_apply_user_message_template
-            ):
-                # Only add the template for the last message?
-                new_message["content"] = interpreter.user_message_template.replace(
-                    "{content}", message["content"]
-                )
-            else:
-                new_message["content"] = message["content"]
-
-        elif message["type"] == "code":
-            new_message["role"] = "assistant"
-            if function_calling:
-                new_message["function_call"] = {
-                    "name": "execute",
-                    "arguments": json.dumps(
-                        {"language": message["format"], "code": message["content"]}
-                    ),
-                    # parsed_arguments isn't actually an OpenAI thing, it's an OI thing.
-                    # but it's soo useful!
-                    # "parsed_arguments": {
-                    #     "language": message["format"],
-                    #     "code": message["content"],
-                    # },
-                }
-                # Add empty content to avoid error "openai.error.InvalidRequestError: 'content' is a required property - 'messages.*'"
-                # especially for the OpenAI service hosted on Azure
-                new_message["content"] = ""
-            else:
-                new_message[
-                    "content"
-                ] = f"""```{message["format"]}\n{message["content"]}\n```"""
-
-        elif message["type"] == "console" and message["format"] == "output":
-            if function_calling:
-                new_message["role"] = "function"
-                new_message["name"] = "execute"
-                if "content" not in message:
-                    print("What is this??", content)
-                if type(message["content"]) != str:
-                    if interpreter.debug:
-                        print("\n\n\nStrange chunk found:", message, "\n\n\n")
-                    message["content"] = str(message["content"])
-                if message["content"].strip() == "":
-                    new_message[
-                        "content"
-                    ] = "No output"  # I think it's best to be explicit, but we should test this.
-                else:
-                    new_message["content"] = message["content"]
-
-            else:
-                # This should be experimented with.
-                if interpreter.code_output_sender == "user":
-                    if message["content"].strip() == "":
-                        content = interpreter.empty_code_output_template
-                    else:
-                        content = interpreter.code_output_template.replace(
-                            "{content}", message["content"]
-                        )
-
-                    new_message["role"] = "user"
-                    new_message["content"] = content
-                elif interpreter.code_output_sender == "assistant":
-                    new_message["role"] = "assistant"
-                    new_message["content"] = (
-                        "\n```output\n" + message["content"] + "\n```"
-                    )
-
-        elif message["type"] == "image":
-            if message.get("format") == "description":
-                new_message["role"] = message["role"]
-                new_message["content"] = message["content"]
-            else:
-                if vision == False:
-                    # If no vision, we only support the format of "description"
-                    continue
-
-                if "base64" in message["format"]:
-                    # Extract the extension from the format, default to 'png' if not specified
-                    if "." in message["format"]:
-                        extension = message["format"].split(".")[-1]
-                    else:
-                        extension = "png"
+        is_last_user_message = (
+            message.get("role") == "user" and message == last_user_message
+        )
+        key = settings + (is_last_user_message,)
 
-                    encoded_string = message["content"]
-
-                elif message["format"] == "path":
-                    # Convert to base64
-                    image_path = message["content"]
-                    extension = image_path.split(".")[-1]
-
-                    with open(image_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode(
-                            "utf-8"
-                        )
-
-                else:
-                    # Probably would be better to move this to a validation pass
-                    # Near core, through the whole messages object
-                    if "format" not in message:
-                        raise Exception("Format of the image is not specified.")
-                    else:
-                        raise Exception(
-                            f"Unrecognized image format: {message['format']}"
-                        )
-
-                content = f"data:image/{extension};base64,{encoded_string}"
-
-                if shrink_images:
-                    # Shrink to less than 5mb
-
-                    # Calculate size
-                    content_size_bytes = sys.getsizeof(str(content))
-
-                    # Convert the size to MB
-                    content_size_mb = content_size_bytes / (1024 * 1024)
-
-                    # If the content size is greater than 5 MB, resize the image
-                    if content_size_mb > 5:
-                        # Decode the base64 image
-                        img_data = base64.b64decode(encoded_string)
-                        img = Image.open(io.BytesIO(img_data))
-
-                        # Run in a loop to make SURE it's less than 5mb
-                        for _ in range(10):
-                            # Calculate the scale factor needed to reduce the image size to 4.9 MB
-                            scale_factor = (4.9 / content_size_mb) ** 0.5
-
-                            # Calculate the new dimensions
-                            new_width = int(img.width * scale_factor)
-                            new_height = int(img.height * scale_factor)
-
-                            # Resize the image
-                            img = img.resize((new_width, new_height))
-
-                            # Convert the image back to base64
-                            buffered = io.BytesIO()
-                            img.save(buffered, format=extension)
-                            encoded_string = base64.b64encode(
-                                buffered.getvalue()
-                            ).decode("utf-8")
-
-                            # Set the content
-                            content = f"data:image/{extension};base64,{encoded_string}"
-
-                            # Recalculate the size of the content in bytes
-                            content_size_bytes = sys.getsizeof(str(content))
-
-                            # Convert the size to MB
-                            content_size_mb = content_size_bytes / (1024 * 1024)
-
-                            if content_size_mb < 5:
-                                break
-                        else:
-                            print(
-                                "Attempted to shrink the image but failed. Sending to the LLM anyway."
-                            )
-
-                new_message = {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": content, "detail": "low"},
-                        }
-                    ],
-                }
-
-                if message["role"] == "computer":
-                    new_message["content"].append(
-                        {
-                            "type": "text",
-                            "text": "This image is the result of the last tool output. What does it mean / are we done?",
-                        }
-                    )
-                if message.get("format") == "path":
-                    if any(
-                        content.get("type") == "text"
-                        for content in new_message["content"]
-                    ):
-                        for content in new_message["content"]:
-                            if content.get("type") == "text":
-                                content["text"] += (
-                                    "\nThis image is at this path: "
-                                    + message["content"]
-                                )
-                    else:
-                        new_message["content"].append(
-                            {
-                                "type": "text",
-                                "text": "This image is at this path: "
-                                + message["content"],
-                            }
-                        )
-
-        elif message["type"] == "file":
-            new_message = {"role": "user", "content": message["content"]}
-        elif message["type"] == "error":
-            print("Ignoring 'type' == 'error' messages.")
-            continue
+        if cache is not None:
+            found, new_message = cache.get(message, key)
         else:
-            raise Exception(f"Unable to convert this message type: {message}")
+            found = False
+
+        if not found:
+            new_message = _convert_message(
+                message,
+                function_calling=function_calling,
+                vision=vision,
+                shrink_images=shrink_images,
+                interpreter=interpreter,
+                is_last_user_message=is_last_user_message,
+            )
+            if cache is not None:
+                cache.set(message, key, new_message)
 
-        if isinstance(new_message["content"], str):
-            new_message["content"] = new_message["content"].strip()
+        if new_message is None:
+            continue
 
         new_messages.append(new_message)
 
+    if cache is not None:
+        cache.prune()
+
     if function_calling == False:
         combined_messages = []
         current_role = None
@@ -287,3 +127,258 @@ def convert_to_openai_messages(
         new_messages = combined_messages
 
     return new_messages
+
+
+def _convert_message(
+    message,
+    function_calling,
+    vision,
+    shrink_images,
+    interpreter,
+    is_last_user_message,
+):
+    """
+    Converts a single LMC message into an OpenAI message, or None if it should be left out.
+    """
+    new_message = {}
+
+    if message["type"] == "message":
+        new_message["role"] = message["role"]  # This should never be `computer`, right?
+
+        if message["role"] == "user" and (
+            is_last_user_message or interpreter.always_apply_user_message_template
+        ):
+            # Only add the template for the last message?
+            new_message["content"] = interpreter.user_message_template.replace(
+                "{content}", message["content"]
+            )
+        else:
+            new_message["content"] = message["content"]
+
+    elif message["type"] == "code":
+        new_message["role"] = "assistant"
+        if function_calling:
+            new_message["function_call"] = {
+                "name": "execute",
+                "arguments": json.dumps(
+                    {"language": message["format"], "code": message["content"]}
+                ),
+                # parsed_arguments isn't actually an OpenAI thing, it's an OI thing.
+                # but it's soo useful!
+                # "parsed_arguments": {
+                #     "language": message["format"],
+                #     "code": message["content"],
+                # },
+            }
+            # Add empty content to avoid error "openai.error.InvalidRequestError: 'content' is a required property - 'messages.*'"
+            # especially for the OpenAI service hosted on Azure
+            new_message["content"] = ""
+        else:
+            new_message[
+                "content"
+            ] = f"""```{message["format"]}\n{message["content"]}\n```"""
+
+    elif message["type"] == "console" and message["format"] == "output":
+        if function_calling:
+            new_message["role"] = "function"
+            new_message["name"] = "execute"
+            if "content" not in message:
+                print("What is this??", content)
+            if type(message["content"]) != str:
+                if interpreter.debug:
+                    print("\n\n\nStrange chunk found:", message, "\n\n\n")
+                message["content"] = str(message["content"])
+            if message["content"].strip() == "":
+                new_message[
+                    "content"
+                ] = "No output"  # I think it's best to be explicit, but we should test this.
+            else:
+                new_message["content"] = message["content"]
+
+        else:
+            # This should be experimented with.
+            if interpreter.code_output_sender == "user":
+                if message["content"].strip() == "":
+                    content = interpreter.empty_code_output_template
+                else:
+                    content = interpreter.code_output_template.replace(
+                        "{content}", message["content"]
+                    )
+
+                new_message["role"] = "user"
+                new_message["content"] = content
+            elif interpreter.code_output_sender == "assistant":
+                new_message["role"] = "assistant"
+                new_message["content"] = "\n```output\n" + message["content"] + "\n```"
+
+    elif message["type"] == "image":
+        if message.get("format") == "description":
+            new_message["role"] = message["role"]
+            new_message["content"] = message["content"]
+        else:
+            if vision == False:
+                # If no vision, we only support the format of "description"
+                return None
+
+            if "base64" in message["format"]:
+                # Extract the extension from the format, default to 'png' if not specified
+                if "." in message["format"]:
+                    extension = message["format"].split(".")[-1]
+                else:
+                    extension = "png"
+
+                encoded_string = message["content"]
+
+            elif is_stored_image(message):
+                extension = message["format"].split(".")[-1]
+                try:
+                    encoded_string = interpreter.image_store.get_base64(
+                        message["content"]
+                    )
+                except OSError:
+                    new_message["role"] = "user"
+                    new_message[
+                        "content"
+                    ] = "(An image was here, but it's no longer available.)"
+                    return new_message
+
+            elif message["format"] == "path":
+                # Convert to base64
+                image_path = message["content"]
+                extension = image_path.split(".")[-1]
+
+                with open(image_path, "rb") as image_file:
+                    encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
+
+            else:
+                # Probably would be better to move this to a validation pass
+                # Near core, through the whole messages object
+                if "format" not in message:
+                    raise Exception("Format of the image is not specified.")
+                else:
+                    raise Exception(f"Unrecognized image format: {message['format']}")
+
+            if shrink_images:
+                # Fit it in 5mb and the provider's pixel limits (remembered, so this is cheap after the first turn)
+                extension, encoded_string = prepare_image(
+                    encoded_string,
+                    extension,
+                    model=interpreter.llm.model,
+                    lossy=getattr(interpreter, "lossy_images", False),
+                    image_hash=message["content"] if is_stored_image(message) else None,
+                )
+
+            content = f"data:image/{extension};base64,{encoded_string}"
+
+            new_message = {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": content, "detail": "low"},
+                    }
+                ],
+            }
+
+            if message["role"] == "computer":
+                new_message["content"].append(
+                    {
+                        "type": "text",
+                        "text": "This image is the result of the last tool output. What does it mean / are we done?",
+                    }
+                )
+            if message.get("format") == "path":
+                if any(
+                    content.get("type") == "text" for content in new_message["content"]
+                ):
+                    for content in new_message["content"]:
+                        if content.get("type") == "text":
+                            content["text"] += (
+                                "\nThis image is at this path: " + message["content"]
+                            )
+                else:
+                    new_message["content"].append(
+                        {
+                            "type": "text",
+                            "text": "This image is at this path: " + message["content"],
+                        }
+                    )
+
+    elif message["type"] == "file":
+        new_message = {"role": "user", "content": message["content"]}
+    elif message["type"] == "error":
+        print("Ignoring 'type' == 'error' messages.")
+        return None
+    else:
+        raise Exception(f"Unable to convert this message type: {message}")
+
+    if isinstance(new_message["content"], str):
+        new_message["content"] = new_message["content"].strip()
+
+    return new_message
+
+
+class ConversionCache:
+    """
+    Remembers what each LMC message was converted into.
+
+    Entries are keyed by the message's identity and checked against a snapshot of its contents
+    (plus the conversion settings), so edited messages are converted again. Image files are also
+    checked against their modification time, so we don't re-read and re-encode them every turn.
+    """
+
+    def __init__(self):
+        self._entries = {}  # id(message) -> (message, fingerprint, new_message)
+        self._used = set()
+
+    def get(self, message, key):
+        entry = self._entries.get(id(message))
+        if entry is not None and entry[0] is message:
+            fingerprint = _fingerprint(message, key)
+            if fingerprint is not None and fingerprint == entry[1]:
+                self._used.add(id(message))
+                # Callers (and the LLM runners) modify these, so hand out a copy
+                return True, _copy(entry[2])
+        return False, None
+
+    def set(self, message, key, new_message):
+        fingerprint = _fingerprint(message, key)
+        if fingerprint is None:
+            return
+        self._entries[id(message)] = (message, fingerprint, _copy(new_message))
+        self._used.add(id(message))
+
+    def prune(self):
+        """
+        Forgets messages that weren't part of the last conversion.
+        """
+        self._entries = {
+            message_id: entry
+            for message_id, entry in self._entries.items()
+            if message_id in self._used
+        }
+        self._used = set()
+
+
+def _fingerprint(message, key):
+    values = tuple(message.items())
+    for _, value in values:
+        if not isinstance(value, (str, int, float, bool, type(None))):
+            # Could be changed in place without us noticing
+            return None
+
+    if message.get("type") == "image" and message.get("format") == "path":
+        try:
+            values += (os.stat(message["content"]).st_mtime_ns,)
+        except OSError:
+            return None
+
+    return values + key
+
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ...utils.image_store import is_stored_image
+
+
+class ImageDescriber:
+    """
+    Describes images for LLMs that can't see them, using a vision renderer (Moondream by default)
+    and OCR.
+
+    Each image's description and OCR run as separate jobs in a thread pool, so they happen at the
+    same time as each other and as the other images'. Results are remembered by the image's hash,
+    so a screenshot we've seen before is described instantly.
+    """
+
+    def __init__(self, max_workers=4, max_entries=256):
+        self.max_workers = max_workers
+        self.max_entries = max_entries
+        self._executor = None
+        self._results = OrderedDict()  # (function, image key) -> Future
+        self._lock = threading.Lock()
+
+    def describe(self, lmc, renderer, ocr, key=None):
+        """
+        Starts describing the image in `lmc` (a base64 or path image message).
+        Returns a future for `(description, ocr)`.
+        """
+        if key is None:
+            key = image_key(lmc)
+        description = self._run(renderer, lmc, key)
+        text = self._run(ocr, lmc, key)
+
+        both = Future()
+
+        def done(_):
+            if not (description.done() and text.done()) or both.done():
+                return
+            for future in (description, text):
+                if future.exception() is not None:
+                    _set(both, exception=future.exception())
+                    return
+            _set(both, result=(description.result(), text.result()))
+
+        description.add_done_callback(done)
+        text.add_done_callback(done)
+        return both
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def _run(self, function, lmc, key):
+        cache_key = (function, key)
+        with self._lock:
+            if cache_key in self._results:
+                # Done, or still running for an earlier message
+                self._results.move_to_end(cache_key)
+                return self._results[cache_key]
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="image-describer"
+                )
+            future = self._executor.submit(function, lmc=lmc)
+            self._results[cache_key] = future
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+        def forget_failures(future):
+            if future.exception() is not None:
+                with self._lock:
+                    if self._results.get(cache_key) is future:
+                        del self._results[cache_key]
+
+        future.add_done_callback(forget_failures)
+        return future
+
+
+def image_key(lmc):
+    """
+    Something that identifies the image in an image message, without keeping it in memory.
+    """
+    if is_stored_image(lmc):
+        return lmc["content"]  # Already its hash
+    if lmc.get("format") == "path":
+        try:
+            stat = os.stat(lmc["content"])
+            return (lmc["content"], stat.st_mtime, stat.st_size)
+        except OSError:
+            return (lmc["content"], None, None)
+    return hashlib.blake2b(
+        str(lmc.get("content")).encode("utf-8"), digest_size=16
+    ).hexdigest()
+
+
+def _set(future, result=None, exception=None):
+    # Both callbacks can get here at once
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except Exception:
+        pass
@@ -0,0 +1,285 @@
+import json
+import re
+
+# Inside a JSON string, the only characters that need special handling are the
+# closing quote and the escape character. Everything else is copied verbatim.
+_STRING_SPECIAL = re.compile(r'["\\]')
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+# Parser states
+_START = 0
+_EXPECT_KEY = 1
+_IN_KEY = 2
+_EXPECT_COLON = 3
+_EXPECT_VALUE = 4
+_IN_STRING_VALUE = 5
+_IN_RAW_VALUE = 6
+_EXPECT_COMMA = 7
+_DONE = 8
+_FAILED = 9
+
+
+class IncrementalJsonParser:
+    """
+    A resumable parser for a streamed JSON object, like the `arguments` of a tool call.
+
+    Unlike `parse_partial_json`, which re-parses the whole accumulated string on every chunk,
+    this keeps its position between calls to `feed`, so each character is only looked at once.
+
+    Top-level string values are decoded as they arrive, which lets callers pull out only the
+    new characters of a value (e.g. `code`) with `read_new`. Any other value (numbers, nested
+    objects...) is buffered and handed to `json.loads` once it's complete.
+    """
+
+    def __init__(self):
+        self.values = {}  # Decoded values. Strings may still be partial
+        self.completed = set()  # Keys whose values have been fully received
+        self.failed = False
+
+        self._state = _START
+        self._key = None
+        self._chars = []  # Fragments of the key or string value being decoded
+        self._read_fragment = 0  # How many of `_chars` `read_new` has returned
+        self._escape = None  # Pending (possibly partial) escape sequence, e.g. "\\u00"
+        self._high_surrogate = None
+        self._raw = []  # Fragments of a non-string value being buffered
+        self._raw_depth = 0
+        self._raw_in_string = False
+        self._raw_escaped = False
+        self._read_positions = {}
+
+    def feed(self, chunk):
+        """
+        Pushes the next piece of the JSON string into the parser.
+        """
+        if not chunk or self._state in (_DONE, _FAILED):
+            return
+
+        i = 0
+        length = len(chunk)
+
+        while i < length:
+            state = self._state
+
+            if state == _IN_STRING_VALUE or state == _IN_KEY:
+                i = self._consume_string(chunk, i)
+                continue
+
+            if state == _IN_RAW_VALUE:
+                i = self._consume_raw(chunk, i)
+                continue
+
+            char = chunk[i]
+            i += 1
+
+            if char in " \t\r\n":
+                continue
+
+            if state == _START:
+                if char == "{":
+                    self._state = _EXPECT_KEY
+                else:
+                    self._fail()
+            elif state == _EXPECT_KEY:
+                if char == '"':
+                    self._state = _IN_KEY
+                    self._chars = []
+                elif char == "}":
+                    self._state = _DONE
+                else:
+                    self._fail()
+            elif state == _EXPECT_COLON:
+                if char == ":":
+                    self._state = _EXPECT_VALUE
+                else:
+                    self._fail()
+            elif state == _EXPECT_VALUE:
+                if char == '"':
+                    self._state = _IN_STRING_VALUE
+                    self._chars = []
+                    self._read_fragment = 0
+                    self.values[self._key] = ""
+                else:
+                    self._state = _IN_RAW_VALUE
+                    self._raw = []
+                    self._raw_depth = 0
+                    self._raw_in_string = False
+                    self._raw_escaped = False
+                    i -= 1  # Let the raw consumer see this character too
+            elif state == _EXPECT_COMMA:
+                if char == ",":
+                    self._state = _EXPECT_KEY
+                elif char == "}":
+                    self._state = _DONE
+                else:
+                    self._fail()
+
+            if self._state == _FAILED:
+                return
+
+    def read_new(self, key):
+        """
+        Returns the characters of `key`'s string value that arrived since the last call.
+        """
+        position = self._read_positions.get(key, 0)
+
+        if key == self._key and self._state == _IN_STRING_VALUE:
+            # Only join the fragments we haven't handed out yet
+            new = "".join(self._chars[self._read_fragment :])
+            self._read_fragment = len(self._chars)
+            self._read_positions[key] = position + len(new)
+            return new
+
+        value = self.values.get(key)
+        if not isinstance(value, str):
+            return ""
+        self._read_positions[key] = len(value)
+        return value[position:]
+
+    def get(self, key, default=None):
+        """
+        Returns the (possibly partial) value of `key`.
+        """
+        if key == self._key and self._state == _IN_STRING_VALUE:
+            return "".join(self._chars)
+        return self.values.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    @property
+    def done(self):
+        return self._state == _DONE
+
+    def _fail(self):
+        self._state = _FAILED
+        self.failed = True
+
+    def _consume_string(self, chunk, i):
+        length = len(chunk)
+
+        while i < length:
+            if self._escape is not None:
+                i = self._consume_escape(chunk, i)
+                continue
+
+            match = _STRING_SPECIAL.search(chunk, i)
+            end = match.start() if match else length
+            if end > i:
+                self._flush_surrogate()
+                self._chars.append(chunk[i:end])
+            if not match:
+                return length
+
+            i = end + 1
+            if match.group() == "\\":
+                self._escape = "\\"
+            else:
+                self._flush_surrogate()
+                self._end_string()
+                return i
+
+        return i
+
+    def _consume_escape(self, chunk, i):
+        self._escape += chunk[i]
+        i += 1
+
+        escape = self._escape
+        if len(escape) == 2 and escape[1] != "u":
+            self._flush_surrogate()
+            # Unknown escapes are kept as-is rather than failing the whole stream
+            self._chars.append(_SIMPLE_ESCAPES.get(escape[1], escape[1]))
+            self._escape = None
+        elif len(escape) == 6:
+            self._escape = None
+            try:
+                code_point = int(escape[2:], 16)
+            except ValueError:
+                self._flush_surrogate()
+                self._chars.append(escape)
+                return i
+
+            if 0xD800 <= code_point < 0xDC00:
+                self._flush_surrogate()
+                self._high_surrogate = code_point
+            elif 0xDC00 <= code_point < 0xE000 and self._high_surrogate is not None:
+                combined = (
+                    0x10000
+                    + ((self._high_surrogate - 0xD800) << 10)
+                    + (code_point - 0xDC00)
+                )
+                self._high_surrogate = None
+                self._chars.append(chr(combined))
+            else:
+                self._flush_surrogate()
+                self._chars.append(chr(code_point))
+
+        return i
+
+    def _flush_surrogate(self):
+        if self._high_surrogate is not None:
+            self._chars.append(chr(self._high_surrogate))
+            self._high_surrogate = None
+
+    def _end_string(self):
+        text = "".join(self._chars)
+        self._chars = []
+
+        if self._state == _IN_KEY:
+            self._key = text
+            self._state = _EXPECT_COLON
+        else:
+            self.values[self._key] = text
+            self.completed.add(self._key)
+            self._state = _EXPECT_COMMA
+
+    def _consume_raw(self, chunk, i):
+        start = i
+        length = len(chunk)
+
+        while i < length:
+            char = chunk[i]
+
+            if self._raw_in_string:
+                if self._raw_escaped:
+                    self._raw_escaped = False
+                elif char == "\\":
+                    self._raw_escaped = True
+                elif char == '"':
+                    self._raw_in_string = False
+            elif char == '"':
+                self._raw_in_string = True
+            elif char in "{[":
+                self._raw_depth += 1
+            elif char in "}]" and self._raw_depth > 0:
+                self._raw_depth -= 1
+            elif self._raw_depth == 0 and char in ",}":
+                # End of a top-level scalar (or of the last nested value)
+                self._raw.append(chunk[start:i])
+                self._end_raw()
+                return i
+
+            i += 1
+
+        self._raw.append(chunk[start:i])
+        return i
+
+    def _end_raw(self):
+        try:
+            self.values[self._key] = json.loads("".join(self._raw))
+            self.completed.add(self._key)
+            self._state = _EXPECT_COMMA
+        except ValueError:
+            self._fail()
+        self._raw = []
@@ -20,3 +20,90 @@ def merge_deltas(original, delta):
                     merge_deltas(original[key], value)
 
     return original
+
+
+class StringAccumulator:
+    """
+    A string that's built up from streamed fragments.
+
+    Fragments are appended to a list and only joined when the full string is asked for,
+    so growing it is O(len(fragment)) rather than a copy of everything received so far.
+    """
+
+    __slots__ = ("_fragments", "_length", "_read_position", "_read_fragment")
+
+    def __init__(self):
+        self._fragments = []
+        self._length = 0
+        self._read_position = 0
+        # Index of the first fragment `read_new` hasn't returned
+        self._read_fragment = 0
+
+    def append(self, fragment):
+        if fragment:
+            self._fragments.append(fragment)
+            self._length += len(fragment)
+
+    def read_new(self):
+        """
+        Returns everything appended since the last call.
+        """
+        if self._read_position == self._length:
+            return ""
+        if self._read_fragment is None:
+            # The fragments were joined mid-read, so fall back to slicing
+            new = str(self)[self._read_position :]
+        else:
+            new = "".join(self._fragments[self._read_fragment :])
+        self._read_fragment = len(self._fragments)
+        self._read_position = self._length
+        return new
+
+    def __str__(self):
+        if len(self._fragments) > 1:
+            # Cache the join so repeated reads don't redo it
+            self._fragments = ["".join(self._fragments)]
+            self._read_fragment = 1 if self._read_position == self._length else None
+        return self._fragments[0] if self._fragments else ""
+
+    def __len__(self):
+        return self._length
+
+    def __bool__(self):
+        return self._length > 0
+
+
+class DeltaAccumulator:
+    """
+    Like `merge_deltas`, but without copying the accumulated strings on every chunk.
+
+    The fields we stream a lot of (`content`, `function_call.name` and `function_call.arguments`)
+    get their own `StringAccumulator`. Anything else falls back to `merge_deltas`.
+    """
+
+    __slots__ = ("content", "name", "arguments", "has_function_call", "other")
+
+    def __init__(self):
+        self.content = StringAccumulator()
+        self.name = StringAccumulator()
+        self.arguments = StringAccumulator()
+        self.has_function_call = False
+        self.other = {}
+
+    def add(self, delta):
+        for key, value in dict(delta).items():
+            if value is None:
+                continue
+            if key == "content":
+                self.content.append(value)
+            elif key == "function_call":
+                self.has_function_call = True
+                if isinstance(value, dict):
+                    name, arguments = value.get("name"), value.get("arguments")
+                else:
+                    name = getattr(value, "name", None)
+                    arguments = getattr(value, "arguments", None)
+                self.name.append(name)
+                self.arguments.append(arguments)
+            else:
+                merge_deltas(self.other, {key: value})
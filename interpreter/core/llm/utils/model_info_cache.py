@@ -0,0 +1,102 @@
+import json
+import os
+import threading
+from importlib.metadata import PackageNotFoundError, version
+
+from ....terminal_interface.utils.local_storage_path import get_storage_path
+
+# Bump this whenever what we store (or how we probe for it) changes
+CACHE_VERSION = 1
+_VERSION = None
+
+
+class ModelInfoCache:
+    """
+    Remembers what we've learned about a model (whether it supports functions or vision, its
+    context window, whether Ollama has it downloaded...) across runs, so we don't probe for it
+    on every start.
+
+    Entries are keyed by model and api_base. The whole file is thrown away if it was written by a
+    different cache version or litellm version, since either can change the answers.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_storage_path("model_info.json")
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def get(self, model, api_base=None):
+        """
+        Returns everything we know about `model` at `api_base`, or an empty dict.
+        """
+        self._load()
+        return dict(self._entries.get(_key(model, api_base), {}))
+
+    def update(self, model, api_base=None, **info):
+        """
+        Merges `info` into the entry for `model` at `api_base`, and saves it to disk.
+        """
+        self._load()
+        with self._lock:
+            entry = self._entries.setdefault(_key(model, api_base), {})
+            if all(entry.get(key) == value for key, value in info.items()):
+                return
+            entry.update(info)
+            self._save()
+
+    def forget(self, model, api_base=None):
+        """
+        Drops the entry for `model` at `api_base`, so it's probed again.
+        """
+        self._load()
+        with self._lock:
+            if self._entries.pop(_key(model, api_base), None) is not None:
+                self._save()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._save()
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        with self._lock:
+            if self._entries is not None:
+                return
+            entries = {}
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                if data.get("version") == _version():
+                    entries = data.get("models", {})
+            except (OSError, ValueError, AttributeError):
+                pass
+            self._entries = entries
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write to a temporary file first, so a crash never leaves half a file behind
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"version": _version(), "models": self._entries}, f)
+            os.replace(temp_path, self.path)
+        except OSError:
+            # Not being able to cache is fine, we'll just probe again next time
+            pass
+
+
+def _key(model, api_base):
+    return f"{model}|{api_base or ''}"
+
+
+def _version():
+    global _VERSION
+    if _VERSION is None:
+        try:
+            litellm_version = version("litellm")
+        except PackageNotFoundError:
+            litellm_version = "unknown"
+        _VERSION = f"{CACHE_VERSION}:{litellm_version}"
+    return _VERSION
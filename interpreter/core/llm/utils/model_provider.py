@@ -0,0 +1,11 @@
+def model_provider(model):
+    """
+    Which provider's rules (image costs and sizes, prompt caching) apply to `model`:
+    "anthropic", "gemini", or "openai" for everything else.
+    """
+    model = (model or "").lower()
+    if "claude" in model or "anthropic" in model:
+        return "anthropic"
+    if "gemini" in model:
+        return "gemini"
+    return "openai"
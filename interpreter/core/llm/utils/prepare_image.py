@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import io
+from collections import OrderedDict
+
+from PIL import Image, features
+
+from .model_provider import model_provider
+
+MAX_IMAGE_BYTES = 5 * 1024 * 1024  # Per image, as a data URL
+
+# Providers scale bigger images down to these anyway, so there's no point sending more pixels
+MAX_IMAGE_SIZE = {
+    "openai": {"side": 2048},
+    "anthropic": {"side": 1568, "pixels": 1150000},
+    "gemini": {"side": 3072},
+}
+
+CACHE_BYTES = 64 * 1024 * 1024
+CACHE_ENTRIES = 1024
+
+_PIL_FORMATS = {
+    "jpg": "JPEG",
+    "jpeg": "JPEG",
+    "png": "PNG",
+    "webp": "WEBP",
+    "gif": "GIF",
+}
+
+_cache = (
+    OrderedDict()
+)  # (image hash, max bytes, lossy, provider) -> (extension, encoded) or None
+_cached_bytes = 0
+
+
+def prepare_image(
+    encoded_string,
+    extension,
+    model=None,
+    max_bytes=MAX_IMAGE_BYTES,
+    lossy=False,
+    image_hash=None,
+):
+    """
+    Returns `(extension, encoded_string)` for a base64 image that fits in `max_bytes` and in the
+    pixel limits of the provider serving `model`. With `lossy`, images that have to be re-encoded
+    are saved as WebP (or JPEG), which is usually far smaller than PNG.
+
+    Results are remembered by the image's hash (pass `image_hash` if you already have one), so
+    an image that's sent every turn is only decoded and resized the first time.
+    """
+    if image_hash is None:
+        image_hash = hashlib.blake2b(
+            encoded_string.encode("utf-8"), digest_size=16
+        ).hexdigest()
+    key = (image_hash, max_bytes, lossy, model_provider(model))
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        prepared = _cache[key]
+    else:
+        try:
+            prepared = _shrink(encoded_string, extension, key[3], max_bytes, lossy)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # Not something PIL can read, so let the LLM deal with it
+            return extension, encoded_string
+        _remember(key, prepared)
+
+    if prepared is None:
+        # Already fine as it is
+        return extension, encoded_string
+    return prepared
+
+
+def _shrink(encoded_string, extension, provider, max_bytes, lossy):
+    """
+    Returns `(extension, encoded_string)` for the shrunk image, or None if it doesn't need shrinking.
+    """
+    budget = max_bytes - len("data:image/webp;base64,")  # In base64 characters
+
+    img = Image.open(io.BytesIO(base64.b64decode(encoded_string)))
+    width, height = img.size
+
+    # Work out the scale in one go: whatever the provider would shrink it to...
+    scale = 1.0
+    limits = MAX_IMAGE_SIZE.get(provider, {})
+    if "side" in limits:
+        scale = min(scale, limits["side"] / max(width, height))
+    if "pixels" in limits:
+        scale = min(scale, (limits["pixels"] / (width * height)) ** 0.5)
+
+    if lossy:
+        pil_format = "WEBP" if features.check("webp") else "JPEG"
+        new_extension = pil_format.lower()
+        if scale >= 1 and len(encoded_string) <= budget:
+            return None
+    else:
+        pil_format = _PIL_FORMATS.get(extension.lower(), "PNG")
+        new_extension = extension
+        # ...and, since the encoded size goes with the number of pixels, small enough to fit
+        if len(encoded_string) > budget:
+            scale = min(scale, 0.95 * (budget / len(encoded_string)) ** 0.5)
+        if scale >= 1:
+            return None
+
+    # That guess is almost always right, but check, and correct it by how far off it was
+    for _ in range(3):
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        encoded = _encode(
+            img.resize(size, Image.LANCZOS) if scale < 1 else img, pil_format
+        )
+        if len(encoded) <= budget:
+            break
+        scale = min(scale, 1.0) * 0.95 * (budget / len(encoded)) ** 0.5
+    else:
+        print("Attempted to shrink the image but failed. Sending to the LLM anyway.")
+
+    return new_extension, encoded
+
+
+def _encode(img, pil_format):
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    elif pil_format == "WEBP" and img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+    buffered = io.BytesIO()
+    if pil_format in ("JPEG", "WEBP"):
+        img.save(buffered, format=pil_format, quality=85)
+    else:
+        img.save(buffered, format=pil_format)
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def _remember(key, prepared):
+    global _cached_bytes
+    size = len(prepared[1]) if prepared else 0
+    if size > CACHE_BYTES:
+        return
+    _cache[key] = prepared
+    _cached_bytes += size
+    while _cached_bytes > CACHE_BYTES or len(_cache) > CACHE_ENTRIES:
+        _, evicted = _cache.popitem(last=False)
+        _cached_bytes -= len(evicted[1]) if evicted else 0
@@ -0,0 +1,86 @@
+import copy
+
+from .model_provider import model_provider
+
+# Anthropic lets us mark up to 4 cache breakpoints per request
+MAX_CACHE_BREAKPOINTS = 4
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_cache_breakpoints(model):
+    """
+    Whether the provider serving `model` needs explicit cache breakpoints.
+    (OpenAI, DeepSeek etc. cache long prefixes automatically, so they don't.)
+    """
+    return model_provider(model) == "anthropic"
+
+
+def add_cache_breakpoints(messages, model):
+    """
+    Marks the system message and the last two user messages as cache breakpoints,
+    so the provider can reuse everything before them on the next turn.
+
+    Returns new messages. The originals are left alone.
+    """
+    if not supports_cache_breakpoints(model):
+        return messages
+
+    messages = list(messages)
+    breakpoints = []
+    if messages and messages[0]["role"] == "system":
+        breakpoints.append(0)
+    user_indexes = [i for i, m in enumerate(messages) if m["role"] == "user"]
+    breakpoints += user_indexes[-2:]
+
+    for i in breakpoints[:MAX_CACHE_BREAKPOINTS]:
+        message = copy.copy(messages[i])
+        content = message.get("content")
+        if isinstance(content, str):
+            if not content:
+                # Empty text blocks can't be cached
+                continue
+            message["content"] = [
+                {"type": "text", "text": content, "cache_control": CACHE_CONTROL}
+            ]
+        elif isinstance(content, list) and content:
+            content = [dict(part) for part in content]
+            content[-1]["cache_control"] = CACHE_CONTROL
+            message["content"] = content
+        else:
+            continue
+        messages[i] = message
+
+    return messages
+
+
+def record_cache_usage(llm, chunk):
+    """
+    Pulls prompt cache hits and misses out of a streamed chunk's `usage`, if it has one,
+    and stores them on `llm.cache_usage`.
+    """
+    usage = _get(chunk, "usage")
+    if not usage:
+        return
+
+    prompt_tokens = _get(usage, "prompt_tokens") or 0
+    cache_write_tokens = _get(usage, "cache_creation_input_tokens") or 0
+    cache_hit_tokens = _get(usage, "cache_read_input_tokens") or 0
+    if not cache_hit_tokens:
+        # OpenAI-style
+        details = _get(usage, "prompt_tokens_details")
+        cache_hit_tokens = (_get(details, "cached_tokens") if details else 0) or 0
+
+    llm.cache_usage = {
+        "cache_hit_tokens": cache_hit_tokens,
+        "cache_miss_tokens": max(prompt_tokens - cache_hit_tokens, 0),
+        "cache_write_tokens": cache_write_tokens,
+    }
+
+    if llm.interpreter.verbose:
+        print("Prompt cache usage:", llm.cache_usage)
+
+
+def _get(obj, key):
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
@@ -0,0 +1,304 @@
+import base64
+import math
+from collections import OrderedDict
+
+from tokentrim.model_map import MODEL_MAX_TOKENS
+from tokentrim.tokentrim import get_encoding
+
+from .model_provider import model_provider
+
+# How many tokens an image costs, per provider. We always send images with detail: low,
+# but providers that ignore that setting bill by size instead.
+IMAGE_TOKEN_COSTS = {
+    "openai": {"low": 85, "tile": 170, "base": 85},
+    "anthropic": {"pixels_per_token": 750, "max": 1600},
+    "gemini": {"flat": 258},
+}
+DEFAULT_IMAGE_TOKENS = 765  # An OpenAI high detail 1024x1024 image, when we can't tell
+
+
+class MessageTrimmer:
+    """
+    Trims OpenAI-style messages to fit in a context window, like `tokentrim.trim`.
+
+    Token counts are cached per message (keyed by its contents and the tokenizer), so each turn
+    only tokenizes messages that are new. Image parts are counted with a per-provider cost model
+    rather than by tokenizing their base64.
+    """
+
+    def __init__(self, max_cached_messages=10000, headroom=0.75):
+        self.max_cached_messages = max_cached_messages
+        self.headroom = headroom
+        self._counts = OrderedDict()
+        # Where the last stable trim started: (index, first kept message)
+        self._start = None
+
+    def trim(self, messages, system_message, max_tokens, model=None, stable=False):
+        """
+        Returns the system message followed by as many of the newest messages as fit in `max_tokens`.
+        The oldest message that doesn't fit is shortened from the middle, if it's plain text.
+
+        With `stable=True` the start of the kept messages only moves when it has to. When it does,
+        we trim down to `headroom` of the budget, so the prefix stays byte-identical (and cacheable
+        by the provider) for the next few turns instead of shifting every turn. Messages aren't
+        shortened in this mode (they'd be different every turn), unless not even the newest fits.
+        """
+        encoding = get_encoding(model)
+        tokens_per_message, tokens_per_name = _message_overhead(model)
+
+        def count(message):
+            return self.count(
+                message, model, encoding, tokens_per_message, tokens_per_name
+            )
+
+        system_message_event = {"role": "system", "content": system_message}
+
+        if system_message:
+            system_tokens = count(system_message_event)
+            if system_tokens > max_tokens:
+                print(
+                    "Warning: the system message exceeds the token limit, which is probably undesired. Trimming..."
+                )
+                system_message_event = _shorten(
+                    system_message_event, max_tokens, count, encoding
+                )
+                system_tokens = count(system_message_event)
+            max_tokens -= system_tokens
+
+        if 3 + sum(count(message) for message in messages) <= max_tokens:
+            # Everything fits (a new or replaced conversation, if we'd trimmed before)
+            self._start = None
+            if system_message:
+                return [system_message_event] + messages
+            return list(messages)
+
+        if stable and self._start is not None:
+            # Keep the same start as last time, if it's the same conversation (the message we started
+            # at is still there) and everything after it still fits
+            start, first_message = self._start
+            if start < len(messages) and _freeze(messages[start]) == first_message:
+                final_messages = messages[start:]
+                total = 3 + sum(count(message) for message in final_messages)
+                if total <= max_tokens:
+                    if system_message:
+                        final_messages = [system_message_event] + final_messages
+                    return final_messages
+
+        budget = max_tokens
+        if stable:
+            budget = int(max_tokens * self.headroom)
+
+        # Walk back from the newest message, keeping a running total
+        total = 3  # Every reply is primed with a few tokens
+        kept = 0
+        for message in reversed(messages):
+            message_tokens = count(message)
+            if total + message_tokens > budget:
+                break
+            total += message_tokens
+            kept += 1
+
+        final_messages = messages[len(messages) - kept :] if kept else []
+
+        if stable and kept:
+            # A shortened message would be different every turn, so don't bother
+            start = len(messages) - kept
+            self._start = (start, _freeze(messages[start]))
+        else:
+            # In stable mode, only when nothing fit at all. A shortened newest message beats none
+            self._start = None
+            # Try to squeeze a shortened version of the next message in
+            message = messages[len(messages) - kept - 1]
+            if "function_call" not in message and isinstance(
+                message.get("content"), str
+            ):
+                message = _shorten(message, max_tokens - total, count, encoding)
+                if total + count(message) <= max_tokens:
+                    final_messages = [message] + final_messages
+
+        if system_message:
+            final_messages = [system_message_event] + final_messages
+
+        return final_messages
+
+    def count(
+        self,
+        message,
+        model=None,
+        encoding=None,
+        tokens_per_message=None,
+        tokens_per_name=None,
+    ):
+        """
+        Returns the number of tokens `message` takes up, using the cache where possible.
+        """
+        if encoding is None:
+            encoding = get_encoding(model)
+        if tokens_per_message is None:
+            tokens_per_message, tokens_per_name = _message_overhead(model)
+
+        try:
+            key = (
+                encoding.name,
+                model_provider(model),
+                tokens_per_message,
+                _freeze(message),
+            )
+        except TypeError:
+            key = None
+
+        if key is not None and key in self._counts:
+            self._counts.move_to_end(key)
+            return self._counts[key]
+
+        tokens = tokens_per_message
+        for field, value in message.items():
+            if field == "content" and isinstance(value, list):
+                tokens += _count_content_parts(value, model, encoding)
+            else:
+                tokens += len(encoding.encode(str(value), disallowed_special=()))
+            if field == "name":
+                tokens += tokens_per_name
+
+        if key is not None:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_cached_messages:
+                self._counts.popitem(last=False)
+
+        return tokens
+
+
+def model_max_tokens(model, trim_ratio=0.75):
+    """
+    The number of tokens `tokentrim` would trim to for a known model, otherwise None.
+    """
+    if model in MODEL_MAX_TOKENS:
+        return int(MODEL_MAX_TOKENS[model] * trim_ratio)
+    return None
+
+
+def image_tokens(url, model=None, detail="low"):
+    """
+    Estimates how many tokens an image costs the provider serving `model`.
+    """
+    provider = model_provider(model)
+    dimensions = _image_dimensions(url)
+
+    if provider == "gemini":
+        return IMAGE_TOKEN_COSTS["gemini"]["flat"]
+
+    if provider == "anthropic":
+        costs = IMAGE_TOKEN_COSTS["anthropic"]
+        if dimensions is None:
+            return costs["max"]
+        width, height = dimensions
+        return min(costs["max"], math.ceil(width * height / costs["pixels_per_token"]))
+
+    costs = IMAGE_TOKEN_COSTS["openai"]
+    if detail == "low":
+        return costs["low"]
+    if dimensions is None:
+        return DEFAULT_IMAGE_TOKENS
+
+    # High detail images are fit in 2048x2048, then scaled so the short side is 768, then tiled
+    width, height = dimensions
+    scale = min(1, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return costs["base"] + costs["tile"] * tiles
+
+
+def _count_content_parts(parts, model, encoding):
+    tokens = 0
+    for part in parts:
+        if part.get("type") == "image_url":
+            image_url = part.get("image_url", {})
+            tokens += image_tokens(
+                image_url.get("url", ""), model, image_url.get("detail", "auto")
+            )
+        elif part.get("type") == "text":
+            tokens += len(encoding.encode(part.get("text", ""), disallowed_special=()))
+        else:
+            tokens += len(encoding.encode(str(part), disallowed_special=()))
+    return tokens
+
+
+def _message_overhead(model):
+    """
+    The tokens every message (and every `name` field) costs on top of its contents.
+    Same numbers as `tokentrim`.
+    """
+    if model is None:
+        return 4, 2
+    if model in {
+        "gpt-3.5-turbo-0613",
+        "gpt-3.5-turbo-16k-0613",
+        "gpt-4-0314",
+        "gpt-4-32k-0314",
+        "gpt-4-0613",
+        "gpt-4-32k-0613",
+    }:
+        return 3, 1
+    if model == "gpt-3.5-turbo-0301":
+        return 4, -1
+    if "gpt-3.5-turbo" in model or "gpt-4" in model:
+        return 3, 1
+    return 4, 2
+
+
+def _image_dimensions(url):
+    """
+    Reads the width and height out of a base64 PNG data URL's header, without decoding the image.
+    """
+    if not url.startswith("data:image/png;base64,"):
+        return None
+    try:
+        header = base64.b64decode(url[22:54])
+    except ValueError:
+        return None
+    if header[:8] != b"\x89PNG\r\n\x1a\n" or len(header) < 24:
+        return None
+    return int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+
+
+def _shorten(message, max_tokens, count, encoding):
+    """
+    Returns a copy of `message` with the middle of its content cut out, so it fits in `max_tokens`.
+    """
+    message = dict(message)
+    for _ in range(12):
+        total_tokens = count(message)
+        if total_tokens <= max_tokens or max_tokens <= 0:
+            break
+
+        content = message["content"]
+        ratio = max_tokens / total_tokens
+        half_length = (
+            int(len(encoding.encode(content, disallowed_special=())) * ratio) // 2
+        )
+        if half_length == 0:
+            message["content"] = ""
+            break
+
+        left_half = encoding.decode(
+            encoding.encode(content[:half_length], disallowed_special=())
+        )
+        right_half = encoding.decode(
+            encoding.encode(content[-half_length:], disallowed_special=())
+        )
+        message["content"] = left_half + "..." + right_half
+    return message
+
+
+def _freeze(value):
+    """
+    Turns a message into something hashable. Strings cache their own hash,
+    so this is cheap for messages we've seen before.
+    """
+    if isinstance(value, dict):
+        return tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
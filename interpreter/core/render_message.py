@@ -1,4 +1,90 @@
 import re
+import time
+import uuid
+
+
+class RenderCache:
+    """
+    Remembers the output of `{{ }}` blocks, so we don't send them to the kernel on every render.
+
+    A block says how long its output stays valid with comments inside it:
+
+        {{
+        # ttl: forever            <- or a number of seconds
+        # invalidate: code, turn  <- forget it when these events happen
+        import platform
+        print(platform.system())
+        }}
+
+    Blocks without a `ttl` are re-run on every render, like before. The interpreter fires
+    "code" after it runs code and "turn" when a new message comes in. You can fire your own
+    with `interpreter.render_cache.invalidate("window")`, or clear everything with `invalidate()`.
+    """
+
+    def __init__(self):
+        self._entries = {}  # code -> (output, expires_at, events)
+
+    def get(self, code):
+        entry = self._entries.get(code)
+        if entry is None:
+            return None
+        output, expires_at, _ = entry
+        if expires_at is not None and time.time() > expires_at:
+            del self._entries[code]
+            return None
+        return output
+
+    def set(self, code, output):
+        ttl, events = parse_cache_settings(code)
+        if ttl is None:
+            return
+        expires_at = None if ttl == "forever" else time.time() + ttl
+        self._entries[code] = (output, expires_at, events)
+
+    def invalidate(self, event=None):
+        """
+        Forgets blocks that should be re-run after `event`, or every block if `event` is None.
+        """
+        if event is None:
+            self._entries = {}
+            return
+        self._entries = {
+            code: entry
+            for code, entry in self._entries.items()
+            if event not in entry[2]
+        }
+
+
+def parse_cache_settings(code):
+    """
+    Reads the `# ttl:` and `# invalidate:` comments out of a block.
+    Returns (ttl, events), where ttl is None (don't cache), "forever", or a number of seconds.
+    """
+    ttl = None
+    events = set()
+
+    ttl_match = re.search(r"^\s*#\s*ttl:\s*(\S+)", code, flags=re.MULTILINE)
+    if ttl_match:
+        value = ttl_match.group(1).lower()
+        if value == "forever":
+            ttl = "forever"
+        else:
+            try:
+                ttl = float(value)
+            except ValueError:
+                ttl = None
+
+    invalidate_match = re.search(
+        r"^\s*#\s*invalidate:\s*(.+)$", code, flags=re.MULTILINE
+    )
+    if invalidate_match:
+        events = {
+            event.strip()
+            for event in invalidate_match.group(1).split(",")
+            if event.strip()
+        }
+
+    return ttl, events
 
 
 def render_message(interpreter, message):
@@ -9,27 +95,38 @@ def render_message(interpreter, message):
     previous_save_skills_setting = interpreter.computer.save_skills
     interpreter.computer.save_skills = False
 
+    render_cache = getattr(interpreter, "render_cache", None)
+
     # Split the message into parts by {{ and }}, including multi-line strings
     parts = re.split(r"({{.*?}})", message, flags=re.DOTALL)
 
+    # Find the blocks we need to run
+    blocks_to_run = {}  # index in parts -> code
     for i, part in enumerate(parts):
         # If the part is enclosed in {{ and }}
         if part.startswith("{{") and part.endswith("}}"):
-            # Run the code inside the brackets
-            output = interpreter.computer.run(
-                "python", part[2:-2].strip(), display=interpreter.verbose
-            )
-
-            # Extract the output content
-            outputs = (
-                line["content"]
-                for line in output
-                if line.get("format") == "output"
-                and "IGNORE_ALL_ABOVE_THIS_LINE" not in line["content"]
-            )
-
-            # Replace the part with the output
-            parts[i] = "\n".join(outputs)
+            code = part[2:-2].strip()
+            cached_output = render_cache.get(code) if render_cache else None
+            if cached_output is not None:
+                parts[i] = cached_output
+            else:
+                blocks_to_run[i] = code
+
+    if len(blocks_to_run) == 1:
+        # Run the code inside the brackets
+        [(i, code)] = blocks_to_run.items()
+        output = interpreter.computer.run("python", code, display=interpreter.verbose)
+        parts[i] = _join_output(output)
+        if render_cache:
+            render_cache.set(code, parts[i])
+
+    elif blocks_to_run:
+        # Run them all in one go, rather than one kernel round-trip per block
+        outputs = _run_blocks(interpreter, list(blocks_to_run.values()))
+        for (i, code), output in zip(blocks_to_run.items(), outputs):
+            parts[i] = output
+            if render_cache:
+                render_cache.set(code, output)
 
     # Join the parts back into the message
     rendered_message = "".join(parts).strip()
@@ -44,3 +141,62 @@ def render_message(interpreter, message):
     interpreter.computer.save_skills = previous_save_skills_setting
 
     return rendered_message
+
+
+def _join_output(output):
+    # Extract the output content
+    return "\n".join(
+        line["content"]
+        for line in output
+        if line.get("format") == "output"
+        and "IGNORE_ALL_ABOVE_THIS_LINE" not in line["content"]
+    )
+
+
+# Runs one block like a notebook cell: a bare expression at the end has its value shown
+_RUN_BLOCK = """
+def {name}(code):
+    import ast, sys, traceback
+    try:
+        tree = ast.parse(code, "<render>")
+        last = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            last = ast.Interactive(body=[tree.body.pop()])
+        exec(compile(tree, "<render>", "exec"), globals())
+        if last is not None:
+            exec(compile(last, "<render>", "single"), globals())
+    except Exception:
+        # Shown like a cell's error, and in order with what the block printed
+        try:
+            get_ipython().showtraceback()
+        except NameError:
+            traceback.print_exc(file=sys.stdout)
+""".strip()
+
+
+def _run_blocks(interpreter, blocks):
+    """
+    Runs several blocks in a single kernel execution, and splits the output back up per block.
+    Each block is run on its own, so one failing block doesn't stop the others, and its output
+    is the same as if it had been run by itself.
+    """
+    marker = f"__RENDER_BLOCK_{uuid.uuid4().hex}__"
+    run_block = f"__render_block_{uuid.uuid4().hex}"
+
+    batched_code = [_RUN_BLOCK.format(name=run_block)]
+    for code in blocks:
+        batched_code.append(f"print({marker!r})")
+        batched_code.append(f"{run_block}({code!r})")
+    batched_code.append(f"print({marker!r})")
+    batched_code.append(f"del {run_block}")
+
+    output = interpreter.computer.run(
+        "python", "\n".join(batched_code), display=interpreter.verbose
+    )
+    output = _join_output(output)
+
+    # The first piece is anything printed before the first marker, the last is after the final one
+    pieces = output.split(marker)[1:-1]
+    pieces += [""] * (len(blocks) - len(pieces))
+    # Each piece starts with the newline printed after its marker
+    return [piece[1:] if piece.startswith("\n") else piece for piece in pieces]
@@ -20,7 +20,14 @@ def respond(interpreter):
     last_unsupported_code = ""
     insert_loop_message = False
 
+    # So a kernel is ready by the time the LLM writes Python (or the system message runs some)
+    interpreter.computer.terminal.warm_up()
+
     while True:
+        # Console output is only written to its message once it's done. Make sure it is,
+        # even if it ended with an error, before the LLM sees the messages
+        interpreter.flush_output()
+
         ## RENDER SYSTEM MESSAGE ##
 
         system_message = interpreter.system_message
@@ -302,9 +309,7 @@ def respond(interpreter):
                     break
 
                 # They may have edited the code! Grab it again
-                code = [m for m in interpreter.messages if m["type"] == "code"][-1][
-                    "content"
-                ]
+                code = interpreter.messages.last(type="code")["content"]
 
                 # don't let it import computer — we handle that!
                 if interpreter.computer.import_computer_api and language == "python":
@@ -344,14 +349,7 @@ def respond(interpreter):
                 # sync up the interpreter's computer with your computer
                 try:
                     if interpreter.sync_computer and language == "python":
-                        computer_dict = interpreter.computer.to_dict()
-                        if "_hashes" in computer_dict:
-                            computer_dict.pop("_hashes")
-                        if "system_message" in computer_dict:
-                            computer_dict.pop("system_message")
-                        computer_json = json.dumps(computer_dict)
-                        sync_code = f"""import json\ncomputer.load_dict(json.loads('''{computer_json}'''))"""
-                        interpreter.computer.run("python", sync_code)
+                        interpreter.computer.terminal.sync_computer()
                 except Exception as e:
                     if interpreter.debug:
                         raise
@@ -365,26 +363,14 @@ def respond(interpreter):
 
                 ## ↑ CODE IS RUN HERE
 
+                # Running code can change what {{ }} blocks in the system message print
+                interpreter.render_cache.invalidate("code")
+
                 # sync up your computer with the interpreter's computer
                 try:
                     if interpreter.sync_computer and language == "python":
-                        # sync up the interpreter's computer with your computer
-                        result = interpreter.computer.run(
-                            "python",
-                            """
-                            import json
-                            computer_dict = computer.to_dict()
-                            if '_hashes' in computer_dict:
-                                computer_dict.pop('_hashes')
-                            if "system_message" in computer_dict:
-                                computer_dict.pop("system_message")
-                            print(json.dumps(computer_dict))
-                            """,
-                        )
-                        result = result[-1]["content"]
-                        interpreter.computer.load_dict(
-                            json.loads(result.strip('"').strip("'"))
-                        )
+                        # (The kernel sent its changes while the code ran)
+                        interpreter.computer.terminal.sync_computer()
                 except Exception as e:
                     if interpreter.debug:
                         raise
@@ -432,25 +418,12 @@ def respond(interpreter):
                 )
             ):
                 # Remove past loop_message messages
-                interpreter.messages = [
-                    message
-                    for message in interpreter.messages
-                    if message.get("content", "") != loop_message
-                ]
+                interpreter.messages.remove_where(
+                    lambda message: message.get("content", "") == loop_message,
+                    role="user",
+                )
                 # Combine adjacent assistant messages, so hopefully it learns to just keep going!
-                combined_messages = []
-                for message in interpreter.messages:
-                    if (
-                        combined_messages
-                        and message["role"] == "assistant"
-                        and combined_messages[-1]["role"] == "assistant"
-                        and message["type"] == "message"
-                        and combined_messages[-1]["type"] == "message"
-                    ):
-                        combined_messages[-1]["content"] += "\n" + message["content"]
-                    else:
-                        combined_messages.append(message)
-                interpreter.messages = combined_messages
+                interpreter.messages.merge_adjacent("assistant", "message")
 
                 # Send model the loop_message:
                 insert_loop_message = True
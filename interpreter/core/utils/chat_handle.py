@@ -0,0 +1,137 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future
+
+_DONE = object()
+
+
+class ChatHandle:
+    """
+    What `interpreter.chat(blocking=False)` returns. The chat runs in its own thread, and this is
+    how you get at it: wait for its new messages (`result()`, or `await handle`), stop it
+    (`cancel()`), or, with `chat(blocking=False, stream=True)`, read its chunks as they come
+    (`for chunk in handle`, or `async for`). Otherwise the chunks aren't kept.
+
+    All of it waits on events, so nothing wakes up until there's something to see.
+    """
+
+    def __init__(self, interpreter, chunks, stream=False):
+        self.interpreter = interpreter
+        self._future = Future()
+        self._chunks = queue.SimpleQueue() if stream else None
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(chunks,))
+        self._thread.start()
+
+    def result(self, timeout=None):
+        """
+        Waits for the chat to finish and returns its new messages. Raises whatever the chat
+        raised, CancelledError if it was cancelled, or TimeoutError after `timeout` seconds.
+        """
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self._future.exception(timeout)
+
+    def cancel(self):
+        """
+        Stops the chat. No more chunks are pulled from the LLM, and any code it's running is
+        stopped. Returns False if it had already finished.
+
+        The handle isn't done (and `result()` keeps waiting) until the chat's thread has actually
+        stopped, so it's safe to use the interpreter again once it is.
+        """
+        if self._future.done():
+            return False
+        self._stopping.set()
+        if hasattr(self.interpreter, "stop_event"):
+            self.interpreter.stop_event.set()
+        self.interpreter.computer.stop()
+        return True
+
+    def cancelled(self):
+        return self._future.cancelled()
+
+    def done(self):
+        return self._future.done()
+
+    def add_done_callback(self, callback):
+        """
+        Calls `callback(handle)` once the chat finishes (or right away, if it has).
+        """
+        self._future.add_done_callback(lambda _: callback(self))
+
+    def __await__(self):
+        return self._wait().__await__()
+
+    def __iter__(self):
+        """
+        Yields the chat's chunks as they're made, then raises whatever the chat raised.
+        Chunks are only yielded once, so there should be one reader.
+        """
+        self._check_streaming()
+        while True:
+            chunk = self._chunks.get()
+            if chunk is _DONE:
+                break
+            yield chunk
+        self._raise_error()
+
+    async def __aiter__(self):
+        self._check_streaming()
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, self._chunks.get)
+            if chunk is _DONE:
+                break
+            yield chunk
+        self._raise_error()
+
+    async def _wait(self):
+        # Shielded, so cancelling the awaiting task goes through cancel() instead of
+        # marking the future cancelled while the chat is still running
+        try:
+            return await asyncio.shield(asyncio.wrap_future(self._future))
+        except asyncio.CancelledError:
+            # Stopping the code can wait on the kernel for a while, so not on the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.cancel)
+            raise
+
+    def _run(self, chunks):
+        interpreter = self.interpreter
+        result = exception = None
+        try:
+            for chunk in chunks:
+                if self._chunks is not None:
+                    self._chunks.put(chunk)
+                if self._stopping.is_set():
+                    break
+            chunks.close()  # Lets the chat clean up, if we stopped early
+            result = interpreter.messages[interpreter.last_messages_count :]
+        except BaseException as e:
+            exception = e
+        finally:
+            interpreter.responding = False
+            if self._stopping.is_set():
+                if hasattr(interpreter, "stop_event"):
+                    interpreter.stop_event.clear()
+                self._future.cancel()
+            elif exception is not None:
+                self._future.set_exception(exception)
+            else:
+                self._future.set_result(result)
+            if self._chunks is not None:
+                self._chunks.put(_DONE)
+
+    def _check_streaming(self):
+        if self._chunks is None:
+            raise TypeError(
+                "Only chats started with chat(blocking=False, stream=True) can be read chunk by chunk."
+            )
+
+    def _raise_error(self):
+        if self._future.done() and not self._future.cancelled():
+            error = self._future.exception()
+            if error is not None:
+                raise error
@@ -0,0 +1,141 @@
+import queue
+import threading
+import time
+
+_END = object()
+
+
+def coalesce_chunks(chunks, max_ms=None, max_bytes=None):
+    """
+    Merges adjacent chunks of the same message (same role, type, format... and string content)
+    into bigger ones, so whatever consumes the stream handles far fewer of them.
+
+    A merged chunk is sent once it has been collecting for `max_ms` milliseconds or holds
+    `max_bytes` characters, whichever comes first. It's always sent before any chunk that can't
+    be merged (start and end flags, confirmations, active lines, images), so those arrive in the
+    same order and at the same points as they would have.
+
+    `chunks` is pulled from in a thread of its own, so a partly filled chunk is sent when its
+    `max_ms` are up, even if nothing else arrives for a while (say, a program that printed a line
+    and then went quiet). With only `max_bytes`, it waits for the next chunk that can't be merged,
+    or the end of the stream.
+
+    The thread never gets past a chunk that can't be merged until it has been handed on and we've
+    been asked for the next one. Whoever's reading may stop there (say, at a confirmation they
+    reject), and then `chunks` is closed without running what comes after it.
+    """
+    if not max_ms and not max_bytes:
+        yield from chunks
+        return
+
+    max_seconds = max_ms / 1000 if max_ms else None
+
+    pending = queue.SimpleQueue()
+    stopping = threading.Event()
+    handed_on = threading.Event()  # The last chunk that can't be merged was taken
+
+    def read():
+        try:
+            for chunk in chunks:
+                pending.put(chunk)
+                if not _mergeable(chunk):
+                    handed_on.wait()
+                    handed_on.clear()
+                if stopping.is_set():
+                    break
+        except BaseException as e:
+            pending.put(_Error(e))
+        finally:
+            # Stopping early should stop what we're pulling from, too
+            if hasattr(chunks, "close"):
+                chunks.close()
+            pending.put(_END)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+
+    first = None  # The first chunk of the run we're collecting
+    parts = []
+    size = 0
+    started = 0
+
+    try:
+        while True:
+            timeout = None
+            if first is not None and max_seconds is not None:
+                timeout = max(0, started + max_seconds - time.perf_counter())
+            try:
+                chunk = pending.get(timeout=timeout)
+            except queue.Empty:
+                # Collected for long enough
+                yield _merge(first, parts)
+                first = None
+                continue
+
+            if chunk is _END or isinstance(chunk, _Error):
+                if first is not None:
+                    yield _merge(first, parts)
+                    first = None
+                if chunk is _END:
+                    break
+                raise chunk.error
+
+            if first is not None and _mergeable(chunk) and _same_message(first, chunk):
+                parts.append(chunk["content"])
+                size += len(chunk["content"])
+            else:
+                if first is not None:
+                    yield _merge(first, parts)
+                    first = None
+                if not _mergeable(chunk):
+                    yield chunk
+                    handed_on.set()
+                    continue
+                first = chunk
+                parts = [chunk["content"]]
+                size = len(chunk["content"])
+                started = time.perf_counter()
+
+            if (max_bytes and size >= max_bytes) or (
+                max_seconds is not None and time.perf_counter() - started >= max_seconds
+            ):
+                yield _merge(first, parts)
+                first = None
+    finally:
+        # If we stopped early, wait for the reader to stop `chunks` (once its next chunk arrives),
+        # so nothing's still running it after we return
+        stopping.set()
+        handed_on.set()
+        reader.join()
+
+
+class _Error:
+    def __init__(self, error):
+        self.error = error
+
+
+def _mergeable(chunk):
+    return (
+        isinstance(chunk, dict)
+        and isinstance(chunk.get("content"), str)
+        and "start" not in chunk
+        and "end" not in chunk
+        and chunk.get("type") not in ("confirmation", "image")
+        and chunk.get("format") != "active_line"
+    )
+
+
+def _same_message(first, chunk):
+    if len(first) != len(chunk):
+        return False
+    for key, value in first.items():
+        if key != "content" and (key not in chunk or chunk[key] != value):
+            return False
+    return True
+
+
+def _merge(first, parts):
+    if len(parts) == 1:
+        return first
+    # A new dict, since the first chunk may also be the start of a message in `messages`
+    return {**first, "content": "".join(parts)}
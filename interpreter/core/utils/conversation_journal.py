@@ -0,0 +1,175 @@
+import atexit
+import json
+import os
+import tempfile
+import time
+import weakref
+
+# Lines with this key are instructions for the loader, not messages
+JOURNAL_KEY = "__journal__"
+
+# Journals with a file open, so they're closed (and fsync'd) on exit. Weak, so a journal that's
+# been dropped isn't kept around until then
+_open_journals = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_journals():
+    for journal in list(_open_journals):
+        journal.close()
+
+
+class ConversationJournal:
+    """
+    Saves a conversation as JSON lines, one message per line, appending only what's new.
+
+    Messages that were already written are remembered by identity, so if an earlier message is
+    edited or removed we write a "truncate" record and append from there. When those pile up,
+    or when we open a file we didn't write, the whole thing is rewritten ("compacted") to a
+    temporary file that replaces the old one, so a crash never leaves half a conversation.
+
+    Every write is flushed to the OS straight away, but fsync'd at most once per `fsync_interval`
+    seconds (and on close), since fsync can take a while on some disks.
+    """
+
+    def __init__(self, path, fsync_interval=1.0):
+        self.path = path
+        self.fsync_interval = fsync_interval
+
+        self._file = None
+        self._written = []  # (message, content) for every message in the file
+        self._records = 0  # Lines in the file
+        self._last_fsync = 0
+        self._needs_fsync = False
+
+    def sync(self, messages):
+        """
+        Brings the file up to date with `messages`.
+        """
+        if self._file is None:
+            self.compact(messages)
+            return
+
+        # Find the first message that changed since we wrote it
+        keep = 0
+        for (message, content), current in zip(self._written, messages):
+            if current is not message or current.get("content") is not content:
+                break
+            keep += 1
+
+        lines = []
+        if keep < len(self._written):
+            lines.append(json.dumps({JOURNAL_KEY: "truncate", "length": keep}))
+            del self._written[keep:]
+        for message in messages[keep:]:
+            lines.append(json.dumps(message))
+            self._written.append((message, message.get("content")))
+
+        if not lines:
+            return
+
+        self._records += len(lines)
+        if self._records > 2 * len(messages) + 10:
+            # More history than conversation
+            self.compact(messages)
+            return
+
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        self._needs_fsync = True
+        if time.time() - self._last_fsync >= self.fsync_interval:
+            self._fsync()
+
+    def compact(self, messages):
+        """
+        Rewrites the file with just `messages`.
+        """
+        self.close()
+
+        directory = os.path.dirname(self.path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                for message in messages:
+                    f.write(json.dumps(message) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self._file = open(self.path, "a")
+        _open_journals.add(self)
+        self._written = [(message, message.get("content")) for message in messages]
+        self._records = len(messages)
+        self._last_fsync = time.time()
+        self._needs_fsync = False
+
+    def close(self):
+        if self._file is None:
+            return
+        _open_journals.discard(self)
+        try:
+            if self._needs_fsync:
+                self._fsync()
+            self._file.close()
+        except (OSError, ValueError):
+            pass
+        self._file = None
+
+    def _fsync(self):
+        os.fsync(self._file.fileno())
+        self._last_fsync = time.time()
+        self._needs_fsync = False
+
+
+def is_conversation_file(filename):
+    return filename.endswith((".json", ".jsonl"))
+
+
+def save_json_conversation(path, messages):
+    """
+    Writes a whole conversation in the old `.json` format, replacing the file in one step.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(messages, f)
+        os.replace(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_conversation(path):
+    """
+    Reads the messages of a saved conversation, in either the old `.json` format or as a journal.
+    Journals are read a line at a time, so the file is never in memory all at once.
+    """
+    if not path.endswith(".jsonl"):
+        with open(path, "r") as f:
+            return json.load(f)
+
+    messages = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Probably the last line, cut off by a crash
+                continue
+            if isinstance(record, dict) and JOURNAL_KEY in record:
+                if record[JOURNAL_KEY] == "truncate":
+                    del messages[record["length"] :]
+                continue
+            messages.append(record)
+    return messages
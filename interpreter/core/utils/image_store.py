@@ -0,0 +1,158 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from collections import OrderedDict
+
+from ...terminal_interface.utils.local_storage_path import get_storage_path
+
+MAX_STORE_BYTES = 1024 * 1024 * 1024  # Least recently used images are deleted past this
+
+_NAME = re.compile(r"[0-9a-f]+\.[A-Za-z0-9]+")
+
+
+class ImageStore:
+    """
+    Keeps image bytes on disk, named by their hash, so messages only have to carry the name.
+
+    A stored image message looks like:
+        {"role": "computer", "type": "image", "format": "blob.png", "content": "<hash>.png"}
+
+    Recently used images are kept in memory (up to `cache_bytes`), so the images we send
+    every turn aren't read from disk every time. On disk, the least recently used images are
+    deleted once the store is bigger than `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        directory=None,
+        cache_bytes=64 * 1024 * 1024,
+        max_bytes=MAX_STORE_BYTES,
+    ):
+        self.directory = directory or get_storage_path("images")
+        self.cache_bytes = cache_bytes
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    def put(self, data, extension="png"):
+        """
+        Stores `data` and returns its name.
+        """
+        name = hashlib.sha256(data).hexdigest()[:32] + "." + extension.lower()
+        path = self.path(name)
+        if os.path.exists(path):
+            # Same image as before
+            os.utime(path)
+            self._remember(name, data)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+            self._remember(name, data)
+            self.prune(keep=path)
+        return name
+
+    def put_base64(self, encoded, extension="png"):
+        return self.put(base64.b64decode(encoded), extension)
+
+    def get(self, name):
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return self._cache[name]
+        path = self.path(name)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        self._remember(name, data)
+        return data
+
+    def get_base64(self, name):
+        return base64.b64encode(self.get(name)).decode("utf-8")
+
+    def path(self, name):
+        if not _NAME.fullmatch(name):
+            raise ValueError(f"Invalid image name: {name}")
+        return os.path.join(self.directory, name)
+
+    def prune(self, keep=None):
+        """
+        Deletes the least recently used images (other than `keep`, and the ones we have in
+        memory, which are in use) until the store fits in `max_bytes`.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        paths = [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if _NAME.fullmatch(name)
+        ]
+        paths.sort(key=os.path.getmtime)
+        sizes = {path: os.path.getsize(path) for path in paths}
+        total = sum(sizes.values())
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            if path == keep or os.path.basename(path) in self._cache:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= sizes[path]
+
+    def store_message(self, message):
+        """
+        Returns a copy of a base64 image message that refers to the stored image instead.
+        Any other message is returned as-is.
+        """
+        if message.get("type") != "image" or "base64" not in message.get("format", ""):
+            return message
+        extension = _extension(message["format"])
+        try:
+            name = self.put_base64(message["content"], extension)
+        except (OSError, ValueError):
+            # Keep it inline if we can't store it
+            return message
+        return {**message, "format": "blob." + extension, "content": name}
+
+    def load_message(self, message):
+        """
+        Returns a copy of a stored image message with the image inline, as base64.
+        Any other message is returned as-is.
+        """
+        if not is_stored_image(message):
+            return message
+        extension = _extension(message["format"])
+        return {
+            **message,
+            "format": "base64." + extension,
+            "content": self.get_base64(message["content"]),
+        }
+
+    def _remember(self, name, data):
+        if len(data) > self.cache_bytes:
+            return
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            return
+        self._cache[name] = data
+        self._cached_bytes += len(data)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+
+def is_stored_image(message):
+    return message.get("type") == "image" and message.get("format", "").startswith(
+        "blob"
+    )
+
+
+def _extension(format):
+    if "." in format:
+        return format.split(".")[-1]
+    return "png"
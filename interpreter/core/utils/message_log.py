@@ -0,0 +1,266 @@
+class _Record:
+    """
+    What the log knows about one message.
+    """
+
+    __slots__ = ("message", "role", "type", "tokens")
+
+    def __init__(self, message):
+        self.message = message
+        self.role = message.get("role") if isinstance(message, dict) else None
+        self.type = message.get("type") if isinstance(message, dict) else None
+        self.tokens = None  # key -> (content, count)
+
+
+class MessageLog(list):
+    """
+    `interpreter.messages`. A list of LMC messages, so everything that treats it as one still works,
+    which also keeps an index of where each role and type of message is, so things like "the last
+    code message" or "every user message" don't mean scanning the whole conversation.
+
+    Appending and removing from the end keep the index up to date. Anything else (inserting,
+    deleting from the middle, sorting...) just throws it away, and it's rebuilt on the next lookup.
+    Messages are indexed by the role and type they had when they were added; if the last message's
+    role or type is changed in place, that's noticed too.
+    """
+
+    def __init__(self, messages=()):
+        super().__init__(messages)
+        if isinstance(messages, MessageLog):
+            self._records = list(messages._records)
+        else:
+            self._records = [_Record(message) for message in self]
+        self._index = None  # (key, value) -> positions, in order
+
+    # Lookups
+
+    def last(self, role=None, type=None):
+        """
+        Returns the last message with this role and/or type, or None.
+        """
+        positions = self._positions(role, type)
+        return self[positions[-1]] if positions else None
+
+    def where(self, role=None, type=None):
+        """
+        Returns every message with this role and/or type, in order.
+        """
+        return [self[position] for position in self._positions(role, type)]
+
+    def tail(self, n):
+        """
+        Returns the last `n` messages.
+        """
+        if n <= 0:
+            return []
+        return list.__getitem__(self, slice(-n, None))
+
+    def token_count(self, count, key=None):
+        """
+        Returns the total of `count(message)` over every message. Each message's count is
+        remembered (under `key`, which defaults to `count` itself) until its content changes,
+        so only new and edited messages are counted again.
+        """
+        key = count if key is None else key
+        total = 0
+        for record in self._records:
+            content = (
+                record.message.get("content")
+                if isinstance(record.message, dict)
+                else record.message
+            )
+            if record.tokens is None:
+                record.tokens = {}
+            cached = record.tokens.get(key)
+            if cached is None or cached[0] is not content:
+                cached = (content, count(record.message))
+                record.tokens[key] = cached
+            total += cached[1]
+        return total
+
+    # Edits that use the index
+
+    def remove_where(self, predicate, role=None, type=None):
+        """
+        Removes the messages with this role and/or type that `predicate(message)` is true for.
+        """
+        doomed = {
+            position
+            for position in self._positions(role, type)
+            if predicate(self[position])
+        }
+        if doomed:
+            self._keep([i for i in range(len(self)) if i not in doomed])
+
+    def merge_adjacent(self, role, type, separator="\n"):
+        """
+        Merges runs of adjacent messages with this role and type into the first one of each run.
+        """
+        positions = self._positions(role, type)
+        doomed = set()
+        previous = None
+        for position in positions:
+            if previous is not None and position == previous + 1:
+                first = position - 1
+                while first in doomed:
+                    first -= 1
+                self[first]["content"] += separator + self[position]["content"]
+                doomed.add(position)
+            previous = position
+        if doomed:
+            self._keep([i for i in range(len(self)) if i not in doomed])
+
+    # list methods that change the list
+
+    def append(self, message):
+        super().append(message)
+        record = _Record(message)
+        self._records.append(record)
+        if self._index is not None:
+            self._add_to_index(len(self) - 1, record)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages):
+        self.extend(messages)
+        return self
+
+    def pop(self, index=-1):
+        if index in (-1, len(self) - 1) and self:
+            message = super().pop()
+            record = self._records.pop()
+            if self._index is not None:
+                self._remove_from_index(len(self), record)
+            return message
+        message = super().pop(index)
+        self._records.pop(index)
+        self._index = None
+        return message
+
+    def insert(self, index, message):
+        if index >= len(self):
+            self.append(message)
+            return
+        super().insert(index, message)
+        self._records.insert(index, _Record(message))
+        self._index = None
+
+    def remove(self, message):
+        del self[self.index(message)]
+
+    def clear(self):
+        super().clear()
+        self._records.clear()
+        self._index = None
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            super().__setitem__(index, value)
+            self._records = [_Record(message) for message in self]
+            self._index = None
+            return
+        super().__setitem__(index, value)
+        if index in (-1, len(self) - 1):
+            # Replacing the last message, like pop() then append()
+            record = self._records[-1]
+            self._records[-1] = _Record(value)
+            if self._index is not None:
+                self._remove_from_index(len(self) - 1, record)
+            if self._index is not None:
+                self._add_to_index(len(self) - 1, self._records[-1])
+        else:
+            self._records[index] = _Record(value)
+            self._index = None
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        del self._records[index]
+        self._index = None
+
+    def __imul__(self, n):
+        super().__imul__(n)
+        self._records = [_Record(message) for message in self]
+        self._index = None
+        return self
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._records = [_Record(message) for message in self]
+        self._index = None
+
+    def reverse(self):
+        super().reverse()
+        self._records.reverse()
+        self._index = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Keep the records, so slicing doesn't mean looking at every message again
+            sliced = MessageLog()
+            list.extend(sliced, list.__getitem__(self, index))
+            sliced._records = self._records[index]
+            return sliced
+        return super().__getitem__(index)
+
+    def copy(self):
+        return list(self)
+
+    def __reduce__(self):
+        # For copy and pickle, which would otherwise append every message twice
+        return (MessageLog, (list(self),))
+
+    # The index
+
+    def _positions(self, role=None, type=None):
+        self._check_last()
+        if self._index is None:
+            self._index = {}
+            for position, record in enumerate(self._records):
+                self._add_to_index(position, record)
+
+        if role is None and type is None:
+            return list(range(len(self)))
+        by_role = self._index.get(("role", role), []) if role is not None else None
+        by_type = self._index.get(("type", type), []) if type is not None else None
+        if by_role is None:
+            return by_type
+        if by_type is None:
+            return by_role
+        # Go through the shorter one
+        if len(by_role) <= len(by_type):
+            return [p for p in by_role if self._records[p].type == type]
+        return [p for p in by_type if self._records[p].role == role]
+
+    def _check_last(self):
+        if not self._records:
+            return
+        record = self._records[-1]
+        message = record.message
+        if not isinstance(message, dict):
+            return
+        if message.get("role") != record.role or message.get("type") != record.type:
+            self._records[-1] = _Record(message)
+            self._index = None
+
+    def _add_to_index(self, position, record):
+        self._index.setdefault(("role", record.role), []).append(position)
+        self._index.setdefault(("type", record.type), []).append(position)
+
+    def _remove_from_index(self, position, record):
+        for key in (("role", record.role), ("type", record.type)):
+            positions = self._index.get(key)
+            if positions and positions[-1] == position:
+                positions.pop()
+            else:
+                self._index = None
+                return
+
+    def _keep(self, positions):
+        messages = [list.__getitem__(self, i) for i in positions]
+        records = [self._records[i] for i in positions]
+        super().clear()
+        list.extend(self, messages)
+        self._records = records
+        self._index = None
@@ -1,3 +1,6 @@
+from collections import deque
+
+
 def truncate_output(data, max_output_chars=200000, add_scrollbars=False):
     # if "@@@DO_NOT_TRUNCATE@@@" in data:
     #     return data
@@ -25,3 +28,112 @@ def truncate_output(data, max_output_chars=200000, add_scrollbars=False):
         data = message + data[-max_output_chars:]
 
     return data
+
+
+class OutputAccumulator:
+    """
+    Collects streamed console output without ever holding (or copying) more than `max_output_chars`.
+
+    Keeps the first part of the output and a rolling window of the most recent part, and counts
+    whatever falls out of the middle. Call `value()` once the output is done to get the
+    (possibly truncated) text, which is the only time the pieces are joined.
+
+    With a `store` (an `OutputStore`), output that gets too long is also written to disk in full,
+    and the truncated text says how to page through it.
+    """
+
+    def __init__(
+        self, max_output_chars=200000, add_scrollbars=False, head_ratio=0.2, store=None
+    ):
+        self.max_output_chars = max_output_chars
+        self.add_scrollbars = add_scrollbars
+        self.head_chars = int(max_output_chars * head_ratio)
+        self.tail_chars = max_output_chars - self.head_chars
+        self.dropped_chars = 0
+        self.store = store
+        self.output_id = None
+
+        self._length = 0
+        self._pending = []  # All of the output, until we know it needs storing
+        self._writer = None
+
+        self._head = []
+        self._head_length = 0
+        self._tail = deque()
+        self._tail_length = 0
+
+    def append(self, data):
+        self._length += len(data)
+        if self.store is not None:
+            self._store(data)
+
+        if self._head_length < self.head_chars:
+            room = self.head_chars - self._head_length
+            self._head.append(data[:room])
+            self._head_length += min(len(data), room)
+            data = data[room:]
+            if not data:
+                return
+
+        self._tail.append(data)
+        self._tail_length += len(data)
+
+        # Drop whole pieces off the front while we can, then trim the one left over
+        while self._tail and self._tail_length - len(self._tail[0]) >= self.tail_chars:
+            piece = self._tail.popleft()
+            self._tail_length -= len(piece)
+            self.dropped_chars += len(piece)
+        excess = self._tail_length - self.tail_chars
+        if excess > 0:
+            self._tail[0] = self._tail[0][excess:]
+            self._tail_length -= excess
+            self.dropped_chars += excess
+
+    def value(self):
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        self._pending = []
+        if not self.dropped_chars:
+            return head + tail
+
+        message = f"Output truncated. Showing the first {len(head)} and last {len(tail)} characters, {self.dropped_chars} characters in between were omitted. You should try again and use computer.ai.summarize(output) over the output, or break it down into smaller steps.\n\n"
+
+        if self._writer is not None:
+            try:
+                self.output_id = self._writer.close()
+            except OSError:
+                self.output_id = None
+        if self.output_id and self.add_scrollbars:
+            message = (
+                message.strip()
+                + f' The full output was saved. Run `computer.terminal.output("{self.output_id}").page(0)` to read it a page at a time, or `.grep(pattern)` to search it.\n\n'
+            )
+        elif self.output_id:
+            message = (
+                message.strip()
+                + f" The full output was saved to {self._writer.path}\n\n"
+            )
+        return (
+            message
+            + head
+            + f"\n\n[...{self.dropped_chars} characters omitted...]\n\n"
+            + tail
+        )
+
+    def _store(self, data):
+        try:
+            if self._writer is not None:
+                self._writer.write(data)
+                return
+            self._pending.append(data)
+            if self._length > self.max_output_chars:
+                # It won't fit, so we'll need the full thing later
+                self._writer = self.store.writer()
+                for piece in self._pending:
+                    self._writer.write(piece)
+                self._pending = []
+        except OSError:
+            # Can't write to disk. Truncate like normal
+            self.store = None
+            self._writer = None
+            self._pending = []
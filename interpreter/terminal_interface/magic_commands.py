@@ -6,7 +6,7 @@ import time
 from datetime import datetime
 
 from ..core.utils.system_debug_info import system_info
-from .utils.count_tokens import count_messages_tokens
+from .utils.count_tokens import count_messages_tokens, count_tokens, token_cost
 from .utils.export_to_markdown import export_to_markdown
 
 
@@ -171,18 +171,18 @@ def handle_load_message(self, json_path):
 
 
 def handle_count_tokens(self, prompt):
-    messages = [{"role": "system", "message": self.system_message}] + self.messages
+    model = self.llm.model
 
     outputs = []
 
-    if len(self.messages) == 0:
-        (conversation_tokens, conversation_cost) = count_messages_tokens(
-            messages=messages, model=self.llm.model
-        )
-    else:
-        (conversation_tokens, conversation_cost) = count_messages_tokens(
-            messages=messages, model=self.llm.model
-        )
+    # Each message's count is remembered, so only new messages are tokenized
+    conversation_tokens = count_tokens(
+        self.system_message, model=model
+    ) + self.messages.token_count(
+        lambda message: count_tokens(str(message.get("content", "")), model=model),
+        key=("content", model),
+    )
+    conversation_cost = token_cost(conversation_tokens, model=model)
 
     outputs.append(
         (
@@ -305,7 +305,10 @@ def markdown(self, export_path: str):
 
     # If user doesn't specify the export path, then save the exported PDF in '~/Downloads'
     if not export_path:
-        export_path = get_downloads_path() + f"/{self.conversation_filename[:-4]}md"
+        export_path = (
+            get_downloads_path()
+            + f"/{os.path.splitext(self.conversation_filename)[0]}.md"
+        )
 
     export_to_markdown(self.messages, export_path)
 
@@ -59,6 +59,7 @@ computer.clipboard.view() # Returns contents of clipboard
 computer.os.get_selected_text() # Use frequently. If editing text, the user often wants this
 
 {{
+# ttl: forever
 import platform
 if platform.system() == 'Darwin':
         print('''
@@ -109,6 +110,8 @@ Include `computer.display.view()` after a 2 second delay at the end of _every_ c
 
 {{
 # Add window information
+# ttl: forever
+# invalidate: code, turn
 
 try:
 
@@ -143,6 +143,12 @@ def start_terminal_interface(interpreter):
             "type": str,
             "attribute": {"object": interpreter.llm, "attr_name": "api_version"},
         },
+        {
+            "name": "refresh_model_info",
+            "help_text": "ignore what was remembered about the model's capabilities and context window last time, and check again",
+            "type": bool,
+            "attribute": {"object": interpreter.llm, "attr_name": "refresh_model_info"},
+        },
         {
             "name": "max_output",
             "nickname": "xo",
@@ -0,0 +1,131 @@
+"""
+Benchmarks the core loop (respond, Llm.run, the LLM runners, running code) against the mock LLM server,
+so the numbers don't depend on a provider.
+
+    python -m scripts.benchmark --turns 10
+    python -m scripts.benchmark session.json --speed 0 --output results.json
+
+For each turn it measures wall time, CPU time per streamed chunk, and how much memory has grown.
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import time
+import tracemalloc
+
+import psutil
+
+from .mock_llm_server import MockLLMServer, scripted_session
+
+
+def run_benchmark(interpreter, server, turns, message="Run the code."):
+    """
+    Has `interpreter` chat with `server` for `turns` turns. Returns a list of per-turn results.
+    """
+    interpreter.llm.model = "openai/mock"
+    interpreter.llm.api_base = server.url
+    interpreter.llm.api_key = "x"
+    interpreter.llm.supports_functions = True
+    interpreter.llm.supports_vision = False
+    interpreter.llm.context_window = 100000
+    interpreter.llm.max_tokens = 1000
+    interpreter.auto_run = True
+    interpreter.disable_telemetry = True
+
+    process = psutil.Process(os.getpid())
+    tracemalloc.start()
+    gc.collect()
+    baseline_memory = tracemalloc.get_traced_memory()[0]
+
+    results = []
+    for turn in range(turns):
+        chunks = 0
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        first_chunk = None
+
+        for chunk in interpreter.chat(message, display=False, stream=True):
+            if first_chunk is None and chunk.get("content"):
+                first_chunk = time.perf_counter() - start
+            chunks += 1
+
+        wall = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        gc.collect()
+        memory = tracemalloc.get_traced_memory()[0]
+
+        results.append(
+            {
+                "turn": turn + 1,
+                "seconds": round(wall, 4),
+                "seconds_to_first_chunk": round(first_chunk or 0, 4),
+                "chunks": chunks,
+                "cpu_ms_per_chunk": round(cpu * 1000 / max(chunks, 1), 4),
+                "python_memory_growth_kb": round((memory - baseline_memory) / 1024, 1),
+                "rss_mb": round(process.memory_info().rss / 1024 / 1024, 1),
+                "messages": len(interpreter.messages),
+            }
+        )
+
+    tracemalloc.stop()
+    return results
+
+
+def summarize(results):
+    if not results:
+        return {}
+    return {
+        "turns": len(results),
+        "median_turn_seconds": round(
+            statistics.median(r["seconds"] for r in results), 4
+        ),
+        "max_turn_seconds": max(r["seconds"] for r in results),
+        "median_seconds_to_first_chunk": round(
+            statistics.median(r["seconds_to_first_chunk"] for r in results), 4
+        ),
+        "median_cpu_ms_per_chunk": round(
+            statistics.median(r["cpu_ms_per_chunk"] for r in results), 4
+        ),
+        "python_memory_growth_kb": results[-1]["python_memory_growth_kb"],
+        "python_memory_growth_kb_per_turn": round(
+            results[-1]["python_memory_growth_kb"] / len(results), 1
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the core loop offline")
+    parser.add_argument("fixture", nargs="?", help="a recorded session (JSON)")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="scales the recorded delays"
+    )
+    parser.add_argument("--message", default="Run the code.")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Imported here so --help stays fast
+    from interpreter import OpenInterpreter
+
+    fixture = args.fixture or scripted_session(turns=args.turns)
+    server = MockLLMServer(fixture, speed=args.speed).start()
+    interpreter = OpenInterpreter()
+
+    try:
+        results = run_benchmark(interpreter, server, args.turns, args.message)
+    finally:
+        interpreter.computer.terminate()
+        server.stop()
+
+    report = {"summary": summarize(results), "turns": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
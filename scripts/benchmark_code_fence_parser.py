@@ -0,0 +1,277 @@
+"""
+Fuzzes and times CodeFenceParser (how run_text_llm splits text-only responses into messages and
+code) on the token streams of recorded sessions.
+
+    python -m scripts.benchmark_code_fence_parser
+    python -m scripts.benchmark_code_fence_parser session.json --cases 200 --repeat 1 10 100
+
+The fuzz check parses each response's text as it was streamed, in one piece, a character at a time
+and at random split points, also with backticks and newlines added at random (models write odd
+things). Every way of splitting the same text has to give the same events as `reference_parse`,
+a simple version that only works on whole strings. Failures are printed with their seed and case,
+so they can be reproduced, and the script exits with an error.
+
+The throughput check parses each response as it was streamed, repeated `--repeat` times in a row
+(as one long response), and reports characters and chunks per second.
+"""
+
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+from .mock_llm_server import _chunks
+
+
+def markdown_session(blocks=20, token_length=4):
+    """
+    A made-up text-only session for when there's nothing recorded: prose with inline code,
+    fenced blocks in a few languages, a block that holds a fence, and one that's never closed.
+    """
+    parts = []
+    for i in range(blocks):
+        parts.append(f"Step {i}: let's use `print` and ``double ticks`` here.\n\n")
+        if i % 4 == 0:
+            parts.append("```python\nfor x in range(3):\n    print(f'{x}`')\n```\n\n")
+        elif i % 4 == 1:
+            parts.append("```shell\necho 'a`b' && ls -la\n```\n\n")
+        elif i % 4 == 2:
+            parts.append("````markdown\n```js\nconsole.log(1)\n```\n````\n\n")
+        else:
+            parts.append("```\nno language here\n```\n\n")
+    parts.append("And finally:\n```python\nprint('this one is never closed')")
+    text = "".join(parts)
+
+    responses = []
+    for length in [1, token_length, 17]:
+        deltas = [
+            {"content": text[i : i + length]} for i in range(0, len(text), length)
+        ]
+        responses.append({"chunks": _chunks(deltas, "stop", 0)})
+    return {"responses": responses}
+
+
+def token_streams(fixture):
+    """
+    The content deltas of each recorded response that has any (tool call responses don't).
+    """
+    streams = []
+    for response in fixture["responses"]:
+        stream = []
+        for recorded in response["chunks"]:
+            choices = recorded["chunk"].get("choices") or []
+            if choices:
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    stream.append(content)
+        if stream:
+            streams.append(stream)
+    return streams
+
+
+def parse(chunks):
+    """
+    The parser's events for `chunks`, with adjacent text or code merged
+    (how much text each event holds depends on where the chunks were split).
+    """
+    from interpreter.core.llm.utils.code_fence_parser import CodeFenceParser
+
+    events = []
+    for event, value in CodeFenceParser().parse(chunks):
+        if events and event in ("message", "code") and events[-1][0] == event:
+            events[-1] = (event, events[-1][1] + value)
+        else:
+            events.append((event, value))
+    return events
+
+
+def reference_parse(text):
+    """
+    What the events for `text` should be, worked out from the whole string at once.
+    """
+    events = []
+
+    def emit(kind, value):
+        if value:
+            if events and events[-1][0] == kind:
+                events[-1] = (kind, events[-1][1] + value)
+            else:
+                events.append((kind, value))
+
+    state = "message"
+    i = 0
+    while i < len(text):
+        if state == "info":
+            newline = text.find("\n", i)
+            info = text[i:] if newline == -1 else text[i:newline]
+            if newline == -1 and not info:
+                break
+            events.append(("language", "".join(c for c in info if c.isalpha())))
+            state = "code"
+            if newline == -1:
+                break
+            i = newline + 1
+            continue
+
+        ticks = re.compile("`+").search(text, i)
+        if ticks is None:
+            emit(state, text[i:])
+            break
+        emit(state, text[i : ticks.start()])
+        i = ticks.end()
+
+        count = len(ticks.group())
+        if count < 3:
+            emit(state, "`" * count)
+            continue
+        emit(state, "`" * (count - 3))
+        if state == "message":
+            state = "info"
+        else:
+            events.append(("end", None))
+            state = "message"
+
+    return events
+
+
+def run_fuzz(streams, cases=100, seed=0):
+    """
+    Checks that every way of splitting each stream's text gives the events `reference_parse` does.
+    Returns a summary, with the first few failures.
+    """
+    checked = 0
+    failures = []
+
+    for index, stream in enumerate(streams):
+        original = "".join(stream)
+        for case in range(cases + 1):
+            rng = random.Random(f"{seed}-{index}-{case}")
+            text = original if case == 0 else _mutate(original, rng)
+            expected = reference_parse(text)
+
+            splits = {
+                "whole": [text],
+                "characters": list(text),
+                "random": _random_split(text, rng),
+            }
+            if case == 0:
+                splits["recorded"] = stream
+
+            for name, chunks in splits.items():
+                checked += 1
+                if parse(chunks) != expected:
+                    failures.append(
+                        {"response": index, "case": case, "seed": seed, "split": name}
+                    )
+
+    return {
+        "responses": len(streams),
+        "checked": checked,
+        "failed": len(failures),
+        "failures": failures[:20],
+    }
+
+
+def run_throughput(streams, repeat=1, runs=3):
+    """
+    Times parsing each stream, as it was streamed, `repeat` times in a row. Keeps the best of `runs`.
+    """
+    from interpreter.core.llm.utils.code_fence_parser import CodeFenceParser
+
+    results = []
+    for index, stream in enumerate(streams):
+        chunks = stream * repeat
+        characters = sum(len(chunk) for chunk in chunks)
+
+        seconds = float("inf")
+        for _ in range(runs):
+            start = time.perf_counter()
+            for _ in CodeFenceParser().parse(chunks):
+                pass
+            seconds = min(seconds, time.perf_counter() - start)
+
+        results.append(
+            {
+                "response": index,
+                "repeat": repeat,
+                "characters": characters,
+                "chunks": len(chunks),
+                "seconds": round(seconds, 6),
+                "characters_per_second": round(characters / seconds),
+                "us_per_chunk": round(seconds * 1e6 / len(chunks), 3),
+            }
+        )
+    return results
+
+
+def _random_split(text, rng):
+    chunks = []
+    i = 0
+    while i < len(text):
+        length = rng.randint(1, 8)
+        chunks.append(text[i : i + length])
+        i += length
+    return chunks
+
+
+def _mutate(text, rng):
+    # Sprinkle in the characters the parser cares about
+    pieces = ["`", "``", "```", "````", "\n", "```\n"]
+    text = list(text)
+    for _ in range(rng.randint(1, 10)):
+        position = rng.randint(0, len(text))
+        text.insert(position, rng.choice(pieces))
+    if rng.random() < 0.25:
+        # The end of the stream is where held back backticks get handled
+        text.append(rng.choice(pieces))
+    return "".join(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fuzz and benchmark the code fence parser on recorded token streams"
+    )
+    parser.add_argument("fixture", nargs="?", help="a recorded session (JSON)")
+    parser.add_argument(
+        "--cases",
+        type=int,
+        default=100,
+        help="mutated copies of each response to check",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.fixture:
+        with open(args.fixture, "r") as f:
+            fixture = json.load(f)
+    else:
+        fixture = markdown_session()
+
+    streams = token_streams(fixture)
+    if not streams:
+        sys.exit("That session has no text responses to parse.")
+
+    report = {
+        "fuzz": run_fuzz(streams, args.cases, args.seed),
+        "throughput": [
+            result
+            for repeat in args.repeat
+            for result in run_throughput(streams, repeat)
+        ],
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if report["fuzz"]["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
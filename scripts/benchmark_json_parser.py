@@ -0,0 +1,155 @@
+"""
+Compares the two ways of reading streamed tool call arguments: re-parsing everything received so far
+with `parse_partial_json` on every chunk (what run_tool_calling_llm used to do), and feeding each
+chunk to an `IncrementalJsonParser`.
+
+    python -m scripts.benchmark_json_parser
+    python -m scripts.benchmark_json_parser --sizes 1 10 --chunk-size 16 --runs 5
+
+Both get the same `{"language": ..., "code": ...}` arguments, a few characters at a time, and have to
+produce the same code. The old way is quadratic, so at 100 KB it takes minutes.
+"""
+
+import argparse
+import json
+import time
+
+
+def tool_arguments(kilobytes):
+    """
+    Tool call arguments with about `kilobytes` KB of code in them, with the characters that need
+    escaping in JSON (quotes, backslashes, newlines, tabs, non-ASCII).
+    """
+    lines = []
+    size = 0
+    i = 0
+    while size < kilobytes * 1024:
+        line = f"print(\"line {i}: \\t tab, \\\\ slash, 'quote', café ☕\")"
+        lines.append(line)
+        size += len(line) + 1
+        i += 1
+    return json.dumps({"language": "python", "code": "\n".join(lines)})
+
+
+def old_path(chunks):
+    """
+    Reads the code out of `chunks` the old way. Returns the code.
+    """
+    from interpreter.core.llm.utils.parse_partial_json import parse_partial_json
+
+    accumulated = ""
+    language = None
+    code = ""
+    for chunk in chunks:
+        accumulated += chunk
+        arguments = parse_partial_json(accumulated)
+        if arguments:
+            if (
+                language is None
+                and "language" in arguments
+                and "code" in arguments
+                and arguments["language"]
+            ):
+                language = arguments["language"]
+            if language is not None and "code" in arguments:
+                code = arguments["code"]
+    return code
+
+
+def new_path(chunks):
+    """
+    Reads the code out of `chunks` with an IncrementalJsonParser. Returns the code.
+    """
+    from interpreter.core.llm.utils.incremental_json_parser import (
+        IncrementalJsonParser,
+    )
+
+    parser = IncrementalJsonParser()
+    language = None
+    code = []
+    for chunk in chunks:
+        parser.feed(chunk)
+        if parser.failed:
+            break
+        if (
+            language is None
+            and "language" in parser.completed
+            and "code" in parser
+            and parser.get("language")
+        ):
+            language = parser.get("language")
+        if language is not None and "code" in parser:
+            code.append(parser.read_new("code"))
+    return "".join(code)
+
+
+def run_json_parser_benchmark(kilobytes, chunk_size=4, runs=3, old=True):
+    """
+    Times both ways of reading `kilobytes` KB of arguments, `chunk_size` characters at a time.
+    Keeps the best of `runs` (the old way only runs once, it's slow enough).
+    """
+    arguments = tool_arguments(kilobytes)
+    chunks = [
+        arguments[i : i + chunk_size] for i in range(0, len(arguments), chunk_size)
+    ]
+    expected = json.loads(arguments)["code"]
+
+    result = {
+        "kilobytes": kilobytes,
+        "characters": len(arguments),
+        "chunks": len(chunks),
+    }
+
+    for name, path, times in [
+        ("incremental", new_path, runs),
+        ("parse_partial_json", old_path, 1 if old else 0),
+    ]:
+        if not times:
+            continue
+        seconds = float("inf")
+        for _ in range(times):
+            start = time.perf_counter()
+            code = path(chunks)
+            seconds = min(seconds, time.perf_counter() - start)
+        result[name] = {
+            "seconds": round(seconds, 6),
+            "us_per_chunk": round(seconds * 1e6 / len(chunks), 3),
+            "correct": code == expected,
+        }
+
+    if "parse_partial_json" in result:
+        result["speedup"] = round(
+            result["parse_partial_json"]["seconds"] / result["incremental"]["seconds"],
+            1,
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark incremental tool call argument parsing against parse_partial_json"
+    )
+    parser.add_argument(
+        "--sizes", type=float, nargs="+", default=[1, 10, 100], help="in KB"
+    )
+    parser.add_argument("--chunk-size", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--no-old", action="store_true", help="only time the incremental parser"
+    )
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = [
+        run_json_parser_benchmark(size, args.chunk_size, args.runs, not args.no_old)
+        for size in args.sizes
+    ]
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
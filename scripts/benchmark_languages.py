@@ -0,0 +1,80 @@
+"""
+Measures how long it takes to run trivial code blocks in the subprocess languages (shell,
+JavaScript, R...), which is mostly the time spent noticing that each one has finished.
+
+    python -m scripts.benchmark_languages --runs 1000
+    python -m scripts.benchmark_languages --language javascript --code "console.log(1)"
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+
+def run_language_benchmark(language, code, runs):
+    """
+    Runs `code` `runs` times in `language` (a language instance). Returns the timings.
+    """
+    list(language.run(code))  # Start the process
+
+    seconds = []
+    outputs = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        for chunk in language.run(code):
+            if chunk.get("format") == "output":
+                outputs += 1
+        seconds.append(time.perf_counter() - start)
+
+    return {
+        "language": language.name,
+        "code": code,
+        "runs": runs,
+        "total_seconds": round(sum(seconds), 4),
+        "mean_ms": round(statistics.mean(seconds) * 1000, 3),
+        "median_ms": round(statistics.median(seconds) * 1000, 3),
+        "max_ms": round(max(seconds) * 1000, 3),
+        "output_chunks": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark running trivial code in a subprocess language"
+    )
+    parser.add_argument("--language", default="shell")
+    parser.add_argument("--code", default="echo hi")
+    parser.add_argument("--runs", type=int, default=1000)
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Imported here so --help stays fast
+    from interpreter.core.computer.terminal.languages.applescript import AppleScript
+    from interpreter.core.computer.terminal.languages.javascript import JavaScript
+    from interpreter.core.computer.terminal.languages.powershell import PowerShell
+    from interpreter.core.computer.terminal.languages.r import R
+    from interpreter.core.computer.terminal.languages.ruby import Ruby
+    from interpreter.core.computer.terminal.languages.shell import Shell
+
+    for language_class in [Shell, JavaScript, R, Ruby, PowerShell, AppleScript]:
+        names = [language_class.name] + getattr(language_class, "aliases", [])
+        if args.language.lower() in [name.lower() for name in names]:
+            break
+    else:
+        parser.error(f"Not a subprocess language: {args.language}")
+
+    language = language_class()
+    try:
+        result = run_language_benchmark(language, args.code, args.runs)
+    finally:
+        language.terminate()
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
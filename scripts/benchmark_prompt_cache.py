@@ -0,0 +1,139 @@
+"""
+Checks how much of each prompt a provider could serve from its prompt cache, as a conversation
+grows past the context window, with and without `llm.prompt_caching`'s stable trimming.
+
+It runs the same steps as `Llm.run` (trim the messages, add cache breakpoints, stream the
+completion through litellm, record the cache usage from the last chunk) against the mock LLM server
+with `echo_cache` on, which reports what a caching provider would have.
+
+    python -m scripts.benchmark_prompt_cache --turns 40 --context-window 4000
+
+`breakpoints_received` is how many cache breakpoints reached the server. (litellm drops them from
+requests to OpenAI-compatible servers, so it's 0 here even for Claude models.)
+"""
+
+import argparse
+import json
+import os
+import types
+
+from .mock_llm_server import MockLLMServer, _breakpoints, _chunks
+
+
+def text_session(words=150):
+    """
+    One long plain text answer, so the conversation grows by a few hundred tokens a turn.
+    """
+    deltas = [{"content": f"word{i} "} for i in range(words)]
+    return {"responses": [{"chunks": _chunks(deltas, "stop", 0)}]}
+
+
+def run_prompt_cache_benchmark(server, turns, context_window, model, stable):
+    """
+    Has a conversation with `server` for `turns` turns. Returns the cache usage of each request.
+    """
+    os.environ["LITELLM_LOCAL_MODEL_COST_MAP"] = "True"
+    import litellm
+
+    from interpreter.core.llm.utils.prompt_cache import (
+        add_cache_breakpoints,
+        record_cache_usage,
+    )
+    from interpreter.core.llm.utils.trim_messages import MessageTrimmer
+
+    # What record_cache_usage needs of an Llm
+    llm = types.SimpleNamespace(
+        cache_usage=None, interpreter=types.SimpleNamespace(verbose=False)
+    )
+    trimmer = MessageTrimmer()
+    system_message = "You are a helpful assistant. " * 20
+    messages = []
+    results = []
+
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Tell me about {turn}."})
+        trimmed = trimmer.trim(
+            messages,
+            system_message=system_message,
+            max_tokens=context_window,
+            model=model,
+            stable=stable,
+        )
+        params = {
+            "model": model,
+            "messages": add_cache_breakpoints(trimmed, model),
+            "api_base": server.url,
+            "api_key": "x",
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+        llm.cache_usage = None
+        content = ""
+        for chunk in litellm.completion(**params):
+            record_cache_usage(llm, chunk)
+            if chunk.choices:
+                content += chunk.choices[0].delta.content or ""
+        messages.append({"role": "assistant", "content": content})
+
+        usage = llm.cache_usage or {}
+        results.append(
+            {
+                "turn": turn + 1,
+                "messages_sent": len(trimmed),
+                "breakpoints_received": _breakpoints(server.requests[-1]),
+                "cache_hit_tokens": usage.get("cache_hit_tokens", 0),
+                "cache_miss_tokens": usage.get("cache_miss_tokens", 0),
+                "cache_write_tokens": usage.get("cache_write_tokens", 0),
+            }
+        )
+
+    return results
+
+
+def summarize(results):
+    hits = sum(r["cache_hit_tokens"] for r in results)
+    misses = sum(r["cache_miss_tokens"] for r in results)
+    return {
+        "turns": len(results),
+        "cache_hit_tokens": hits,
+        "cache_miss_tokens": misses,
+        "cache_write_tokens": sum(r["cache_write_tokens"] for r in results),
+        "cache_hit_ratio": round(hits / max(hits + misses, 1), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare prompt cache hits with and without stable trimming"
+    )
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--context-window", type=int, default=4000)
+    parser.add_argument("--model", default="openai/mock")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = MockLLMServer(text_session(), speed=0, echo_cache=True).start()
+    report = {}
+    try:
+        for name, stable in [("shifting", False), ("stable", True)]:
+            server.reset()
+            results = run_prompt_cache_benchmark(
+                server, args.turns, args.context_window, args.model, stable
+            )
+            report[name] = {"summary": summarize(results), "turns": results}
+    finally:
+        server.stop()
+
+    print(
+        json.dumps(
+            {name: result["summary"] for name, result in report.items()}, indent=2
+        )
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Measures what the websocket server sends for one streamed response, with and without chunk
+coalescing, against the mock LLM server: how many messages, how many bytes, and how long it took.
+
+    python -m scripts.benchmark_websocket --tokens 2000
+    python -m scripts.benchmark_websocket --coalesce-ms 0 20 50 --coalesce-bytes 0 512
+
+Needs the server extras (`pip install 'open-interpreter[server]'`).
+"""
+
+import argparse
+import json
+import os
+import time
+
+from .mock_llm_server import MockLLMServer, _chunks
+
+
+def text_session(tokens, delay=0):
+    """
+    A made-up session where the model just writes `tokens` words.
+    """
+    deltas = [{"content": f"word{i} "} for i in range(tokens)]
+    return {"responses": [{"chunks": _chunks(deltas, "stop", delay)}]}
+
+
+def run_websocket_benchmark(async_interpreter, coalesce_ms=None, coalesce_bytes=None):
+    """
+    Sends one message over the websocket and reads the response. Returns what was received.
+    """
+    from starlette.testclient import TestClient
+
+    async_interpreter.messages = []
+    # Each TestClient runs its own event loop, and the output queue belongs to the one that made it
+    async_interpreter.output_queue = None
+    async_interpreter.coalesce_ms = coalesce_ms or None
+    async_interpreter.coalesce_bytes = coalesce_bytes or None
+
+    client = TestClient(async_interpreter.server.app)
+    with client.websocket_connect("/") as websocket:
+        websocket.send_text(json.dumps({"auth": os.getenv("INTERPRETER_API_KEY")}))
+        websocket.receive_text()
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for chunk in [
+            {"role": "user", "type": "message", "start": True},
+            {"role": "user", "type": "message", "content": "Say something."},
+            {"role": "user", "type": "message", "end": True},
+        ]:
+            websocket.send_text(json.dumps(chunk))
+
+        messages = 0
+        received_bytes = 0
+        content = ""
+        while True:
+            text = websocket.receive_text()
+            messages += 1
+            received_bytes += len(text)
+            chunk = json.loads(text)
+            if chunk.get("role") == "server":
+                break
+            if chunk.get("type") == "message" and isinstance(chunk.get("content"), str):
+                content += chunk["content"]
+
+        seconds = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+
+    return {
+        "coalesce_ms": coalesce_ms or None,
+        "coalesce_bytes": coalesce_bytes or None,
+        "seconds": round(seconds, 4),
+        "cpu_seconds": round(cpu, 4),
+        "websocket_messages": messages,
+        "websocket_bytes": received_bytes,
+        "messages_per_second": round(messages / seconds, 1),
+        "content_chars_per_second": round(len(content) / seconds, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark websocket output with and without chunk coalescing"
+    )
+    parser.add_argument("--tokens", type=int, default=2000)
+    parser.add_argument(
+        "--delay", type=float, default=0, help="seconds between LLM chunks"
+    )
+    parser.add_argument("--coalesce-ms", type=float, nargs="+", default=[0, 20])
+    parser.add_argument("--coalesce-bytes", type=int, nargs="+", default=[0, 512])
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # Imported here so --help stays fast
+    from interpreter import AsyncInterpreter
+
+    server = MockLLMServer(text_session(args.tokens, args.delay)).start()
+    async_interpreter = AsyncInterpreter()
+    async_interpreter.llm.model = "openai/mock"
+    async_interpreter.llm.api_base = server.url
+    async_interpreter.llm.api_key = "x"
+    async_interpreter.llm.supports_functions = True
+    async_interpreter.llm.supports_vision = False
+    async_interpreter.llm.context_window = 100000
+    async_interpreter.llm.max_tokens = 1000
+    async_interpreter.disable_telemetry = True
+
+    results = []
+    try:
+        for coalesce_ms in args.coalesce_ms:
+            for coalesce_bytes in args.coalesce_bytes:
+                server.reset()
+                results.append(
+                    run_websocket_benchmark(
+                        async_interpreter, coalesce_ms, coalesce_bytes
+                    )
+                )
+    finally:
+        async_interpreter.computer.terminate()
+        server.stop()
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""
+A local, OpenAI-compatible stand-in for an LLM provider, for testing and benchmarking without a network.
+
+It replays recorded sessions: each request gets the next recorded response, streamed with the
+same gaps between chunks as when it was recorded (scaled by `speed`). Record a session with
+`record_session`, then point the interpreter at the server:
+
+    server = MockLLMServer("session.json").start()
+    interpreter.llm.model = "openai/mock"
+    interpreter.llm.api_base = server.url
+    interpreter.llm.api_key = "x"
+
+Without a fixture, it replays `scripted_session()`, which runs a little Python and then answers.
+
+With `echo_cache`, it also acts like a provider with prompt caching: it reports how much of each
+prompt it would have had cached (see `_cache_usage`) in the stream's final `usage` chunk, and echoes
+that and the cache breakpoints it was sent in `X-Mock-*` response headers.
+
+Run it on its own with `python -m scripts.mock_llm_server [fixture.json] [--port 8000] [--speed 1]`.
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients dropping kept-alive connections isn't worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class MockLLMServer:
+    def __init__(
+        self,
+        fixture=None,
+        host="127.0.0.1",
+        port=0,
+        speed=1.0,
+        loop=True,
+        echo_cache=False,
+    ):
+        """
+        `fixture` is a path to a recorded session, or an already loaded one.
+        `speed` scales the recorded delays (0 sends every chunk immediately).
+        With `loop`, the responses start over once they've all been sent.
+        With `echo_cache`, prompt cache usage is simulated and reported.
+        """
+        if fixture is None:
+            fixture = scripted_session()
+        elif isinstance(fixture, str):
+            with open(fixture, "r") as f:
+                fixture = json.load(f)
+
+        self.responses = fixture["responses"]
+        self.speed = speed
+        self.loop = loop
+        self.echo_cache = echo_cache
+        self.requests = []  # Every request body we've received, in order
+
+        self._next = 0
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self):
+        with self._lock:
+            self._next = 0
+            self.requests = []
+
+    def next_response(self, request):
+        """
+        Returns the next recorded response, and the cache usage for `request` (or None).
+        """
+        with self._lock:
+            previous = self.requests[-1] if self.requests else None
+            self.requests.append(request)
+            usage = _cache_usage(request, previous) if self.echo_cache else None
+            if self._next >= len(self.responses):
+                if not self.loop:
+                    return None, usage
+                self._next = 0
+            response = self.responses[self._next]
+            self._next += 1
+            return response, usage
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(
+                        200,
+                        {"object": "list", "data": [{"id": "mock", "object": "model"}]},
+                    )
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    request = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": {"message": "Invalid JSON"}})
+                    return
+
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "Not found"}})
+                    return
+
+                response, usage = server.next_response(request)
+                if response is None:
+                    self._send_json(
+                        500, {"error": {"message": "No more recorded responses"}}
+                    )
+                    return
+
+                recorded = response["chunks"]
+                chunks = [_with_defaults(chunk["chunk"], request) for chunk in recorded]
+                headers = {}
+                if usage is not None:
+                    headers = {
+                        "X-Mock-Cache-Breakpoints": str(_breakpoints(request)),
+                        "X-Mock-Prompt-Tokens": str(usage["prompt_tokens"]),
+                        "X-Mock-Cached-Tokens": str(_cached_tokens(usage)),
+                    }
+                    if (request.get("stream_options") or {}).get("include_usage"):
+                        recorded = recorded + [{"delay": 0}]
+                        chunks.append(
+                            _with_defaults({"choices": [], "usage": usage}, request)
+                        )
+                if request.get("stream"):
+                    self._stream(recorded, chunks, headers)
+                else:
+                    response = _combine(chunks)
+                    if usage is not None:
+                        response["usage"] = usage
+                    self._send_json(200, response, headers)
+
+            def _stream(self, recorded, chunks, headers):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    for recorded_chunk, chunk in zip(recorded, chunks):
+                        delay = recorded_chunk.get("delay", 0) * server.speed
+                        if delay > 0:
+                            time.sleep(delay)
+                        self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                    self._write_chunk("data: [DONE]\n\n")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. after a code block ended
+                    pass
+
+            def _write_chunk(self, text):
+                data = text.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def record_session(interpreter, path):
+    """
+    Wraps `interpreter.llm.completions` so every response it streams is saved to `path`,
+    along with the gaps between chunks. Returns a function that stops recording.
+    """
+    completions = interpreter.llm.completions
+    session = {"responses": []}
+
+    def save():
+        with open(path, "w") as f:
+            json.dump(session, f, indent=2)
+
+    def recording_completions(**params):
+        response = {"chunks": []}
+        session["responses"].append(response)
+        last = time.perf_counter()
+        try:
+            for chunk in completions(**params):
+                now = time.perf_counter()
+                response["chunks"].append(
+                    {"delay": round(now - last, 4), "chunk": _to_dict(chunk)}
+                )
+                last = now
+                yield chunk
+        finally:
+            save()
+
+    interpreter.llm.completions = recording_completions
+
+    def stop():
+        interpreter.llm.completions = completions
+        save()
+
+    return stop
+
+
+def scripted_session(turns=1, code="print(sum(range(10)))", delay=0.01):
+    """
+    A made-up session for when there's nothing recorded: for each turn, the model runs `code`
+    with a tool call, then writes a short answer.
+    """
+    responses = []
+    for turn in range(turns):
+        arguments = json.dumps({"language": "python", "code": code})
+        tool_chunks = [
+            {
+                "tool_calls": [
+                    {
+                        "index": 0,
+                        "id": f"call_{turn}",
+                        "type": "function",
+                        "function": {"name": "execute", "arguments": ""},
+                    }
+                ]
+            }
+        ]
+        for i in range(0, len(arguments), 4):
+            tool_chunks.append(
+                {
+                    "tool_calls": [
+                        {"index": 0, "function": {"arguments": arguments[i : i + 4]}}
+                    ]
+                }
+            )
+        responses.append({"chunks": _chunks(tool_chunks, "tool_calls", delay)})
+
+        words = (
+            f"The code ran, and its output is above. That was turn {turn + 1}.".split(
+                " "
+            )
+        )
+        text_chunks = [{"content": word + " "} for word in words]
+        responses.append({"chunks": _chunks(text_chunks, "stop", delay)})
+
+    return {"responses": responses}
+
+
+def _chunks(deltas, finish_reason, delay):
+    chunks = []
+    for i, delta in enumerate(deltas):
+        if i == 0:
+            delta = {"role": "assistant", **delta}
+        chunks.append(
+            {
+                "delay": delay,
+                "chunk": {
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+                },
+            }
+        )
+    chunks.append(
+        {
+            "delay": delay,
+            "chunk": {
+                "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]
+            },
+        }
+    )
+    return chunks
+
+
+def _to_dict(chunk):
+    if hasattr(chunk, "model_dump"):
+        return chunk.model_dump(exclude_none=True)
+    if hasattr(chunk, "json"):
+        return json.loads(chunk.json())
+    return dict(chunk)
+
+
+def _with_defaults(chunk, request):
+    chunk = dict(chunk)
+    chunk.setdefault("id", "chatcmpl-mock")
+    chunk["object"] = "chat.completion.chunk"
+    chunk.setdefault("created", 0)
+    chunk["model"] = request.get("model", "mock")
+    return chunk
+
+
+def _cache_usage(request, previous):
+    """
+    Roughly what a provider with prompt caching would report for `request`, if `previous` was the
+    request before it. Tokens are estimated as 4 characters each.
+
+    With cache breakpoints (Anthropic-style `cache_control`), the prompt up to the last breakpoint
+    that's still the same as last time is a cache hit, and the rest up to the last breakpoint is
+    written to the cache. Without them (OpenAI-style), the same prefix is cached automatically,
+    in 128 token steps once it's at least 1024 tokens.
+    """
+    messages = [_without_cache_control(m) for m in request.get("messages", [])]
+    sizes = [len(json.dumps(m)) // 4 for m in messages]
+    prompt_tokens = sum(sizes)
+
+    same = 0
+    if previous is not None:
+        previous_messages = [
+            _without_cache_control(m) for m in previous.get("messages", [])
+        ]
+        for message, previous_message in zip(messages, previous_messages):
+            if message != previous_message:
+                break
+            same += 1
+
+    breakpoints = [
+        i
+        for i, message in enumerate(request.get("messages", []))
+        if "cache_control" in json.dumps(message)
+    ]
+    if breakpoints:
+        hit = max([i + 1 for i in breakpoints if i < same], default=0)
+        cached = sum(sizes[:hit])
+        written = sum(sizes[: breakpoints[-1] + 1]) - cached
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 0,
+            "total_tokens": prompt_tokens,
+            "cache_read_input_tokens": cached,
+            "cache_creation_input_tokens": written,
+        }
+
+    cached = sum(sizes[:same])
+    cached = cached // 128 * 128 if cached >= 1024 else 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": 0,
+        "total_tokens": prompt_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached},
+    }
+
+
+def _cached_tokens(usage):
+    if "cache_read_input_tokens" in usage:
+        return usage["cache_read_input_tokens"]
+    return usage["prompt_tokens_details"]["cached_tokens"]
+
+
+def _breakpoints(request):
+    return sum(
+        "cache_control" in json.dumps(message)
+        for message in request.get("messages", [])
+    )
+
+
+def _without_cache_control(message):
+    content = message.get("content")
+    if isinstance(content, list):
+        message = dict(message)
+        message["content"] = [
+            {k: v for k, v in part.items() if k != "cache_control"}
+            if isinstance(part, dict)
+            else part
+            for part in content
+        ]
+        if len(message["content"]) == 1 and message["content"][0].get("type") == "text":
+            # The same as a plain string, for comparing with requests without breakpoints
+            message["content"] = message["content"][0]["text"]
+    return message
+
+
+def _combine(chunks):
+    """
+    Turns streamed chunks into a single non-streaming response.
+    """
+    content = ""
+    tool_calls = {}
+    finish_reason = "stop"
+    for chunk in chunks:
+        for choice in chunk.get("choices", []):
+            delta = choice.get("delta", {})
+            content += delta.get("content") or ""
+            for tool_call in delta.get("tool_calls") or []:
+                merged = tool_calls.setdefault(
+                    tool_call.get("index", 0),
+                    {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    },
+                )
+                merged["id"] = tool_call.get("id") or merged["id"]
+                function = tool_call.get("function", {})
+                merged["function"]["name"] += function.get("name") or ""
+                merged["function"]["arguments"] += function.get("arguments") or ""
+            finish_reason = choice.get("finish_reason") or finish_reason
+
+    message = {"role": "assistant", "content": content or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": 0,
+        "model": chunks[0]["model"] if chunks else "mock",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve recorded LLM sessions locally")
+    parser.add_argument("fixture", nargs="?", help="a recorded session (JSON)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="scales the recorded delays"
+    )
+    parser.add_argument(
+        "--echo-cache",
+        action="store_true",
+        help="simulate prompt caching and report it in usage and headers",
+    )
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.fixture, args.host, args.port, args.speed, echo_cache=args.echo_cache
+    )
+    print(f"Serving at {server.url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import time
+
+from interpreter.core.utils.coalesce_chunks import coalesce_chunks
+
+
+def respond(ran):
+    # Like respond(): some output, then a confirmation before running code
+    for i in range(5):
+        yield {
+            "role": "computer",
+            "type": "console",
+            "format": "output",
+            "content": f"{i}",
+        }
+    yield {
+        "role": "computer",
+        "type": "confirmation",
+        "format": "execution",
+        "content": {"type": "code", "format": "python", "content": "print(1)"},
+    }
+    ran.append("CODE RAN")
+    yield {"role": "computer", "type": "console", "format": "output", "content": "1"}
+
+
+def test_rejected_confirmation_stops_the_code():
+    for max_ms, max_bytes in [(None, None), (20, None), (None, 512), (20, 512)]:
+        ran = []
+        for chunk in coalesce_chunks(respond(ran), max_ms, max_bytes):
+            if chunk["type"] == "confirmation":
+                break
+        time.sleep(0.05)
+        assert ran == []
+
+
+def test_accepted_confirmation_runs_the_code():
+    ran = []
+    chunks = list(coalesce_chunks(respond(ran), 20, 512))
+    assert ran == ["CODE RAN"]
+    assert [c["type"] for c in chunks] == ["console", "confirmation", "console"]
+    assert chunks[0]["content"] == "01234"
+
+
+def test_partial_chunk_is_sent_when_its_time_is_up():
+    def slow():
+        yield {"role": "assistant", "type": "message", "content": "a"}
+        time.sleep(1)
+        yield {"role": "assistant", "type": "message", "content": "b"}
+
+    start = time.perf_counter()
+    for chunk in coalesce_chunks(slow(), 50):
+        assert chunk["content"] == "a"
+        assert time.perf_counter() - start < 0.5
+        break